@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Autocomplete lookup latency of the indexed ORM query against the
+per-prefix result cache and the in-process prefix index, over an
+in-memory SQLite user table.
+
+    python benchmarks/autocomplete.py [users]
+"""
+import os
+import sys
+import timeit
+
+import django
+from django.conf import settings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from runtests import DEFAULT_SETTINGS  # noqa: E402
+
+settings.configure(**DEFAULT_SETTINGS)
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+
+from pinax.teams.models import Team  # noqa: E402
+from pinax.teams.search import (  # noqa: E402
+    autocomplete_cache,
+    autocomplete_queryset,
+    index_users,
+    prefix_index,
+)
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+N = 100
+QUERIES = ["us", "user1", "user12345", "first9", "nomatch"]
+
+
+def report(name, seconds):
+    print(f"{name:<28} {seconds / N * 1e6:10.1f} us/lookup")
+
+
+def main():
+    call_command("migrate", verbosity=0)
+    User.objects.bulk_create([
+        User(username=f"user{i}", first_name=f"First{i}", last_name=f"Last{i}", email=f"user{i}@example.com")
+        for i in range(USERS)
+    ], batch_size=1000)
+    users = list(User.objects.all())
+    for i in range(0, len(users), 1000):
+        index_users(users[i:i + 1000])
+    owner = users[0]
+    team = Team.objects.create(name="Eldarion", creator=owner, member_access="open", manager_access="add someone")
+
+    def orm(q):
+        return list(autocomplete_queryset(q, team, owner))
+
+    def cached(q):
+        return autocomplete_cache.search(q, team, owner)
+
+    def indexed(q):
+        return prefix_index.search(q, team, owner)
+
+    indexed("us")
+    print(f"{USERS} users")
+    for q in QUERIES:
+        print(repr(q))
+        report("ORM (term table)", timeit.timeit(lambda: orm(q), number=N))
+        report("result cache", timeit.timeit(lambda: cached(q), number=N))
+        report("prefix index", timeit.timeit(lambda: indexed(q), number=N))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Per-request overhead of the WSGI and ASGI team middlewares and of the
+anonymous allow-list check, compared with the previous uncompiled regexes.
+
+    python benchmarks/middleware.py
+"""
+import asyncio
+import os
+import re
+import sys
+import timeit
+
+from django.conf import settings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+settings.configure()
+
+from pinax.teams.asgi_middleware import ASGITeamMiddleware  # noqa: E402
+from pinax.teams.routing import is_allowed_path  # noqa: E402
+from pinax.teams.wsgi_middleware import WSGITeamMiddleware  # noqa: E402
+
+N = 200000
+PATHS = [
+    "/teams/eldarion/account/password/reset/",
+    "/teams/eldarion/manage/",
+    "/about/",
+]
+
+
+def legacy_wsgi(environ):
+    m = re.match(r"(/teams/([\w-]+))(.*)", environ["PATH_INFO"])
+    if m:
+        environ["SCRIPT_NAME"] = m.group(1)
+        environ["PATH_INFO"] = m.group(3)
+        environ["pinax.team"] = m.group(2)
+
+
+def legacy_allowed(path):
+    allowed = [
+        r"^/teams/[\w-]+/account/login/$",
+        r"^/teams/[\w-]+/account/signup/",
+        r"^/teams/[\w-]+/ajax/username-validation/",
+        r"^/teams/[\w-]+/account/password/reset/",
+    ]
+    for allow_re in allowed:
+        if re.search(allow_re, path):
+            return True
+    return False
+
+
+def report(name, seconds):
+    print(f"{name:<28} {seconds / N * 1e9:8.0f} ns/request")
+
+
+def main():
+    wsgi = WSGITeamMiddleware(lambda environ, start_response: None)
+
+    async def app(scope, receive, send):
+        pass
+
+    asgi = ASGITeamMiddleware(app)
+    loop = asyncio.new_event_loop()
+
+    for path in PATHS:
+        print(path)
+        report("legacy wsgi routing", timeit.timeit(lambda: legacy_wsgi({"PATH_INFO": path}), number=N))
+        report("WSGITeamMiddleware", timeit.timeit(lambda: wsgi({"PATH_INFO": path}, None), number=N))
+        scope = {"type": "http", "path": path, "root_path": ""}
+        report("bare ASGI app", timeit.timeit(
+            lambda: loop.run_until_complete(app(scope, None, None)), number=N // 10
+        ) * 10)
+        report("ASGITeamMiddleware", timeit.timeit(
+            lambda: loop.run_until_complete(asgi(scope, None, None)), number=N // 10
+        ) * 10)
+        report("legacy allow-list", timeit.timeit(lambda: legacy_allowed(path), number=N))
+        report("compiled allow-list", timeit.timeit(lambda: is_allowed_path(path), number=N))
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
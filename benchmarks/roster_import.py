@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+Rows per second of import_roster on an in-memory SQLite database, for rows
+that create memberships, leave them unchanged and update them.
+
+    python benchmarks/roster_import.py [rows]
+"""
+import os
+import sys
+import time
+
+import django
+from django.conf import settings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from runtests import DEFAULT_SETTINGS  # noqa: E402
+
+settings.configure(**DEFAULT_SETTINGS)
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+
+from pinax.teams.models import Membership, Team  # noqa: E402
+from pinax.teams.roster import import_roster  # noqa: E402
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+
+def report(name, rows, inviter, team):
+    start = time.perf_counter()
+    results = import_roster(team, rows, inviter)
+    seconds = time.perf_counter() - start
+    print(f"{name:<12} {len(rows) / seconds:10.0f} rows/s  {dict(results)}")
+
+
+def main():
+    call_command("migrate", verbosity=0)
+    User.objects.bulk_create([User(username=f"user{i}") for i in range(ROWS + 1)], batch_size=1000)
+    owner = User.objects.get(username="user0")
+    team = Team.objects.create(name="Eldarion", creator=owner, member_access="open", manager_access="add someone")
+    rows = [{"username": f"user{i}"} for i in range(1, ROWS + 1)]
+    print(f"{ROWS} rows")
+    report("created", rows, owner, team)
+    report("unchanged", rows, owner, team)
+    report("updated", [dict(row, role=Membership.ROLE_MANAGER) for row in rows], owner, team)
+
+
+if __name__ == "__main__":
+    main()
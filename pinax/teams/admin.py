@@ -3,12 +3,13 @@ from django.utils.translation import gettext_lazy as _
 
 from reversion.admin import VersionAdmin
 
+from .history import uses_reversion
 from .hooks import hookset
-from .models import Membership, Team
+from .models import Membership, MembershipEvent, OutboxMessage, Team
 
 
 def members_count(obj):
-    return obj.memberships.count()
+    return obj.member_count + obj.manager_count + obj.owner_count
 
 
 members_count.short_description = _("Members Count")
@@ -24,6 +25,7 @@ admin.site.register(
         "description",
         "member_access",
         "manager_access",
+        "capacity",
         "creator"
     ],
     prepopulated_fields={"slug": ("name",)},
@@ -31,7 +33,9 @@ admin.site.register(
 )
 
 
-class MembershipAdmin(VersionAdmin):
+# without django-reversion history, VersionAdmin would register the model
+# with it again
+class MembershipAdmin(VersionAdmin if uses_reversion() else admin.ModelAdmin):
     raw_id_fields = ["user"]
     list_display = ["team", "user", "state", "role"]
     list_filter = ["team"]
@@ -39,3 +43,19 @@ class MembershipAdmin(VersionAdmin):
 
 
 admin.site.register(Membership, MembershipAdmin)
+
+
+admin.site.register(
+    OutboxMessage,
+    list_display=["invite", "state", "attempts", "next_attempt", "sent"],
+    list_filter=["state"],
+    raw_id_fields=["invite"]
+)
+
+
+admin.site.register(
+    MembershipEvent,
+    list_display=["action", "membership_type", "membership_pk", "team_pk", "user", "state", "role", "by", "created"],
+    list_filter=["action", "membership_type"],
+    raw_id_fields=["user", "by"]
+)
@@ -0,0 +1,28 @@
+# @@@ separate asgi middlewares from django middlewares
+# to avoid app loading errors
+from .routing import match_team_path
+
+
+class ASGITeamMiddleware():
+    """
+    ASGI counterpart of WSGITeamMiddleware: moves the /teams/<slug> prefix
+    into scope["root_path"] and sets scope["pinax.team"] to the slug.
+    scope["path"] keeps the full path, as the ASGI spec requires.
+    """
+
+    def __init__(self, application):
+        self.app = application
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            root_path, path = scope.get("root_path", ""), scope["path"]
+            if root_path and path.startswith(root_path):
+                path = path[len(root_path):]
+            m = match_team_path(path)
+            if m:
+                script_name, slug, path_info = m
+                scope = dict(scope)
+                scope["root_path"] = root_path + script_name
+                scope["path"] = scope["root_path"] + path_info
+                scope["pinax.team"] = slug
+        return await self.app(scope, receive, send)
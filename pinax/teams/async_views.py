@@ -0,0 +1,169 @@
+"""
+Async counterparts of the team views for sites served over ASGI; include
+pinax.teams.async_urls instead of pinax.teams.urls to use them. Reads go
+through the async ORM and cache APIs, writes keep their transactions in a
+single sync_to_async hop. Requires Django 4.1 or later.
+"""
+from functools import WRAPPER_ASSIGNMENTS, wraps
+
+from django.contrib import messages
+from django.http import Http404, JsonResponse
+from django.shortcuts import redirect, render
+
+from account.utils import handle_redirect_to_login
+from asgiref.sync import sync_to_async
+
+from .cache import team_cache
+from .conf import settings
+from .forms import TeamInviteUserForm
+from .hooks import hookset
+from .models import Membership, Team
+from .search import autocomplete_queryset, autocomplete_results
+from .utils import (
+    aget_user,
+    set_request_team,
+    team_list_context,
+    team_list_queryset,
+)
+
+MESSAGE_STRINGS = hookset.get_message_strings()
+
+
+def login_required(view_func):
+    """
+    Async counterpart of account.decorators.login_required
+    """
+    @wraps(view_func, assigned=WRAPPER_ASSIGNMENTS)
+    async def _wrapped_view(request, *args, **kwargs):
+        request.user = await aget_user(request)
+        if not request.user.is_authenticated:
+            return handle_redirect_to_login(request, redirect_field_name="next")
+        return await view_func(request, *args, **kwargs)
+    return _wrapped_view
+
+
+def team_required(view_func):
+    """
+    Async counterpart of pinax.teams.decorators.team_required
+    """
+    @wraps(view_func, assigned=WRAPPER_ASSIGNMENTS)
+    async def _wrapped_view(request, *args, **kwargs):
+        slug = kwargs.pop("slug", None)
+        if not getattr(request, "team", None):
+            try:
+                team = await team_cache.aget(slug)
+            except Team.DoesNotExist:
+                raise Http404()
+            set_request_team(request, team)
+        elif not getattr(request, "team_membership", None):
+            set_request_team(request, request.team)
+        return await view_func(request, *args, **kwargs)
+    return _wrapped_view
+
+
+def manager_required(view_func):
+    """
+    Async counterpart of pinax.teams.decorators.manager_required
+    """
+    @team_required
+    @login_required
+    @wraps(view_func, assigned=WRAPPER_ASSIGNMENTS)
+    async def _wrapped_view(request, *args, **kwargs):
+        snapshot = await request.team_membership.aresolve()
+        if not snapshot.can_manage:
+            raise Http404()
+        return await view_func(request, *args, **kwargs)
+    return _wrapped_view
+
+
+async def arender(request, template_name, context):
+    # templates may follow relations lazily, which the ORM only allows
+    # outside the event loop
+    return await sync_to_async(render)(request, template_name, context)
+
+
+async def team_list(request):
+    request.user = await aget_user(request)
+    page_size = settings.PINAX_TEAMS_TEAM_LIST_PAGE_SIZE
+    teams = [team async for team in team_list_queryset(request.GET)[:page_size + 1]]
+    return await arender(request, "pinax/teams/team_list.html", team_list_context(request.GET, teams))
+
+
+@team_required
+async def team_detail(request):
+    request.user = await aget_user(request)
+    team = request.team
+    snapshot = await request.team_membership.aresolve()
+    return await arender(request, "pinax/teams/team_detail.html", {
+        "team": team,
+        "object": team,
+        "team_membership": snapshot,
+        "state": snapshot.state,
+        "role": snapshot.role,
+        "invite_form": TeamInviteUserForm(team=team),
+        "can_join": snapshot.can_join,
+        "can_leave": snapshot.can_leave,
+        "can_apply": snapshot.can_apply,
+    })
+
+
+@team_required
+@login_required
+async def team_join(request):
+    team = request.team
+    snapshot = await request.team_membership.aresolve()
+
+    if not snapshot.can_view:
+        raise Http404()
+
+    if snapshot.can_join and request.method == "POST":
+        membership = await sync_to_async(team.join)(request.user)
+        if membership.state == Membership.STATE_WAITLISTED:
+            messages.success(request, MESSAGE_STRINGS["joined-waitlist"])
+        else:
+            messages.success(request, MESSAGE_STRINGS["joined-team"])
+    return redirect(team.get_absolute_url())
+
+
+@team_required
+@login_required
+async def team_leave(request):
+    team = request.team
+    snapshot = await request.team_membership.aresolve()
+    if not snapshot.can_view:
+        raise Http404()
+
+    if snapshot.can_leave and request.method == "POST":
+        await sync_to_async(snapshot.membership.leave)()
+        messages.success(request, MESSAGE_STRINGS["left-team"])
+        return redirect("pinax_teams:dashboard")
+    else:
+        return redirect(team.get_absolute_url())
+
+
+@team_required
+@login_required
+async def team_apply(request):
+    team = request.team
+    snapshot = await request.team_membership.aresolve()
+    if not snapshot.can_view:
+        raise Http404()
+
+    if snapshot.can_apply and request.method == "POST":
+        await sync_to_async(team.apply)(request.user)
+        messages.success(request, MESSAGE_STRINGS["applied-to-join"])
+    return redirect(team.get_absolute_url())
+
+
+@manager_required
+async def autocomplete_users(request):
+    if settings.PINAX_TEAMS_AUTOCOMPLETE_INDEX or settings.PINAX_TEAMS_AUTOCOMPLETE_CACHE:
+        return JsonResponse({
+            "users": await sync_to_async(autocomplete_results)(
+                request.GET.get("q", ""), request.team, request.user
+            )
+        })
+    users = autocomplete_queryset(request.GET.get("q", ""), request.team, request.user)
+    return JsonResponse({
+        "users": [hookset.get_autocomplete_result(u) async for u in users]
+    })
@@ -0,0 +1,216 @@
+import collections
+import copy
+import threading
+import uuid
+
+from django.core.cache import cache
+
+from .conf import settings
+from .models import Membership, Team
+
+
+class TeamCache:
+    """
+    Two-level cache of teams keyed by slug: a bounded in-process LRU in front
+    of Django's cache backend. Each slug has a version key in the shared
+    cache which is replaced whenever the team is saved or deleted, so stale
+    entries at either level are never served. The membership counters
+    change with UPDATEs that skip save(), so they are left out of the
+    cached copy and read from the database when accessed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = collections.OrderedDict()
+        self.stats = collections.Counter()
+
+    def version_key(self, slug):
+        return f"pinax-teams:team-version:{slug}"
+
+    def team_key(self, slug, version):
+        return f"pinax-teams:team:{slug}:{version}"
+
+    def get_version(self, slug):
+        key = self.version_key(slug)
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, uuid.uuid4().hex, None)
+            version = cache.get(key)
+        return version
+
+    async def aget_version(self, slug):
+        key = self.version_key(slug)
+        version = await cache.aget(key)
+        if version is None:
+            await cache.aadd(key, uuid.uuid4().hex, None)
+            version = await cache.aget(key)
+        return version
+
+    def queryset(self):
+        return Team.objects.defer(*Team.count_filters())
+
+    def get_local(self, slug, version):
+        with self.lock:
+            entry = self.local.get(slug)
+            if entry is not None and entry[0] == version:
+                self.local.move_to_end(slug)
+                self.stats["local_hits"] += 1
+                return copy.copy(entry[1])
+
+    def set_local(self, slug, version, team):
+        with self.lock:
+            self.local[slug] = (version, team)
+            self.local.move_to_end(slug)
+            while len(self.local) > settings.PINAX_TEAMS_TEAM_CACHE_SIZE:
+                self.local.popitem(last=False)
+        return copy.copy(team)
+
+    def get(self, slug):
+        """
+        Returns a private copy of the team with the given slug, raising
+        Team.DoesNotExist as Team.objects.get() would
+        """
+        if not settings.PINAX_TEAMS_TEAM_CACHE:
+            return Team.objects.get(slug=slug)
+        version = self.get_version(slug)
+        team = self.get_local(slug, version)
+        if team is not None:
+            return team
+        team = cache.get(self.team_key(slug, version))
+        if team is None:
+            self.stats["misses"] += 1
+            team = self.queryset().get(slug=slug)
+            cache.set(self.team_key(slug, version), team, settings.PINAX_TEAMS_TEAM_CACHE_TIMEOUT)
+        else:
+            self.stats["shared_hits"] += 1
+        return self.set_local(slug, version, team)
+
+    async def aget(self, slug):
+        """
+        Async counterpart of get()
+        """
+        if not settings.PINAX_TEAMS_TEAM_CACHE:
+            return await Team.objects.aget(slug=slug)
+        version = await self.aget_version(slug)
+        team = self.get_local(slug, version)
+        if team is not None:
+            return team
+        team = await cache.aget(self.team_key(slug, version))
+        if team is None:
+            self.stats["misses"] += 1
+            team = await self.queryset().aget(slug=slug)
+            await cache.aset(self.team_key(slug, version), team, settings.PINAX_TEAMS_TEAM_CACHE_TIMEOUT)
+        else:
+            self.stats["shared_hits"] += 1
+        return self.set_local(slug, version, team)
+
+    def invalidate(self, slug):
+        cache.set(self.version_key(slug), uuid.uuid4().hex, None)
+        with self.lock:
+            self.local.pop(slug, None)
+
+    def clear(self):
+        with self.lock:
+            self.local.clear()
+            self.stats.clear()
+
+
+class UserTeamsCache:
+    """
+    Caches the profiles behind request.user.teams and request.profile per
+    user. Each user has a version key which is replaced whenever one of
+    their memberships or profiles changes.
+    """
+
+    def version_key(self, user_pk):
+        return f"pinax-teams:user-version:{user_pk}"
+
+    def get_version(self, user_pk):
+        key = self.version_key(user_pk)
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, uuid.uuid4().hex, None)
+            version = cache.get(key)
+        return version
+
+    async def aget_version(self, user_pk):
+        key = self.version_key(user_pk)
+        version = await cache.aget(key)
+        if version is None:
+            await cache.aadd(key, uuid.uuid4().hex, None)
+            version = await cache.aget(key)
+        return version
+
+    def teams_queryset(self, user):
+        return settings.PINAX_TEAMS_PROFILE_MODEL.objects.filter(
+            user=user,
+            team__isnull=False,
+            team__memberships__user=user,
+            team__memberships__state__in=[
+                Membership.STATE_ACCEPTED,
+                Membership.STATE_AUTO_JOINED
+            ]
+        ).distinct()
+
+    def evaluated(self, queryset, teams):
+        # a queryset whose results come from the cache; chaining further
+        # methods onto it still queries the database
+        queryset._result_cache = teams
+        queryset._prefetch_done = True
+        return queryset
+
+    def get_teams(self, user):
+        """
+        Returns the user's profiles on teams they belong to as a queryset,
+        evaluated from the cache when it holds them
+        """
+        key = f"pinax-teams:user-teams:{user.pk}:{self.get_version(user.pk)}"
+        teams = cache.get(key)
+        if teams is None:
+            teams = list(self.teams_queryset(user))
+            cache.set(key, teams, settings.PINAX_TEAMS_USER_TEAMS_CACHE_TIMEOUT)
+        return self.evaluated(self.teams_queryset(user), teams)
+
+    async def aget_teams(self, user):
+        key = f"pinax-teams:user-teams:{user.pk}:{await self.aget_version(user.pk)}"
+        teams = await cache.aget(key)
+        if teams is None:
+            teams = [profile async for profile in self.teams_queryset(user)]
+            await cache.aset(key, teams, settings.PINAX_TEAMS_USER_TEAMS_CACHE_TIMEOUT)
+        return self.evaluated(self.teams_queryset(user), teams)
+
+    def get_profile(self, user, team):
+        """
+        Returns the user's profile for team, or None if there is none
+        """
+        team_pk = team.pk if team is not None else None
+        key = f"pinax-teams:user-profile:{user.pk}:{team_pk}:{self.get_version(user.pk)}"
+        profile = cache.get(key)
+        if profile is None:
+            profile_model = settings.PINAX_TEAMS_PROFILE_MODEL
+            try:
+                profile = profile_model.objects.get(user=user, team=team)
+            except profile_model.DoesNotExist:
+                profile = False
+            cache.set(key, profile, settings.PINAX_TEAMS_USER_TEAMS_CACHE_TIMEOUT)
+        return profile or None
+
+    async def aget_profile(self, user, team):
+        team_pk = team.pk if team is not None else None
+        key = f"pinax-teams:user-profile:{user.pk}:{team_pk}:{await self.aget_version(user.pk)}"
+        profile = await cache.aget(key)
+        if profile is None:
+            profile_model = settings.PINAX_TEAMS_PROFILE_MODEL
+            try:
+                profile = await profile_model.objects.aget(user=user, team=team)
+            except profile_model.DoesNotExist:
+                profile = False
+            await cache.aset(key, profile, settings.PINAX_TEAMS_USER_TEAMS_CACHE_TIMEOUT)
+        return profile or None
+
+    def invalidate(self, user_pks):
+        cache.set_many({self.version_key(pk): uuid.uuid4().hex for pk in user_pks}, None)
+
+
+team_cache = TeamCache()
+user_teams_cache = UserTeamsCache()
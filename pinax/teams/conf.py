@@ -5,6 +5,8 @@ from django.core.exceptions import ImproperlyConfigured
 
 from appconf import AppConf
 
+from .routing import DEFAULT_ALLOWED_PATHS
+
 
 def load_path_attr(path):
     i = path.rfind(".")
@@ -25,6 +27,29 @@ class TeamAppConf(AppConf):
     PROFILE_MODEL = ""
     HOOKSET = "pinax.teams.hooks.TeamDefaultHookset"
     NAME_BLACKLIST = []
+    AVAILABLE_TEAMS_CACHE_TIMEOUT = None
+    INVITE_OUTBOX = False
+    BULK_INVITE_MAX = 500
+    TEAM_CACHE = True
+    TEAM_CACHE_SIZE = 1000
+    TEAM_CACHE_TIMEOUT = 300
+    USER_TEAMS_CACHE_TIMEOUT = 300
+    ALLOWED_PATHS = DEFAULT_ALLOWED_PATHS
+    OUTBOX_MAX_ATTEMPTS = 5
+    OUTBOX_BACKOFF = 60
+    OUTBOX_LEASE = 300
+    AUTOCOMPLETE_MIN_LENGTH = 2
+    AUTOCOMPLETE_LIMIT = 10
+    AUTOCOMPLETE_INDEX = False
+    AUTOCOMPLETE_INDEX_SIZE = 100000
+    AUTOCOMPLETE_INDEX_TIMEOUT = 60
+    AUTOCOMPLETE_CACHE = True
+    AUTOCOMPLETE_CACHE_SIZE = 1000
+    AUTOCOMPLETE_CACHE_TIMEOUT = 60
+    AUTOCOMPLETE_CACHE_MATCHES = 200
+    TEAM_LIST_PAGE_SIZE = 20
+    EXPORT_CHUNK_SIZE = 2000
+    MEMBERSHIP_HISTORY = "reversion"
 
     def configure_profile_model(self, value):
         if value:
@@ -33,5 +58,12 @@ class TeamAppConf(AppConf):
     def configure_hookset(self, value):
         return load_path_attr(value)()
 
+    def configure_membership_history(self, value):
+        if value not in ["reversion", "deferred", "events", "off"]:
+            raise ImproperlyConfigured(
+                f"PINAX_TEAMS_MEMBERSHIP_HISTORY must be one of reversion, deferred, events or off, not {value!r}"
+            )
+        return value
+
     class Meta:
         prefix = "pinax_teams"
@@ -1,11 +1,12 @@
 from functools import WRAPPER_ASSIGNMENTS, wraps
 
 from django.http import Http404
-from django.shortcuts import get_object_or_404
 
 from account.decorators import login_required
 
-from .models import Membership, Team
+from .cache import team_cache
+from .models import Team
+from .utils import set_request_team
 
 
 def team_required(func=None):
@@ -18,7 +19,13 @@ def team_required(func=None):
         def _wrapped_view(request, *args, **kwargs):
             slug = kwargs.pop("slug", None)
             if not getattr(request, "team", None):
-                request.team = get_object_or_404(Team, slug=slug)
+                try:
+                    team = team_cache.get(slug)
+                except Team.DoesNotExist:
+                    raise Http404()
+                set_request_team(request, team)
+            elif not getattr(request, "team_membership", None):
+                set_request_team(request, request.team)
             return view_func(request, *args, **kwargs)
         return _wrapped_view
     if func:
@@ -36,8 +43,7 @@ def manager_required(func=None):
         @login_required
         @wraps(view_func, assigned=WRAPPER_ASSIGNMENTS)
         def _wrapped_view(request, *args, **kwargs):
-            role = request.team.role_for(request.user)
-            if role not in [Membership.ROLE_MANAGER, Membership.ROLE_OWNER]:
+            if not request.team_membership.can_manage:
                 raise Http404()
             return view_func(request, *args, **kwargs)
         return _wrapped_view
@@ -1,12 +1,18 @@
+import csv
+import re
+
 from django import forms
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 
 from account.forms import SignupForm
 
 from .conf import settings
 from .hooks import hookset
-from .models import Membership, Team, create_slug
+from .models import Membership, Team, create_slug, transition_matrix
 
 MESSAGE_STRINGS = hookset.get_message_strings()
 
@@ -44,7 +50,8 @@ class TeamForm(forms.ModelForm):
             "avatar",
             "description",
             "member_access",
-            "manager_access"
+            "manager_access",
+            "capacity"
         ]
 
 
@@ -76,6 +83,122 @@ class TeamInviteUserForm(forms.Form):
         self.team = kwargs.pop("team")
         super().__init__(*args, **kwargs)
         self.fields["invitee"].widget.attrs["data-autocomplete-url"] = hookset.build_team_url(
-            "autocomplete_users"
+            "autocomplete_users", self.team.slug
         )
         self.fields["invitee"].widget.attrs["placeholder"] = "email address"
+
+
+class TeamBulkInviteForm(forms.Form):
+
+    STATUS_ADDED = "added"
+    STATUS_INVITED = "invited"
+    STATUS_EXISTS = "exists"
+    STATUS_INVALID = "invalid"
+
+    invitees = forms.CharField(label=_("People to invite"), widget=forms.Textarea)
+    role = forms.ChoiceField(choices=Membership.ROLE_CHOICES, widget=forms.RadioSelect)
+
+    def __init__(self, *args, **kwargs):
+        self.team = kwargs.pop("team")
+        super().__init__(*args, **kwargs)
+        self.fields["invitees"].widget.attrs["placeholder"] = "email addresses or usernames"
+
+    def clean_invitees(self):
+        """
+        Accepts a pasted list or CSV of email addresses and usernames,
+        separated by commas, semicolons or whitespace
+        """
+        addresses = []
+        for row in csv.reader(self.cleaned_data["invitees"].splitlines()):
+            for cell in row:
+                addresses.extend(address for address in re.split(r"[\s;]+", cell) if address)
+        addresses = list(dict.fromkeys(addresses))
+        if not addresses:
+            raise forms.ValidationError(_("Enter at least one email address or username."))
+        if len(addresses) > settings.PINAX_TEAMS_BULK_INVITE_MAX:
+            raise forms.ValidationError(
+                _("You can invite at most %(max)d people at once."),
+                params={"max": settings.PINAX_TEAMS_BULK_INVITE_MAX}
+            )
+        return addresses
+
+    def resolve_users(self, addresses):
+        """
+        Returns a function mapping each address to its user, or None, and the
+        pks of those users already on the team, using one query for each
+        """
+        User = get_user_model()
+        emails = [address for address in addresses if "@" in address]
+        usernames = [address for address in addresses if "@" not in address]
+        by_email, by_username = {}, {}
+        users = User.objects.filter(
+            Q(email__in=emails) | Q(**{f"{User.USERNAME_FIELD}__in": usernames})
+        )
+        for user in users:
+            by_email.setdefault(user.email, user)
+            by_username[user.get_username()] = user
+        on_team = set(
+            self.team.memberships.filter(user__in=users).values_list("user_id", flat=True)
+        )
+
+        def lookup(address):
+            return by_email.get(address) if "@" in address else by_username.get(address)
+        return lookup, on_team
+
+    def sort_addresses(self, addresses, lookup, on_team):
+        """
+        Splits addresses into users to add and emails to invite, recording
+        the status of those that are neither
+        """
+        results = {}
+        to_add, to_invite = {}, []
+        for address in addresses:
+            user = lookup(address)
+            if user is not None:
+                if user.pk in on_team or user.pk in to_add:
+                    results[address] = self.STATUS_EXISTS
+                else:
+                    to_add[user.pk] = user
+                    results[address] = self.STATUS_ADDED
+                continue
+            try:
+                validate_email(address)
+            except ValidationError:
+                results[address] = self.STATUS_INVALID
+            else:
+                to_invite.append(address)
+        return results, to_add, to_invite
+
+    def build_results(self, addresses, lookup, results, memberships):
+        data = []
+        for address in addresses:
+            user = lookup(address)
+            key = address if user is None else user.pk
+            membership = memberships.get(key) if results[address] != self.STATUS_EXISTS else None
+            data.append({
+                "address": address,
+                "status": results[address],
+                "membership": membership.pk if membership else None,
+            })
+        return data
+
+    def save(self, from_user):
+        """
+        Resolves every address against users, memberships and invitations
+        with set-based queries, then adds or invites everyone new in bulk.
+        Returns one result per address.
+        """
+        addresses = self.cleaned_data["invitees"]
+        role = self.cleaned_data["role"]
+        lookup, on_team = self.resolve_users(addresses)
+        results, to_add, to_invite = self.sort_addresses(addresses, lookup, on_team)
+
+        state, _ = transition_matrix.target(self.team, None, None, "add")
+        memberships = {}
+        for membership in self.team.add_members(to_add.values(), role=role, state=state, by=from_user):
+            memberships[membership.user_id] = membership
+        for membership in self.team.invite_users(from_user, to_invite, role).select_related("invite__signup_code"):
+            memberships[membership.invite.signup_code.email] = membership
+        for address in to_invite:
+            results[address] = self.STATUS_INVITED if address in memberships else self.STATUS_EXISTS
+        return self.build_results(addresses, lookup, results, memberships)
@@ -0,0 +1,124 @@
+"""
+Membership history, as chosen by PINAX_TEAMS_MEMBERSHIP_HISTORY:
+
+    "reversion"  django-reversion versions, serialized as memberships are saved
+                 inside a revision (the default)
+    "deferred"   django-reversion versions, queued as memberships are saved
+                 inside a revision and written in one revision per batch once
+                 the transaction commits
+    "events"     an append-only MembershipEvent log written from the team
+                 signals, without django-reversion
+    "off"        no history
+"""
+import collections
+import functools
+import threading
+import weakref
+
+from django.db import router, transaction
+from django.db.models.signals import post_save
+
+from reversion import revisions as reversion
+
+from .conf import settings
+
+HISTORY_REVERSION = "reversion"
+HISTORY_DEFERRED = "deferred"
+HISTORY_EVENTS = "events"
+HISTORY_OFF = "off"
+
+HISTORY_MODES = [HISTORY_REVERSION, HISTORY_DEFERRED, HISTORY_EVENTS, HISTORY_OFF]
+
+_deferred = threading.local()
+
+
+def uses_reversion():
+    return settings.PINAX_TEAMS_MEMBERSHIP_HISTORY in [HISTORY_REVERSION, HISTORY_DEFERRED]
+
+
+def register(*models):
+    """
+    Registers the membership models with django-reversion, routing their
+    saves through record() rather than reversion's own post_save receiver
+    so the mode can decide when, or whether, they are serialized
+    """
+    for model in models:
+        reversion.register(model)
+        post_save.disconnect(reversion._post_save_receiver, sender=model)
+
+
+def record(instance, using=None):
+    """
+    Adds a saved membership to the active revision, if any, now or after
+    commit depending on the mode
+    """
+    if not reversion.is_active() or reversion.is_manage_manually() or not reversion.is_registered(type(instance)):
+        return
+    mode = settings.PINAX_TEAMS_MEMBERSHIP_HISTORY
+    if mode == HISTORY_REVERSION:
+        reversion.add_to_revision(instance, model_db=using)
+    elif mode == HISTORY_DEFERRED:
+        defer(type(instance), [instance.pk], using or router.db_for_write(type(instance), instance=instance))
+
+
+def record_all(queryset):
+    """
+    Bulk counterpart of record() for the memberships in queryset, changed by
+    a bulk insert or a queryset update, which send no post_save
+    """
+    model = queryset.model
+    if not reversion.is_active() or reversion.is_manage_manually() or not reversion.is_registered(model):
+        return
+    mode = settings.PINAX_TEAMS_MEMBERSHIP_HISTORY
+    if mode == HISTORY_REVERSION:
+        for instance in queryset:
+            reversion.add_to_revision(instance, model_db=queryset.db)
+    elif mode == HISTORY_DEFERRED:
+        pks = list(queryset.values_list("pk", flat=True))
+        if pks:
+            defer(model, pks, queryset.db)
+
+
+class Batch(dict):
+    """
+    Membership pks queued in one atomic block, by (user, comment, model)
+    """
+
+
+def defer(model, pks, using):
+    batches = getattr(_deferred, "batches", None)
+    if batches is None:
+        batches = _deferred.batches = weakref.WeakValueDictionary()
+    key = (using, tuple(transaction.get_connection(using).savepoint_ids))
+    batch = batches.get(key)
+    created = batch is None
+    if created:
+        batch = batches[key] = Batch()
+    batch.setdefault((reversion.get_user(), reversion.get_comment(), model), set()).update(pks)
+    if created:
+        # only the commit callback holds on to the batch, so rolling back the
+        # block discards the queued pks along with it
+        transaction.on_commit(functools.partial(flush, using, batch), using=using)
+
+
+def flush(using, batch):
+    """
+    Writes the memberships queued on using as versions, one revision per user
+    and comment, loading each model's rows with a single query. The first
+    callback to run at commit takes every pending batch; the rest find their
+    batch already written.
+    """
+    batches = getattr(_deferred, "batches", None) or {}
+    pending = [batch] + [batches.pop(key) for key in list(batches.keys()) if key[0] == using]
+    revisions = collections.defaultdict(lambda: collections.defaultdict(set))
+    for queued in pending:
+        for (user, comment, model), pks in queued.items():
+            revisions[(user, comment)][model].update(pks)
+        queued.clear()
+    for (user, comment), models in revisions.items():
+        with reversion.create_revision(using=using):
+            reversion.set_user(user)
+            reversion.set_comment(comment)
+            for model, pks in models.items():
+                for instance in model._base_manager.using(using).filter(pk__in=pks):
+                    reversion.add_to_revision(instance, model_db=using)
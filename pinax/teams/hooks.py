@@ -1,8 +1,8 @@
-from django.db.models import Q
 from django.urls import reverse
 
 MESSAGE_STRINGS = {
     "joined-team": "Joined team.",
+    "joined-waitlist": "Team is full; you have been added to the waitlist.",
     "left-team": "Left team.",
     "applied-to-join": "Applied to join team.",
     "accepted-application": "Accepted application.",
@@ -11,6 +11,7 @@ MESSAGE_STRINGS = {
     "on-team-blacklist": "You can not create a team by this name",
     "user-member-exists": "User already on team.",
     "invitee-member-exists": "Invite already sent.",
+    "not-enough-invitations": "You do not have enough invitations left.",
 }
 
 
@@ -21,20 +22,37 @@ class TeamDefaultHookset():
     # not have a username field
     membership_search_fields = ["user__username"]
 
+    # user fields loaded with each membership by Team.roster()
+    roster_user_fields = ["username", "email", "first_name", "last_name"]
+
+    # user fields get_search_terms() and get_autocomplete_result() read; user
+    # saves limited to other fields, such as last_login, skip reindexing
+    search_user_fields = ["username", "email", "first_name", "last_name"]
+
     def build_team_url(self, url_name, team_slug):
         from .urls import app_name
         return reverse(f"{app_name}:{url_name}", args=[team_slug])
 
     def get_autocomplete_result(self, user):
-        return {"pk": user.pk, "email": user.email, "name": user.get_full_name()}
+        return {
+            "pk": user.pk,
+            "username": user.get_username(),
+            "email": user.email,
+            "name": user.get_full_name()
+        }
+
+    def get_search_terms(self, user):
+        # values the user can be found by, most relevant first
+        return [
+            user.get_username(),
+            getattr(user, "first_name", ""),
+            getattr(user, "last_name", ""),
+            getattr(user, "email", ""),
+        ]
 
     def search_queryset(self, query, users):
-        return users.filter(
-            Q(email__icontains=query) |
-            Q(username__icontains=query) |
-            Q(first_name__icontains=query) |
-            Q(last_name__icontains=query)
-        )
+        from .search import search_users
+        return search_users(query, users)
 
     def get_message_strings(self):
         return MESSAGE_STRINGS
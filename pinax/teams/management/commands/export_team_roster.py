@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...conf import settings
+from ...models import Team
+from ...roster import EXPORT_FORMATS, export_roster
+
+
+class Command(BaseCommand):
+
+    help = "Streams the memberships of a team as CSV or newline-delimited JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("slug")
+        parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv")
+        parser.add_argument("--output", help="file to write to instead of stdout")
+        parser.add_argument("--chunk-size", type=int, default=settings.PINAX_TEAMS_EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            team = Team.objects.get(slug=options["slug"])
+        except Team.DoesNotExist:
+            raise CommandError(f"Team {options['slug']!r} does not exist")
+        lines = export_roster(team, options["format"], options["chunk_size"])
+        if options["output"]:
+            with open(options["output"], "w", newline="") as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
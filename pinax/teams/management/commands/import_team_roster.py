@@ -0,0 +1,43 @@
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Team
+from ...roster import import_roster, read_roster
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Adds or updates memberships of a team from a CSV or newline-delimited "
+        "JSON file of usernames or emails, roles and states"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("slug")
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "ndjson"], help="defaults to the file extension")
+        parser.add_argument("--inviter", help="username invitations are sent from; defaults to the team creator")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            team = Team.objects.get(slug=options["slug"])
+        except Team.DoesNotExist:
+            raise CommandError(f"Team {options['slug']!r} does not exist")
+        inviter = team.creator
+        if options["inviter"]:
+            User = get_user_model()
+            try:
+                inviter = User.objects.get(**{User.USERNAME_FIELD: options["inviter"]})
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['inviter']!r} does not exist")
+        import_format = options["format"]
+        if import_format is None:
+            import_format = "ndjson" if os.path.splitext(options["path"])[1] in [".ndjson", ".jsonl"] else "csv"
+        with open(options["path"], newline="") as lines:
+            results = import_roster(team, read_roster(lines, import_format), inviter, options["chunk_size"])
+        self.stdout.write(", ".join(
+            f"{results[key]} {key}" for key in ["created", "updated", "unchanged", "invited", "skipped"]
+        ))
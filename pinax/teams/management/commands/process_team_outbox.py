@@ -0,0 +1,46 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ...models import OutboxMessage
+
+
+def deliver(message):
+    try:
+        return message.deliver()
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+
+    help = "Sends queued team invitation emails"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--loop", action="store_true", help="keep polling for new messages")
+        parser.add_argument("--interval", type=float, default=5, help="seconds between polls when idle")
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            while True:
+                messages = OutboxMessage.claim(options["batch_size"])
+                if messages:
+                    if executor is None:
+                        results = [message.deliver() for message in messages]
+                    else:
+                        results = list(executor.map(deliver, messages))
+                    sent = sum(results)
+                    self.stdout.write(f"Sent {sent} of {len(results)} invitations")
+                elif options["loop"]:
+                    time.sleep(options["interval"])
+                if not options["loop"] and len(messages) < options["batch_size"]:
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown()
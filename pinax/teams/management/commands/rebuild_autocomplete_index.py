@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from ...models import UserSearchTerm
+from ...search import autocomplete_cache, index_users, prefix_index
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Rebuilds the user search terms behind the invite autocomplete and "
+        "makes every in-process prefix index rebuild"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        UserSearchTerm.objects.all().delete()
+        indexed = 0
+        last_pk = None
+        users = get_user_model().objects.order_by("pk")
+        while True:
+            batch = users if last_pk is None else users.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            index_users(batch)
+            indexed += len(batch)
+            last_pk = batch[-1].pk
+        autocomplete_cache.invalidate_users()
+        prefix_index.invalidate()
+        self.stdout.write(f"Indexed {indexed} users")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import SimpleTeam, Team
+
+
+class Command(BaseCommand):
+
+    help = "Recomputes the denormalized membership counters of every team"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        for model in [Team, SimpleTeam]:
+            updated = 0
+            last_pk = 0
+            while True:
+                pks = list(
+                    model.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:batch_size]
+                )
+                if not pks:
+                    break
+                with transaction.atomic():
+                    updated += model.objects.filter(pk__in=pks).recount()
+                last_pk = pks[-1]
+            self.stdout.write(f"Recounted {updated} {model._meta.verbose_name_plural}")
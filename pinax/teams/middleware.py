@@ -1,60 +1,135 @@
+import asyncio
+import functools
 import re
 
 from django.http import Http404
+from django.utils.functional import SimpleLazyObject
 
 from account.utils import handle_redirect_to_login
 
+try:
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+except ImportError:  # asgiref < 3.6
+    from asyncio import iscoroutinefunction
+
+    def markcoroutinefunction(func):
+        func._is_coroutine = asyncio.coroutines._is_coroutine
+        return func
+
+from .cache import team_cache, user_teams_cache
 from .conf import settings
-from .models import Membership, Team
+from .models import Team
+from .routing import is_allowed_path
+from .utils import aget_user, set_request_team
+
+SIGNUP_PATH_RE = re.compile(r"^/teams/[\w-]+/account/signup/")
 
 
 def check_team_allowed(request):
-    allowed = [
-        r"^/teams/[\w-]+/account/login/$",
-        r"^/teams/[\w-]+/account/signup/",
-        r"^/teams/[\w-]+/ajax/username-validation/",
-        r"^/teams/[\w-]+/account/password/reset/",
-    ]
-    for allow_re in allowed:
-        if re.search(allow_re, request.path):
-            return None
+    if is_allowed_path(request.path):
+        return None
     return handle_redirect_to_login(request, redirect_field_name="next")
 
 
+def get_team_slug(request):
+    """
+    Returns the team slug set by WSGITeamMiddleware or ASGITeamMiddleware
+    """
+    scope = getattr(request, "scope", None)
+    if scope is not None:
+        return scope.get("pinax.team")
+    return request.environ.get("pinax.team")
+
+
+def get_profile(user, team):
+    profile = user_teams_cache.get_profile(user, team)
+    if profile is None:
+        raise Http404()
+    return profile
+
+
+async def aget_profile(user, team):
+    profile = await user_teams_cache.aget_profile(user, team)
+    if profile is None:
+        raise Http404()
+    return profile
+
+
+async def resolved(value):
+    return value
+
+
 class TeamMiddleware:
+    """
+    Sets request.team, request.team_membership and request.profile, raising
+    Http404 for a user with no profile on the team, and lazily
+    request.user.teams. Runs natively under both WSGI and ASGI; on the async
+    path request.ateams() and request.aprofile() are awaitable counterparts
+    of the attributes.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        self.async_mode = get_response is not None and iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.process_request(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.aprocess_request(request) or await self.get_response(request)
 
     def process_request(self, request):
-        team_slug = request.environ.get("pinax.team")
+        team_slug = get_team_slug(request)
+        team = None
         if team_slug is not None:
             try:
-                team = Team.objects.get(slug=team_slug)
+                team = team_cache.get(team_slug)
             except Team.DoesNotExist:
                 if request.user.is_authenticated:
                     request.user.teams = None
                     raise Http404()
                 else:
                     return check_team_allowed(request)
-            else:
-                request.team = team
-        else:
-            request.team = None
+        set_request_team(request, team)
         if request.user.is_authenticated and settings.PINAX_TEAMS_PROFILE_MODEL:
-            if re.search(r"^/teams/[\w-]+/account/signup/", request.path):
+            if SIGNUP_PATH_RE.match(request.path):
                 return None
-            profiles = settings.PINAX_TEAMS_PROFILE_MODEL.objects.filter(
-                user=request.user
-            )
-            request.user.teams = profiles.filter(
-                team__isnull=False,
-                team__memberships__state__in=[
-                    Membership.STATE_ACCEPTED,
-                    Membership.STATE_AUTO_JOINED
-                ]
-            ).distinct()
+            self.set_user_attributes(request, request.user, get_profile(request.user, team))
+        else:
+            if team_slug is not None:
+                return check_team_allowed(request)
+
+    async def aprocess_request(self, request):
+        user = request.user = await aget_user(request)
+        team_slug = get_team_slug(request)
+        team = None
+        if team_slug is not None:
             try:
-                request.profile = profiles.get(team=request.team)
-            except settings.PINAX_TEAMS_PROFILE_MODEL.DoesNotExist:
-                raise Http404()
+                team = await team_cache.aget(team_slug)
+            except Team.DoesNotExist:
+                if user.is_authenticated:
+                    user.teams = None
+                    raise Http404()
+                else:
+                    return check_team_allowed(request)
+        set_request_team(request, team)
+        if user.is_authenticated and settings.PINAX_TEAMS_PROFILE_MODEL:
+            if SIGNUP_PATH_RE.match(request.path):
+                return None
+            self.set_user_attributes(request, user, await aget_profile(user, team))
         else:
             if team_slug is not None:
                 return check_team_allowed(request)
+
+    def set_user_attributes(self, request, user, profile):
+        user.teams = SimpleLazyObject(lambda: user_teams_cache.get_teams(user))
+        request.profile = profile
+        request.ateams = functools.partial(user_teams_cache.aget_teams, user)
+        request.aprofile = functools.partial(resolved, profile)
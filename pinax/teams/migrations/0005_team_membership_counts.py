@@ -0,0 +1,88 @@
+# Generated by Django 5.0.14 on 2026-10-17 02:24
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+ACCEPTED = ['accepted', 'auto-joined']
+COUNT_FILTERS = {
+    'member_count': {'state__in': ACCEPTED, 'role': 'member'},
+    'manager_count': {'state__in': ACCEPTED, 'role': 'manager'},
+    'owner_count': {'state__in': ACCEPTED, 'role': 'owner'},
+    'applicant_count': {'state': 'applied'},
+    'invitee_count': {'state': 'invited'},
+}
+
+
+def populate_counts(apps, schema_editor):
+    for team_name, membership_name in [('Team', 'Membership'), ('SimpleTeam', 'SimpleMembership')]:
+        team_model = apps.get_model('pinax_teams', team_name)
+        membership_model = apps.get_model('pinax_teams', membership_name)
+        counts = {}
+        for field, lookups in COUNT_FILTERS.items():
+            count = membership_model.objects.filter(
+                team=OuterRef('pk'), **lookups
+            ).order_by().values('team').annotate(count=Count('pk')).values('count')
+            counts[field] = Coalesce(Subquery(count), 0)
+        team_model.objects.update(**counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pinax_teams', '0004_auto_20170511_0856'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='simpleteam',
+            name='applicant_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='applicant count'),
+        ),
+        migrations.AddField(
+            model_name='simpleteam',
+            name='invitee_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='invitee count'),
+        ),
+        migrations.AddField(
+            model_name='simpleteam',
+            name='manager_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='manager count'),
+        ),
+        migrations.AddField(
+            model_name='simpleteam',
+            name='member_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='member count'),
+        ),
+        migrations.AddField(
+            model_name='simpleteam',
+            name='owner_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='owner count'),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='applicant_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='applicant count'),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='invitee_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='invitee count'),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='manager_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='manager count'),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='member_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='member count'),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='owner_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='owner count'),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
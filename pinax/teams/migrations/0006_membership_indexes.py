@@ -0,0 +1,29 @@
+# Generated by Django 5.0.14 on 2026-10-17 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pinax_teams', '0005_team_membership_counts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='membership',
+            index=models.Index(fields=['team', 'state', 'role'], name='pinax_teams_m_team_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='membership',
+            index=models.Index(fields=['user', 'state'], name='pinax_teams_m_user_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='simplemembership',
+            index=models.Index(fields=['team', 'state', 'role'], name='pinax_teams_sm_team_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='simplemembership',
+            index=models.Index(fields=['user', 'state'], name='pinax_teams_sm_user_state_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.0.14 on 2026-10-17 02:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+SEARCH_FIELDS = ['first_name', 'last_name', 'email']
+
+
+def normalize_term(value):
+    return ' '.join(str(value or '').split()).casefold()[:255]
+
+
+def populate_search_terms(apps, schema_editor):
+    # indexes the default hookset's terms; sites with a custom
+    # get_search_terms hook should run rebuild_autocomplete_index
+    user_model = apps.get_model(settings.AUTH_USER_MODEL)
+    search_term_model = apps.get_model('pinax_teams', 'UserSearchTerm')
+    username_field = getattr(user_model, 'USERNAME_FIELD', 'username')
+    terms = []
+    for user in user_model.objects.iterator(chunk_size=500):
+        seen = set()
+        for weight, field in enumerate([username_field] + SEARCH_FIELDS):
+            term = normalize_term(getattr(user, field, ''))
+            if term and term not in seen:
+                seen.add(term)
+                terms.append(search_term_model(user_id=user.pk, term=term, weight=weight))
+        if len(terms) >= 500:
+            search_term_model.objects.bulk_create(terms)
+            terms = []
+    search_term_model.objects.bulk_create(terms)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pinax_teams', '0007_outbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=255, verbose_name='term')),
+                ('weight', models.PositiveSmallIntegerField(default=0, verbose_name='weight')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pinax_teams_search_terms', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'User Search Term',
+                'verbose_name_plural': 'User Search Terms',
+                'indexes': [models.Index(fields=['term', 'user'], name='pinax_teams_search_term_idx')],
+            },
+        ),
+        migrations.RunPython(populate_search_terms, migrations.RunPython.noop),
+    ]
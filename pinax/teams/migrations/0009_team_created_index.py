@@ -0,0 +1,19 @@
+# Generated by Django 5.0.14 on 2026-10-17 03:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pinax_teams', '0008_user_search_terms'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='team',
+            index=models.Index(fields=['created', 'id'], name='pinax_teams_team_created_idx'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.0.14 on 2026-10-17 03:35
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+ACCEPTED = ['accepted', 'auto-joined']
+COUNT_FILTERS = {
+    'member_count': {'state__in': ACCEPTED, 'role': 'member'},
+    'manager_count': {'state__in': ACCEPTED, 'role': 'manager'},
+    'owner_count': {'state__in': ACCEPTED, 'role': 'owner'},
+    'applicant_count': {'state': 'applied'},
+    'invitee_count': {'state': 'invited'},
+}
+
+
+def remove_duplicates(apps, schema_editor):
+    """
+    Keeps the oldest of any memberships sharing (team, user) or
+    (team, invite), which the old unique_together let through, and recounts
+    the teams they belonged to
+    """
+    for team_name, membership_name in [('Team', 'Membership'), ('SimpleTeam', 'SimpleMembership')]:
+        team_model = apps.get_model('pinax_teams', team_name)
+        membership_model = apps.get_model('pinax_teams', membership_name)
+        team_ids = set()
+        for field in ['user', 'invite']:
+            duplicates = membership_model.objects.filter(
+                **{f'{field}__isnull': False}
+            ).values('team', field).annotate(keep=Min('pk'), count=Count('pk')).filter(count__gt=1)
+            for row in duplicates:
+                membership_model.objects.filter(
+                    team=row['team'], **{field: row[field]}
+                ).exclude(pk=row['keep']).delete()
+                team_ids.add(row['team'])
+        if team_ids:
+            counts = {}
+            for field, lookups in COUNT_FILTERS.items():
+                count = membership_model.objects.filter(
+                    team=OuterRef('pk'), **lookups
+                ).order_by().values('team').annotate(count=Count('pk')).values('count')
+                counts[field] = Coalesce(Subquery(count), 0)
+            team_model.objects.filter(pk__in=team_ids).update(**counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pinax_invitations', '0001_initial'),
+        ('pinax_teams', '0009_team_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='membership',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='simplemembership',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='membership',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('team', 'user'), name='pinax_teams_m_team_user_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='membership',
+            constraint=models.UniqueConstraint(condition=models.Q(('invite__isnull', False)), fields=('team', 'invite'), name='pinax_teams_m_team_invite_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='simplemembership',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('team', 'user'), name='pinax_teams_sm_team_user_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='simplemembership',
+            constraint=models.UniqueConstraint(condition=models.Q(('invite__isnull', False)), fields=('team', 'invite'), name='pinax_teams_sm_team_invite_uniq'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-17 03:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pinax_teams', '0010_membership_unique_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='simpleteam',
+            name='capacity',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='capacity'),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='capacity',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='capacity'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.14 on 2026-10-17 03:50
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('pinax_teams', '0011_team_capacity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MembershipEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('membership_pk', models.PositiveIntegerField(verbose_name='membership')),
+                ('team_pk', models.PositiveIntegerField(verbose_name='team')),
+                ('action', models.CharField(choices=[('added', 'added'), ('invited', 'invited'), ('joined', 'joined'), ('applied', 'applied'), ('accepted', 'accepted'), ('rejected', 'rejected'), ('promoted', 'promoted'), ('demoted', 'demoted'), ('left', 'left'), ('removed', 'removed')], max_length=20, verbose_name='action')),
+                ('state', models.CharField(choices=[('applied', 'applied'), ('invited', 'invited'), ('declined', 'declined'), ('rejected', 'rejected'), ('accepted', 'accepted'), ('waitlisted', 'waitlisted'), ('auto-joined', 'auto joined')], max_length=20, verbose_name='state')),
+                ('role', models.CharField(choices=[('member', 'member'), ('manager', 'manager'), ('owner', 'owner')], max_length=20, verbose_name='role')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='created')),
+                ('by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='by')),
+                ('membership_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype', verbose_name='membership type')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'membership event',
+                'verbose_name_plural': 'membership events',
+                'indexes': [models.Index(fields=['membership_type', 'membership_pk'], name='pinax_teams_event_member_idx'), models.Index(fields=['membership_type', 'team_pk', 'created'], name='pinax_teams_event_team_idx')],
+            },
+        ),
+    ]
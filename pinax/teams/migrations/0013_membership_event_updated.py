@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-17 04:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pinax_teams', '0012_membership_event'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='membershipevent',
+            name='action',
+            field=models.CharField(choices=[('added', 'added'), ('invited', 'invited'), ('joined', 'joined'), ('applied', 'applied'), ('accepted', 'accepted'), ('rejected', 'rejected'), ('promoted', 'promoted'), ('demoted', 'demoted'), ('left', 'left'), ('removed', 'removed'), ('updated', 'updated')], max_length=20, verbose_name='action'),
+        ),
+    ]
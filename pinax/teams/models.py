@@ -1,21 +1,28 @@
+import collections
 import datetime
+import itertools
 import os
 import uuid
 
-from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils import timezone
-from django.utils.translation import gettext_lazy as _
 from django.utils.text import slugify as django_slugify
+from django.utils.translation import gettext_lazy as _
 
-from pinax.invitations.models import JoinInvitation
-from reversion import revisions as reversion
-from slugify import slugify
+from account.models import SignupCode
+from pinax.invitations.conf import settings as invitations_settings
+from pinax.invitations.models import JoinInvitation, NotEnoughInvitationsError
 
-from . import signals
+from . import history, signals
+from .conf import settings
 from .hooks import hookset
+from .outbox import send_invite
+from .transitions import Rule, TransitionMatrix
 
 
 def avatar_upload(instance, filename):
@@ -28,6 +35,76 @@ def create_slug(name):
     return django_slugify(name)[:50]
 
 
+_membership_versions = itertools.count(1)
+_membership_version = next(_membership_versions)
+
+
+def membership_changed(user_ids=(), team_ids=()):
+    """
+    Invalidates every memoized membership snapshot in this process and
+    notifies receivers of the memberships_changed signal, which drop
+    cached data of the given users and teams
+    """
+    global _membership_version
+    _membership_version = next(_membership_versions)
+    user_ids = [pk for pk in user_ids if pk is not None]
+    team_ids = list(set(team_ids))
+    if user_ids or team_ids:
+        signals.memberships_changed.send(sender=None, user_ids=user_ids, team_ids=team_ids)
+
+
+class TeamQuerySet(models.QuerySet):
+
+    def available_to(self, user):
+        """
+        Teams the user has no membership on and may join: open teams, or any
+        team for staff users. Evaluates as a single query.
+        """
+        queryset = self
+        if not hookset.user_is_staff(user):
+            queryset = queryset.filter(member_access=BaseTeam.MEMBER_ACCESS_OPEN)
+        if user is not None and user.is_authenticated:
+            memberships = self.model._meta.get_field("memberships").related_model
+            queryset = queryset.filter(
+                ~Exists(memberships.objects.filter(team=OuterRef("pk"), user=user))
+            )
+        return queryset
+
+    def recount(self):
+        """
+        Recomputes the denormalized membership counters of every team in the
+        queryset with a single UPDATE
+        """
+        memberships = self.model._meta.get_field("memberships").related_model
+        counts = {}
+        for field, lookups in self.model.count_filters().items():
+            count = memberships.objects.filter(
+                team=OuterRef("pk"), **lookups
+            ).order_by().values("team").annotate(count=Count("pk")).values("count")
+            counts[field] = Coalesce(Subquery(count), 0)
+        return self.update(**counts)
+
+    def with_member_total(self):
+        """
+        Annotates member_total, the number of accepted memberships of any
+        role, from the denormalized counters
+        """
+        return self.annotate(member_total=F("member_count") + F("manager_count") + F("owner_count"))
+
+    def search(self, query):
+        return self.filter(
+            models.Q(name__icontains=query) |
+            models.Q(slug__icontains=query) |
+            models.Q(description__icontains=query)
+        )
+
+    def before(self, created, pk):
+        """
+        Keyset page boundary for an ordering on (-created, -pk)
+        """
+        return self.filter(models.Q(created__lt=created) | models.Q(created=created, pk__lt=pk))
+
+
 class BaseTeam(models.Model):
 
     MEMBER_ACCESS_OPEN = "open"
@@ -51,70 +128,156 @@ class BaseTeam(models.Model):
     member_access = models.CharField(max_length=20, choices=MEMBER_ACCESS_CHOICES, verbose_name=_("member access"))
     manager_access = models.CharField(max_length=20, choices=MANAGER_ACCESS_CHOICES, verbose_name=_("manager access"))
 
+    member_count = models.IntegerField(default=0, editable=False, verbose_name=_("member count"))
+    manager_count = models.IntegerField(default=0, editable=False, verbose_name=_("manager count"))
+    owner_count = models.IntegerField(default=0, editable=False, verbose_name=_("owner count"))
+    applicant_count = models.IntegerField(default=0, editable=False, verbose_name=_("applicant count"))
+    invitee_count = models.IntegerField(default=0, editable=False, verbose_name=_("invitee count"))
+
+    # seats for accepted memberships of any role; joins beyond it are waitlisted
+    capacity = models.PositiveIntegerField(null=True, blank=True, verbose_name=_("capacity"))
+
+    objects = TeamQuerySet.as_manager()
+
     class Meta:
         abstract = True
         verbose_name = _("Base")
         verbose_name_plural = _("Bases")
 
+    def save(self, *args, **kwargs):
+        # the counters are kept with F() updates; don't write back a stale copy
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.count_filters()
+            ]
+        super().save(*args, **kwargs)
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        # cached teams defer the counters; reading one loads them all
+        if fields is not None:
+            counters = set(self.count_filters()) & self.get_deferred_fields()
+            if counters & set(fields):
+                fields = list(set(fields) | counters)
+        super().refresh_from_db(using, fields, **kwargs)
+
+    @staticmethod
+    def count_filters():
+        accepted = BaseMembership.SEATED_STATES
+        return {
+            "member_count": {"state__in": accepted, "role": BaseMembership.ROLE_MEMBER},
+            "manager_count": {"state__in": accepted, "role": BaseMembership.ROLE_MANAGER},
+            "owner_count": {"state__in": accepted, "role": BaseMembership.ROLE_OWNER},
+            "applicant_count": {"state": BaseMembership.STATE_APPLIED},
+            "invitee_count": {"state": BaseMembership.STATE_INVITED},
+        }
+
+    @staticmethod
+    def count_field_for(state, role):
+        if state == BaseMembership.STATE_APPLIED:
+            return "applicant_count"
+        if state == BaseMembership.STATE_INVITED:
+            return "invitee_count"
+        if state in BaseMembership.SEATED_STATES:
+            return {
+                BaseMembership.ROLE_MEMBER: "member_count",
+                BaseMembership.ROLE_MANAGER: "manager_count",
+                BaseMembership.ROLE_OWNER: "owner_count",
+            }.get(role)
+
+    @classmethod
+    def adjust_counts(cls, pk, changes):
+        """
+        Applies membership changes, given as (before, after) pairs of
+        (state, role) where either side may be None for an added or removed
+        membership, to the counters of team pk with a single UPDATE
+        """
+        deltas = collections.Counter()
+        for before, after in changes:
+            if before is not None:
+                field = cls.count_field_for(*before)
+                if field:
+                    deltas[field] -= 1
+            if after is not None:
+                field = cls.count_field_for(*after)
+                if field:
+                    deltas[field] += 1
+        updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+        if updates:
+            cls.objects.filter(pk=pk).update(**updates)
+
     def can_join(self, user):
-        state = self.state_for(user)
-        if self.member_access == BaseTeam.MEMBER_ACCESS_OPEN and state is None:
-            return True
-        elif state == BaseMembership.STATE_INVITED:
-            return True
-        else:
-            return False
+        return self.snapshot_for(user).can_join
 
     def can_leave(self, user):
-        # managers can't leave at the moment
-        role = self.role_for(user)
-        return role == BaseMembership.ROLE_MEMBER
+        return self.snapshot_for(user).can_leave
 
     def can_apply(self, user):
-        state = self.state_for(user)
-        return self.member_access == BaseTeam.MEMBER_ACCESS_APPLICATION and state is None
+        return self.snapshot_for(user).can_apply
 
     @property
     def applicants(self):
-        return self.memberships.filter(state=BaseMembership.STATE_APPLIED)
+        return self.partition("applicants", state=BaseMembership.STATE_APPLIED)
 
     @property
     def invitees(self):
-        return self.memberships.filter(state=BaseMembership.STATE_INVITED)
+        return self.partition("invitees", state=BaseMembership.STATE_INVITED)
 
     @property
     def declines(self):
-        return self.memberships.filter(state=BaseMembership.STATE_DECLINED)
+        return self.partition("declines", state=BaseMembership.STATE_DECLINED)
 
     @property
     def rejections(self):
-        return self.memberships.filter(state=BaseMembership.STATE_REJECTED)
+        return self.partition("rejections", state=BaseMembership.STATE_REJECTED)
 
     @property
     def waitlisted(self):
-        return self.memberships.filter(state=BaseMembership.STATE_WAITLISTED)
+        return self.partition("waitlisted", state=BaseMembership.STATE_WAITLISTED)
 
     @property
     def acceptances(self):
-        return self.memberships.filter(state__in=[
-            BaseMembership.STATE_ACCEPTED,
-            BaseMembership.STATE_AUTO_JOINED]
-        )
+        return self.partition("acceptances", state__in=BaseMembership.SEATED_STATES)
 
     @property
     def members(self):
-        return self.acceptances.filter(role=BaseMembership.ROLE_MEMBER)
+        return self.partition("members", state__in=BaseMembership.SEATED_STATES, role=BaseMembership.ROLE_MEMBER)
 
     @property
     def managers(self):
-        return self.acceptances.filter(role=BaseMembership.ROLE_MANAGER)
+        return self.partition("managers", state__in=BaseMembership.SEATED_STATES, role=BaseMembership.ROLE_MANAGER)
 
     @property
     def owners(self):
-        return self.acceptances.filter(role=BaseMembership.ROLE_OWNER)
+        return self.partition("owners", state__in=BaseMembership.SEATED_STATES, role=BaseMembership.ROLE_OWNER)
+
+    def partition(self, name, **lookups):
+        # a team with a loaded roster serves the lists it already holds
+        roster = self.__dict__.get("loaded_roster")
+        if roster is not None:
+            return getattr(roster, name)
+        return self.memberships.filter(**lookups)
+
+    def roster(self):
+        """
+        Returns every membership of the team loaded with one query and
+        partitioned into the same lists as the properties above
+        """
+        from .roster import Roster
+        return Roster(self)
+
+    def load_roster(self):
+        """
+        Loads roster() onto this instance, after which the properties above
+        return its lists rather than querying; for a team rendered once, as
+        on the manage page
+        """
+        self.loaded_roster = self.roster()
+        return self.loaded_roster
 
     def is_owner_or_manager(self, user):
-        return self.acceptances.filter(
+        return self.memberships.filter(
+            state__in=BaseMembership.SEATED_STATES,
             role__in=[
                 BaseMembership.ROLE_OWNER,
                 BaseMembership.ROLE_MANAGER
@@ -123,16 +286,22 @@ class BaseTeam(models.Model):
         ).exists()
 
     def is_member(self, user):
-        return self.members.filter(user=user).exists()
+        return self.memberships.filter(
+            state__in=BaseMembership.SEATED_STATES, role=BaseMembership.ROLE_MEMBER, user=user
+        ).exists()
 
     def is_manager(self, user):
-        return self.managers.filter(user=user).exists()
+        return self.memberships.filter(
+            state__in=BaseMembership.SEATED_STATES, role=BaseMembership.ROLE_MANAGER, user=user
+        ).exists()
 
     def is_owner(self, user):
-        return self.owners.filter(user=user).exists()
+        return self.memberships.filter(
+            state__in=BaseMembership.SEATED_STATES, role=BaseMembership.ROLE_OWNER, user=user
+        ).exists()
 
     def is_on_team(self, user):
-        return self.acceptances.filter(user=user).exists()
+        return self.memberships.filter(state__in=BaseMembership.SEATED_STATES, user=user).exists()
 
     def add_member(self, user, role=None, state=None, by=None):
         # we do this, rather than put the BaseMembership constants in declaration
@@ -142,54 +311,358 @@ class BaseTeam(models.Model):
         if state is None:
             state = BaseMembership.STATE_AUTO_JOINED
 
-        membership, created = self.memberships.get_or_create(
-            team=self,
-            user=user,
-            defaults={"role": role, "state": state},
-        )
+        with transaction.atomic():
+            state = self.seat_state(state)
+            membership, created = self.memberships.get_or_create(
+                team=self,
+                user=user,
+                defaults={"role": role, "state": state},
+            )
+            if created:
+                self.adjust_counts(self.pk, [(None, (state, role))])
         signals.added_member.send(sender=self, membership=membership, by=by)
         return membership
 
     def add_user(self, user, role, by=None):
-        state = BaseMembership.STATE_AUTO_JOINED
-        if self.manager_access == BaseTeam.MANAGER_ACCESS_INVITE:
-            state = BaseMembership.STATE_INVITED
-        membership, _ = self.memberships.get_or_create(
-            user=user,
-            defaults={"role": role, "state": state}
-        )
+        state, _ = transition_matrix.target(self, None, None, "add")
+        with transaction.atomic():
+            state = self.seat_state(state)
+            membership, created = self.memberships.get_or_create(
+                user=user,
+                defaults={"role": role, "state": state}
+            )
+            if created:
+                self.adjust_counts(self.pk, [(None, (state, role))])
         signals.added_member.send(sender=self, membership=membership, by=by)
         return membership
 
+    def add_members(self, users, role=None, state=None, by=None):
+        """
+        Adds every user without a membership on the team in a constant number
+        of queries and sends a single added_members signal
+        """
+        if role is None:
+            role = BaseMembership.ROLE_MEMBER
+        if state is None:
+            state = BaseMembership.STATE_AUTO_JOINED
+
+        users = {user.pk: user for user in users}
+        membership_model = self.memberships.model
+        with transaction.atomic():
+            existing = set(
+                self.memberships.filter(user__in=list(users)).values_list("user_id", flat=True)
+            )
+            added = [pk for pk in users if pk not in existing]
+            states = [state] * len(added)
+            if state in BaseMembership.SEATED_STATES and self.capacity is not None:
+                free = max(self.free_seats(), 0)
+                states[free:] = [BaseMembership.STATE_WAITLISTED] * len(states[free:])
+            now = timezone.now()
+            membership_model.objects.bulk_create([
+                membership_model(team=self, user=users[pk], role=role, state=added_state, created=now)
+                for pk, added_state in zip(added, states)
+            ], ignore_conflicts=True)
+            # ignore_conflicts skips the users a concurrent add got to first,
+            # so only the rows stamped by this insert are counted
+            inserted = list(
+                self.memberships.filter(user__in=added, created=now).values_list("pk", "user_id", "state")
+            )
+            self.adjust_counts(self.pk, [(None, (added_state, role)) for pk, user_pk, added_state in inserted])
+            memberships = self.memberships.filter(pk__in=[pk for pk, user_pk, added_state in inserted])
+            history.record_all(memberships)
+        membership_changed([user_pk for pk, user_pk, added_state in inserted], [self.pk])
+        signals.added_members.send(sender=self, memberships=memberships, by=by)
+        return memberships
+
     def invite_user(self, from_user, to_email, role, message=None):
         if not JoinInvitation.objects.filter(signup_code__email=to_email).exists():
-            invite = JoinInvitation.invite(from_user, to_email, message, send=False)
-            membership, _ = self.memberships.get_or_create(
-                invite=invite,
-                defaults={"role": role, "state": BaseMembership.STATE_INVITED}
-            )
-            invite.send_invite()
+            with transaction.atomic():
+                invite = JoinInvitation.invite(from_user, to_email, message, send=False)
+                membership, created = self.memberships.get_or_create(
+                    invite=invite,
+                    defaults={"role": role, "state": BaseMembership.STATE_INVITED}
+                )
+                if created:
+                    self.adjust_counts(self.pk, [(None, (BaseMembership.STATE_INVITED, role))])
+                if settings.PINAX_TEAMS_INVITE_OUTBOX:
+                    OutboxMessage.objects.create(invite=invite)
+            if not settings.PINAX_TEAMS_INVITE_OUTBOX:
+                send_invite(invite)
             signals.invited_user.send(sender=self, membership=membership, by=from_user)
             return membership
 
+    def invite_users(self, from_user, to_emails, role, message=None):
+        """
+        Bulk counterpart of invite_user: creates signup codes, invitations
+        and memberships for every address without an invitation in a constant
+        number of queries and sends a single invited_users signal
+        """
+        existing = set(
+            JoinInvitation.objects.filter(
+                signup_code__email__in=to_emails
+            ).values_list("signup_code__email", flat=True)
+        )
+        to_emails = [email for email in dict.fromkeys(to_emails) if email not in existing]
+        if not to_emails:
+            return self.memberships.none()
+        remaining = from_user.invitationstat.invites_remaining()
+        if remaining != -1 and remaining < len(to_emails):
+            raise NotEnoughInvitationsError()
+
+        membership_model = self.memberships.model
+        with transaction.atomic():
+            codes = [
+                SignupCode.create(
+                    email=email,
+                    inviter=from_user,
+                    expiry=invitations_settings.PINAX_INVITATIONS_DEFAULT_EXPIRATION,
+                    check_exists=False
+                )
+                for email in to_emails
+            ]
+            SignupCode.objects.bulk_create(codes)
+            codes = SignupCode.objects.filter(code__in=[code.code for code in codes])
+            JoinInvitation.objects.bulk_create([
+                JoinInvitation(
+                    from_user=from_user,
+                    message=message,
+                    status=JoinInvitation.STATUS_SENT,
+                    signup_code=code
+                )
+                for code in codes
+            ])
+            invites = list(JoinInvitation.objects.filter(signup_code__in=codes).select_related("signup_code"))
+            membership_model.objects.bulk_create([
+                membership_model(team=self, invite=invite, role=role, state=BaseMembership.STATE_INVITED)
+                for invite in invites
+            ])
+            self.adjust_counts(self.pk, [(None, (BaseMembership.STATE_INVITED, role))] * len(invites))
+            memberships = self.memberships.filter(invite__in=invites)
+            history.record_all(memberships)
+            if settings.PINAX_TEAMS_INVITE_OUTBOX:
+                OutboxMessage.objects.bulk_create([OutboxMessage(invite=invite) for invite in invites])
+        membership_changed(team_ids=[self.pk])
+        if not settings.PINAX_TEAMS_INVITE_OUTBOX:
+            for invite in invites:
+                send_invite(invite)
+        signals.invited_users.send(sender=self, memberships=memberships, by=from_user)
+        return memberships
+
+    def upsert_membership(self, user, state, role=None):
+        """
+        Puts user on the team in state, inserting a membership or moving their
+        existing one with a conditional UPDATE; role defaults to member for a
+        new membership and is otherwise left as it is. Safe to call
+        concurrently for the same user: the unique (team, user) constraint
+        admits a single insert and the others fall through to the update.
+        Joining a team that is at capacity waitlists the membership instead.
+        Returns the membership and whether it changed.
+        """
+        model = self.memberships.model
+        requested = state
+        with transaction.atomic():
+            state = self.seat_state(state)
+            try:
+                with transaction.atomic():
+                    membership = self.memberships.create(
+                        user=user, state=state, role=role or BaseMembership.ROLE_MEMBER
+                    )
+            except IntegrityError:
+                membership = self.memberships.get(user=user)
+            else:
+                membership.adjust_team_counts(None, (membership.state, membership.role))
+                return membership, True
+            before = (membership.state, membership.role)
+            role = role or membership.role
+            if membership.state in BaseMembership.SEATED_STATES:
+                # already holds a seat
+                state = requested
+            if before == (state, role):
+                return membership, False
+            applied = model.objects.filter(
+                pk=membership.pk, state=membership.state, role=membership.role
+            ).update(state=state, role=role)
+            if not applied:
+                # a concurrent request moved it first
+                membership.refresh_from_db()
+                return membership, False
+            membership.state, membership.role = state, role
+            membership.adjust_team_counts(before, (state, role))
+            history.record(membership)
+        membership_changed([membership.user_id], [membership.team_id])
+        return membership, True
+
+    def claim_seat(self):
+        """
+        Returns whether the team has a free seat, locking its row until the
+        end of the transaction so the seat cannot be given away before the
+        caller's membership change updates the counters
+        """
+        return bool(type(self).objects.filter(pk=self.pk).filter(
+            models.Q(capacity__isnull=True) |
+            models.Q(capacity__gt=F("member_count") + F("manager_count") + F("owner_count"))
+        ).update(capacity=F("capacity")))
+
+    def free_seats(self):
+        """
+        Returns how many seats the team has left, or None without a capacity,
+        locking its row until the end of the transaction
+        """
+        return type(self).objects.select_for_update().filter(pk=self.pk).values_list(
+            F("capacity") - F("member_count") - F("manager_count") - F("owner_count"), flat=True
+        ).get()
+
+    def seat_state(self, state):
+        """
+        Returns state, or waitlisted if state takes a seat and the team has
+        none free; call within the transaction that makes the change
+        """
+        if state in BaseMembership.SEATED_STATES and self.capacity is not None and not self.claim_seat():
+            return BaseMembership.STATE_WAITLISTED
+        return state
+
+    def promote_waitlisted(self):
+        """
+        Moves waitlisted memberships, oldest first, onto the team while it
+        has free seats and returns them
+        """
+        promoted = []
+        with transaction.atomic():
+            while self.claim_seat():
+                membership = self.memberships.filter(
+                    state=BaseMembership.STATE_WAITLISTED
+                ).order_by("created", "pk").first()
+                if membership is None:
+                    break
+                if membership.transition("admit"):
+                    promoted.append(membership)
+        for membership in promoted:
+            signals.joined_team.send(sender=self, membership=membership)
+        return promoted
+
+    def join(self, user):
+        membership, changed = self.upsert_membership(
+            user, BaseMembership.STATE_AUTO_JOINED, BaseMembership.ROLE_MEMBER
+        )
+        if changed:
+            signals.joined_team.send(sender=self, membership=membership)
+        return membership
+
+    def apply(self, user):
+        membership, changed = self.upsert_membership(user, BaseMembership.STATE_APPLIED)
+        if changed:
+            signals.applied_to_team.send(sender=self, membership=membership)
+        return membership
+
+    def memoize_snapshots(self):
+        """
+        Memoizes snapshot_for() on this instance until a membership changes;
+        intended for the request-scoped team set by team_required
+        """
+        self._snapshot_memo = {}
+
+    def get_memoized_snapshot(self, key, version):
+        memo = getattr(self, "_snapshot_memo", None)
+        if memo is not None and key in memo:
+            memo_version, snapshot = memo[key]
+            if memo_version == version:
+                return snapshot
+
+    def set_memoized_snapshot(self, key, version, snapshot):
+        memo = getattr(self, "_snapshot_memo", None)
+        if memo is not None:
+            memo[key] = (version, snapshot)
+
+    def snapshot_for(self, user):
+        authenticated = user is not None and user.is_authenticated
+        key = user.pk if authenticated else None
+        version = _membership_version
+        snapshot = self.get_memoized_snapshot(key, version)
+        if snapshot is not None:
+            return snapshot
+        membership = None
+        if authenticated:
+            try:
+                membership = self.memberships.get(user=user)
+            except ObjectDoesNotExist:
+                pass
+        snapshot = MembershipSnapshot(self, user, membership)
+        self.set_memoized_snapshot(key, version, snapshot)
+        return snapshot
+
+    async def asnapshot_for(self, user):
+        authenticated = user is not None and user.is_authenticated
+        key = user.pk if authenticated else None
+        version = _membership_version
+        snapshot = self.get_memoized_snapshot(key, version)
+        if snapshot is not None:
+            return snapshot
+        membership = None
+        if authenticated:
+            try:
+                membership = await self.memberships.aget(user=user)
+            except ObjectDoesNotExist:
+                pass
+        snapshot = MembershipSnapshot(self, user, membership)
+        self.set_memoized_snapshot(key, version, snapshot)
+        return snapshot
+
     def for_user(self, user):
-        try:
-            return self.memberships.get(user=user)
-        except ObjectDoesNotExist:
-            pass
+        return self.snapshot_for(user).membership
 
     def state_for(self, user):
-        membership = self.for_user(user=user)
-        if membership:
-            return membership.state
+        return self.snapshot_for(user).state
 
     def role_for(self, user):
-        if hookset.user_is_staff(user):
-            return Membership.ROLE_MANAGER
+        return self.snapshot_for(user).role
+
+
+class MembershipSnapshot:
+    """
+    The state, role and capabilities of a user on a team, computed in memory
+    from a single membership lookup
+    """
+
+    def __init__(self, team, user, membership=None):
+        self.team = team
+        self.user = user
+        self.membership = membership
+        self.is_staff = hookset.user_is_staff(user)
+
+    @property
+    def state(self):
+        if self.membership:
+            return self.membership.state
+
+    @property
+    def role(self):
+        if self.is_staff:
+            return BaseMembership.ROLE_MANAGER
+        if self.membership:
+            return self.membership.role
+
+    @property
+    def can_manage(self):
+        return self.role in [BaseMembership.ROLE_MANAGER, BaseMembership.ROLE_OWNER]
+
+    def can(self, action):
+        return transition_matrix.allows(self.team, self.state, self.role, action)
 
-        membership = self.for_user(user)
-        if membership:
-            return membership.role
+    @property
+    def can_view(self):
+        return self.can("view")
+
+    @property
+    def can_join(self):
+        return self.can("join")
+
+    @property
+    def can_leave(self):
+        return self.can("leave")
+
+    @property
+    def can_apply(self):
+        return self.can("apply")
 
 
 class SimpleTeam(BaseTeam):
@@ -209,6 +682,9 @@ class Team(BaseTeam):
     created = models.DateTimeField(default=timezone.now, editable=False, verbose_name=_("created"))
 
     class Meta:
+        indexes = [
+            models.Index(fields=["created", "id"], name="pinax_teams_team_created_idx"),
+        ]
         verbose_name = _("Team")
         verbose_name_plural = _("Teams")
 
@@ -225,6 +701,104 @@ class Team(BaseTeam):
         super().save(*args, **kwargs)
 
 
+class MembershipQuerySet(models.QuerySet):
+
+    def transition_all(self, action, signal, by=None, **updates):
+        """
+        Applies action to every membership in the queryset that the
+        transition matrix allows it for, also setting any further field
+        values given as updates, with one conditional UPDATE per distinct
+        (before, after) pair and sends one batched signal
+        """
+        team_model = self.model._meta.get_field("team").related_model
+        with transaction.atomic():
+            rows = self.select_for_update().filter(
+                state__in=transition_matrix.source_states(action),
+                role__in=transition_matrix.source_roles(action),
+            ).order_by("created", "pk").values_list(
+                "pk", "team_id", "user_id", "state", "role",
+                "team__member_access", "team__manager_access", "team__capacity",
+            )
+            targets = []
+            for pk, team_id, user_id, state, role, member_access, manager_access, capacity in rows:
+                target = transition_matrix.get(member_access, manager_access, state, role, action)
+                if target is not None:
+                    targets.append(((pk, team_id, user_id), (state, role), target, capacity))
+            moves = collections.defaultdict(list)
+            for member, before, after in self.waitlist_overflow(team_model, targets):
+                moves[(before, after)].append(member)
+            if not moves:
+                return 0
+            updated = 0
+            changes = collections.defaultdict(list)
+            for (before, after), members in moves.items():
+                updated += self.model.objects.filter(
+                    pk__in=[pk for pk, team_id, user_id in members], state=before[0], role=before[1]
+                ).update(state=after[0], role=after[1], **updates)
+                for pk, team_id, user_id in members:
+                    changes[team_id].append((before, after))
+            for team_id, team_changes in changes.items():
+                team_model.adjust_counts(team_id, team_changes)
+            members = [member for members in moves.values() for member in members]
+            memberships = self.model.objects.filter(pk__in=[pk for pk, team_id, user_id in members])
+            history.record_all(memberships)
+        user_ids = [user_id for pk, team_id, user_id in members]
+        if updates.get("user") is not None:
+            user_ids.append(updates["user"].pk)
+        membership_changed(user_ids, list(changes))
+        signal.send(sender=self.model, memberships=memberships, by=by)
+        return updated
+
+    @staticmethod
+    def waitlist_overflow(team_model, targets):
+        """
+        Yields (member, before, after) for each target, waitlisting instead
+        the memberships that would take a seat their team no longer has,
+        oldest first
+        """
+        seated = BaseMembership.SEATED_STATES
+
+        def takes_seat(before, after, capacity):
+            return capacity is not None and after[0] in seated and before[0] not in seated
+        team_ids = {
+            member[1] for member, before, after, capacity in targets if takes_seat(before, after, capacity)
+        }
+        free = {}
+        if team_ids:
+            free = dict(team_model.objects.select_for_update().filter(pk__in=team_ids).values_list(
+                "pk", F("capacity") - F("member_count") - F("manager_count") - F("owner_count")
+            ))
+        for member, before, after, capacity in targets:
+            if takes_seat(before, after, capacity):
+                if free[member[1]] > 0:
+                    free[member[1]] -= 1
+                else:
+                    after = (BaseMembership.STATE_WAITLISTED, after[1])
+            yield member, before, after
+
+    def promote_all(self, by=None):
+        return self.transition_all("promote", signals.promoted_members, by)
+
+    def demote_all(self, by=None):
+        return self.transition_all("demote", signals.demoted_members, by)
+
+    def accept_all(self, by=None):
+        return self.transition_all("accept", signals.accepted_memberships, by)
+
+    def reject_all(self, by=None):
+        return self.transition_all("reject", signals.rejected_memberships, by)
+
+    def join_all(self, user):
+        """
+        Accepts every invited membership in the queryset on behalf of user,
+        attaching user to them in the same UPDATE. Memberships on teams user
+        is already on are left as they are.
+        """
+        return self.exclude(
+            team__in=self.model.objects.filter(user=user).values("team")
+        ).transition_all("accept_invite", signals.joined_teams, user=user)
+
+
 class BaseMembership(models.Model):
 
     STATE_APPLIED = "applied"
@@ -239,6 +813,9 @@ class BaseMembership(models.Model):
     ROLE_MANAGER = "manager"
     ROLE_OWNER = "owner"
 
+    # states that hold one of the team's seats
+    SEATED_STATES = [STATE_ACCEPTED, STATE_AUTO_JOINED]
+
     STATE_CHOICES = [
         (STATE_APPLIED, _("applied")),
         (STATE_INVITED, _("invited")),
@@ -259,6 +836,8 @@ class BaseMembership(models.Model):
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default=ROLE_MEMBER, verbose_name=_("role"))
     created = models.DateTimeField(default=timezone.now, verbose_name=_("created"))
 
+    objects = MembershipQuerySet.as_manager()
+
     class Meta:
         abstract = True
 
@@ -271,42 +850,64 @@ class BaseMembership(models.Model):
     def is_member(self):
         return self.role == BaseMembership.ROLE_MEMBER
 
+    def adjust_team_counts(self, before=None, after=None):
+        team_model = self._meta.get_field("team").related_model
+        team_model.adjust_counts(self.team_id, [(before, after)])
+
+    def transition(self, action):
+        """
+        Applies action when the transition matrix allows it from the
+        membership's state and role, with an UPDATE conditional on both so
+        concurrent transitions cannot overwrite each other, and returns
+        whether it applied. On success the instance is updated in place and
+        added to the active revision, if any.
+        """
+        before = (self.state, self.role)
+        after = transition_matrix.target(self.team, self.state, self.role, action)
+        if after is None:
+            return False
+        with transaction.atomic():
+            if self.state not in BaseMembership.SEATED_STATES:
+                after = (self.team.seat_state(after[0]), after[1])
+            if after == before:
+                return False
+            applied = type(self).objects.filter(
+                pk=self.pk, state=self.state, role=self.role
+            ).update(state=after[0], role=after[1])
+            if applied:
+                self.state, self.role = after
+                self.adjust_team_counts(before, after)
+                history.record(self)
+        if applied:
+            membership_changed([self.user_id], [self.team_id])
+        return bool(applied)
+
     def promote(self, by):
-        if self.role == BaseMembership.ROLE_MEMBER:
-            self.role = BaseMembership.ROLE_MANAGER
-            self.save()
+        if self.transition("promote"):
             signals.promoted_member.send(sender=self.team, membership=self, by=by)
             return True
         return False
 
     def demote(self, by):
-        if self.role == BaseMembership.ROLE_MANAGER:
-            self.role = BaseMembership.ROLE_MEMBER
-            self.save()
+        if self.transition("demote"):
             signals.demoted_member.send(sender=self.team, membership=self, by=by)
             return True
         return False
 
     def accept(self, by):
-        if self.state == BaseMembership.STATE_APPLIED:
-            self.state = BaseMembership.STATE_ACCEPTED
-            self.save()
+        if self.transition("accept"):
             signals.accepted_membership.send(sender=self.team, membership=self, by=by)
             return True
         return False
 
     def reject(self, by):
-        if self.state == BaseMembership.STATE_APPLIED:
-            self.state = BaseMembership.STATE_REJECTED
-            self.save()
+        if self.transition("reject"):
             signals.rejected_membership.send(sender=self.team, membership=self, by=by)
             return True
         return False
 
     def joined(self):
-        if self.state == BaseMembership.STATE_INVITED:
-            self.state = BaseMembership.STATE_ACCEPTED
-            self.save()
+        if self.transition("accept_invite"):
             signals.joined_team.send(sender=self.team, membership=self)
             return True
         return False
@@ -316,14 +917,32 @@ class BaseMembership(models.Model):
 
     def resend_invite(self, by=None):
         if self.state == BaseMembership.STATE_INVITED and self.invite:
-            self.invite.send_invite()
+            if settings.PINAX_TEAMS_INVITE_OUTBOX:
+                OutboxMessage.objects.create(invite=self.invite)
+            else:
+                send_invite(self.invite)
             signals.resent_invite.send(sender=self.team, membership=self, by=by)
             return True
         return False
 
+    def vacate(self):
+        """
+        Deletes the membership, handing its seat to the waitlist if the team
+        has a capacity
+        """
+        with transaction.atomic():
+            self.delete()
+            self.adjust_team_counts(before=(self.state, self.role))
+            if self.state in BaseMembership.SEATED_STATES and self.team.capacity is not None:
+                self.team.promote_waitlisted()
+
+    def leave(self):
+        signals.left_team.send(sender=self.team, membership=self)
+        self.vacate()
+
     def remove(self, by=None):
         signals.removed_member.send(sender=self.team, membership=self, by=by)
-        self.delete()
+        self.vacate()
 
     @property
     def invitee(self):
@@ -331,6 +950,49 @@ class BaseMembership(models.Model):
             return self.invite.to_user
 
 
+MEMBERSHIP_STATES = [state for state, label in BaseMembership.STATE_CHOICES]
+
+MEMBERSHIP_RULES = [
+    # seeing the join, leave and apply pages of a team
+    Rule("view", member_access=[BaseTeam.MEMBER_ACCESS_OPEN, BaseTeam.MEMBER_ACCESS_APPLICATION]),
+    Rule("view", state=MEMBERSHIP_STATES),
+    Rule("view", role=[BaseMembership.ROLE_MANAGER, BaseMembership.ROLE_OWNER]),
+    # a user acting on their own membership
+    Rule(
+        "join", state=None, member_access=BaseTeam.MEMBER_ACCESS_OPEN,
+        to_state=BaseMembership.STATE_AUTO_JOINED, to_role=BaseMembership.ROLE_MEMBER
+    ),
+    Rule(
+        "join", state=BaseMembership.STATE_INVITED,
+        to_state=BaseMembership.STATE_AUTO_JOINED, to_role=BaseMembership.ROLE_MEMBER
+    ),
+    Rule(
+        "apply", state=None, member_access=BaseTeam.MEMBER_ACCESS_APPLICATION,
+        to_state=BaseMembership.STATE_APPLIED, to_role=BaseMembership.ROLE_MEMBER
+    ),
+    # managers can't leave at the moment
+    Rule("leave", state=MEMBERSHIP_STATES, role=BaseMembership.ROLE_MEMBER, to_state=None),
+    Rule("accept_invite", state=BaseMembership.STATE_INVITED, to_state=BaseMembership.STATE_ACCEPTED),
+    # a manager acting on someone else's membership
+    Rule("add", state=None, manager_access=BaseTeam.MANAGER_ACCESS_ADD, to_state=BaseMembership.STATE_AUTO_JOINED),
+    Rule("add", state=None, manager_access=BaseTeam.MANAGER_ACCESS_INVITE, to_state=BaseMembership.STATE_INVITED),
+    Rule("accept", state=BaseMembership.STATE_APPLIED, to_state=BaseMembership.STATE_ACCEPTED),
+    Rule("reject", state=BaseMembership.STATE_APPLIED, to_state=BaseMembership.STATE_REJECTED),
+    Rule("promote", state=MEMBERSHIP_STATES, role=BaseMembership.ROLE_MEMBER, to_role=BaseMembership.ROLE_MANAGER),
+    Rule("demote", state=MEMBERSHIP_STATES, role=BaseMembership.ROLE_MANAGER, to_role=BaseMembership.ROLE_MEMBER),
+    # a seat freeing up on a team at capacity
+    Rule("admit", state=BaseMembership.STATE_WAITLISTED, to_state=BaseMembership.STATE_AUTO_JOINED),
+]
+
+transition_matrix = TransitionMatrix(
+    MEMBERSHIP_RULES,
+    member_access=[access for access, label in BaseTeam.MEMBER_ACCESS_CHOICES],
+    manager_access=[access for access, label in BaseTeam.MANAGER_ACCESS_CHOICES],
+    states=MEMBERSHIP_STATES,
+    roles=[role for role, label in BaseMembership.ROLE_CHOICES],
+)
+
+
 class SimpleMembership(BaseMembership):
 
     team = models.ForeignKey(SimpleTeam, related_name="memberships", verbose_name=_("team"), on_delete=models.CASCADE)
@@ -341,7 +1003,23 @@ class SimpleMembership(BaseMembership):
         return f"{self.team}: {self.user}"
 
     class Meta:
-        unique_together = [("team", "user", "invite")]
+        # (team, user) lookups are served by the unique (team, user) index
+        constraints = [
+            models.UniqueConstraint(
+                fields=["team", "user"],
+                condition=models.Q(user__isnull=False),
+                name="pinax_teams_sm_team_user_uniq",
+            ),
+            models.UniqueConstraint(
+                fields=["team", "invite"],
+                condition=models.Q(invite__isnull=False),
+                name="pinax_teams_sm_team_invite_uniq",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["team", "state", "role"], name="pinax_teams_sm_team_state_idx"),
+            models.Index(fields=["user", "state"], name="pinax_teams_sm_user_state_idx"),
+        ]
         verbose_name = _("Simple Membership")
         verbose_name_plural = _("Simple Memberships")
 
@@ -356,10 +1034,197 @@ class Membership(BaseMembership):
         return f"{self.team}: {self.user}"
 
     class Meta:
-        unique_together = [("team", "user", "invite")]
+        # (team, user) lookups are served by the unique (team, user) index
+        constraints = [
+            models.UniqueConstraint(
+                fields=["team", "user"],
+                condition=models.Q(user__isnull=False),
+                name="pinax_teams_m_team_user_uniq",
+            ),
+            models.UniqueConstraint(
+                fields=["team", "invite"],
+                condition=models.Q(invite__isnull=False),
+                name="pinax_teams_m_team_invite_uniq",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["team", "state", "role"], name="pinax_teams_m_team_state_idx"),
+            models.Index(fields=["user", "state"], name="pinax_teams_m_user_state_idx"),
+        ]
         verbose_name = _("Membership")
         verbose_name_plural = _("Memberships")
 
 
-reversion.register(SimpleMembership)
-reversion.register(Membership)
+class UserSearchTerm(models.Model):
+    """
+    A normalized term a user can be found by in the invite autocomplete,
+    so that prefix searches are index range scans. Kept up to date from
+    user saves; rebuild with the rebuild_autocomplete_index command.
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="pinax_teams_search_terms", verbose_name=_("user"), on_delete=models.CASCADE)
+    term = models.CharField(max_length=255, verbose_name=_("term"))
+    weight = models.PositiveSmallIntegerField(default=0, verbose_name=_("weight"))
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["term", "user"], name="pinax_teams_search_term_idx"),
+        ]
+        verbose_name = _("User Search Term")
+        verbose_name_plural = _("User Search Terms")
+
+    def __str__(self):
+        return self.term
+
+
+class OutboxMessage(models.Model):
+    """
+    An invitation email queued for delivery by the process_team_outbox
+    command, written in the same transaction as its membership
+    """
+
+    STATE_PENDING = "pending"
+    STATE_SENT = "sent"
+    STATE_FAILED = "failed"
+
+    STATE_CHOICES = [
+        (STATE_PENDING, _("pending")),
+        (STATE_SENT, _("sent")),
+        (STATE_FAILED, _("failed"))
+    ]
+
+    invite = models.ForeignKey(JoinInvitation, related_name="outbox_messages", verbose_name=_("invite"), on_delete=models.CASCADE)
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default=STATE_PENDING, verbose_name=_("state"))
+    attempts = models.PositiveIntegerField(default=0, verbose_name=_("attempts"))
+    next_attempt = models.DateTimeField(default=timezone.now, verbose_name=_("next attempt"))
+    last_error = models.TextField(blank=True, verbose_name=_("last error"))
+    created = models.DateTimeField(default=timezone.now, verbose_name=_("created"))
+    sent = models.DateTimeField(null=True, blank=True, verbose_name=_("sent"))
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["state", "next_attempt"], name="pinax_teams_outbox_due_idx"),
+        ]
+        verbose_name = _("Outbox Message")
+        verbose_name_plural = _("Outbox Messages")
+
+    def __str__(self):
+        return f"{self.invite}: {self.state}"
+
+    @classmethod
+    def claim(cls, batch_size):
+        """
+        Returns up to batch_size due messages and leases them so that
+        concurrent workers skip them until the lease runs out
+        """
+        now = timezone.now()
+        lease = now + datetime.timedelta(seconds=settings.PINAX_TEAMS_OUTBOX_LEASE)
+        with transaction.atomic():
+            due = cls.objects.filter(state=cls.STATE_PENDING, next_attempt__lte=now).order_by("next_attempt")
+            pks = list(due.select_for_update(skip_locked=True).values_list("pk", flat=True)[:batch_size])
+            cls.objects.filter(pk__in=pks).update(next_attempt=lease)
+        return list(
+            cls.objects.filter(pk__in=pks).select_related("invite__signup_code").order_by("pk")
+        )
+
+    def deliver(self):
+        """
+        Sends the invitation, recording success, a retry with exponential
+        backoff, or dead-lettering once PINAX_TEAMS_OUTBOX_MAX_ATTEMPTS is hit
+        """
+        self.attempts += 1
+        try:
+            send_invite(self.invite)
+        except Exception as e:
+            self.last_error = repr(e)
+            if self.attempts >= settings.PINAX_TEAMS_OUTBOX_MAX_ATTEMPTS:
+                self.state = OutboxMessage.STATE_FAILED
+            else:
+                backoff = settings.PINAX_TEAMS_OUTBOX_BACKOFF * 2 ** (self.attempts - 1)
+                self.next_attempt = timezone.now() + datetime.timedelta(seconds=backoff)
+        else:
+            self.state = OutboxMessage.STATE_SENT
+            self.sent = timezone.now()
+        self.save(update_fields=["state", "attempts", "next_attempt", "last_error", "sent"])
+        return self.state == OutboxMessage.STATE_SENT
+
+
+class MembershipEvent(models.Model):
+    """
+    An append-only record of a membership change, written from the team
+    signals when PINAX_TEAMS_MEMBERSHIP_HISTORY is "events"
+    """
+
+    ACTION_ADDED = "added"
+    ACTION_INVITED = "invited"
+    ACTION_JOINED = "joined"
+    ACTION_APPLIED = "applied"
+    ACTION_ACCEPTED = "accepted"
+    ACTION_REJECTED = "rejected"
+    ACTION_PROMOTED = "promoted"
+    ACTION_DEMOTED = "demoted"
+    ACTION_LEFT = "left"
+    ACTION_REMOVED = "removed"
+    ACTION_UPDATED = "updated"
+
+    ACTION_CHOICES = [
+        (ACTION_ADDED, _("added")),
+        (ACTION_INVITED, _("invited")),
+        (ACTION_JOINED, _("joined")),
+        (ACTION_APPLIED, _("applied")),
+        (ACTION_ACCEPTED, _("accepted")),
+        (ACTION_REJECTED, _("rejected")),
+        (ACTION_PROMOTED, _("promoted")),
+        (ACTION_DEMOTED, _("demoted")),
+        (ACTION_LEFT, _("left")),
+        (ACTION_REMOVED, _("removed")),
+        (ACTION_UPDATED, _("updated")),
+    ]
+
+    # memberships and teams are referenced by id so that events outlive them
+    membership_type = models.ForeignKey(ContentType, verbose_name=_("membership type"), on_delete=models.CASCADE)
+    membership_pk = models.PositiveIntegerField(verbose_name=_("membership"))
+    team_pk = models.PositiveIntegerField(verbose_name=_("team"))
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="+", null=True, blank=True, verbose_name=_("user"), on_delete=models.SET_NULL)
+    by = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="+", null=True, blank=True, verbose_name=_("by"), on_delete=models.SET_NULL)
+    action = models.CharField(max_length=20, choices=ACTION_CHOICES, verbose_name=_("action"))
+    state = models.CharField(max_length=20, choices=BaseMembership.STATE_CHOICES, verbose_name=_("state"))
+    role = models.CharField(max_length=20, choices=BaseMembership.ROLE_CHOICES, verbose_name=_("role"))
+    created = models.DateTimeField(default=timezone.now, verbose_name=_("created"))
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["membership_type", "membership_pk"], name="pinax_teams_event_member_idx"),
+            models.Index(fields=["membership_type", "team_pk", "created"], name="pinax_teams_event_team_idx"),
+        ]
+        verbose_name = _("membership event")
+        verbose_name_plural = _("membership events")
+
+    def __str__(self):
+        return f"{self.action} {self.membership_type.model} {self.membership_pk}"
+
+    @classmethod
+    def log(cls, action, memberships, by=None):
+        """
+        Appends an event for each of memberships, a queryset or a list of
+        instances of one model, with a single INSERT
+        """
+        if isinstance(memberships, models.QuerySet):
+            model = memberships.model
+            rows = list(memberships.values_list("pk", "team_id", "user_id", "state", "role"))
+        else:
+            model = type(memberships[0])
+            rows = [(m.pk, m.team_id, m.user_id, m.state, m.role) for m in memberships]
+        membership_type = ContentType.objects.get_for_model(model)
+        now = timezone.now()
+        return cls.objects.bulk_create([
+            cls(
+                membership_type=membership_type, membership_pk=pk, team_pk=team_id, user_id=user_id,
+                by=by, action=action, state=state, role=role, created=now,
+            )
+            for pk, team_id, user_id, state, role in rows
+        ])
+
+
+if history.uses_reversion():
+    history.register(SimpleMembership, Membership)
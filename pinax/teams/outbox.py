@@ -0,0 +1,20 @@
+from django.db.models import F
+
+from pinax.invitations.models import InvitationStat, JoinInvitation
+from pinax.invitations.signals import invite_sent
+
+
+def send_invite(invite):
+    """
+    Sends a join invitation. JoinInvitation.invite(send=False) only attaches
+    send_invite() to the instance it returns, so invitations loaded from the
+    database are sent the same way here.
+    """
+    if hasattr(invite, "send_invite"):
+        invite.send_invite()
+        return
+    invite.signup_code.send()
+    InvitationStat.objects.filter(user=invite.from_user_id).update(
+        invites_sent=F("invites_sent") + 1
+    )
+    invite_sent.send(sender=JoinInvitation, invitation=invite)
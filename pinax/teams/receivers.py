@@ -1,9 +1,22 @@
-from django.db.models.signals import post_save
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 from pinax.invitations.signals import invite_accepted, joined_independently
 
-from .models import Membership, Team
+from . import history, signals
+from .cache import team_cache, user_teams_cache
+from .conf import settings
+from .hooks import hookset
+from .models import (
+    Membership,
+    MembershipEvent,
+    SimpleMembership,
+    SimpleTeam,
+    Team,
+    membership_changed,
+)
+from .search import autocomplete_cache, prefix_index, reindex_user
 
 
 @receiver(post_save, sender=Team)
@@ -11,16 +24,130 @@ def handle_team_save(sender, **kwargs):
     created = kwargs.pop("created")
     team = kwargs.pop("instance")
     if created:
-        team.memberships.get_or_create(
+        membership, created = team.memberships.get_or_create(
             user=team.creator,
             defaults={
                 "role": Membership.ROLE_OWNER,
                 "state": Membership.STATE_AUTO_JOINED
             }
         )
+        if created:
+            Team.adjust_counts(team.pk, [(None, (membership.state, membership.role))])
+
+
+@receiver(post_save, sender=Team)
+@receiver(post_save, sender=SimpleTeam)
+def handle_team_capacity(sender, instance, created, raw=False, **kwargs):
+    # a raised or removed capacity admits the waitlist
+    if not created and not raw and instance.memberships.filter(state=Membership.STATE_WAITLISTED).exists():
+        instance.promote_waitlisted()
 
 
 @receiver([invite_accepted, joined_independently])
 def handle_invite_used(sender, invitation, **kwargs):
-    for membership in invitation.memberships.all():
-        membership.joined()
+    if invitation.to_user is not None:
+        for model in [Membership, SimpleMembership]:
+            model.objects.filter(invite=invitation).join_all(invitation.to_user)
+
+
+@receiver([post_save, post_delete], sender=Membership)
+@receiver([post_save, post_delete], sender=SimpleMembership)
+def handle_membership_change(sender, instance, **kwargs):
+    membership_changed([instance.user_id], [instance.team_id])
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_save, sender=SimpleMembership)
+def handle_membership_save(sender, instance, using, raw=False, **kwargs):
+    if not raw:
+        history.record(instance, using)
+
+
+MEMBERSHIP_EVENTS = {
+    signals.added_member: MembershipEvent.ACTION_ADDED,
+    signals.invited_user: MembershipEvent.ACTION_INVITED,
+    signals.joined_team: MembershipEvent.ACTION_JOINED,
+    signals.applied_to_team: MembershipEvent.ACTION_APPLIED,
+    signals.accepted_membership: MembershipEvent.ACTION_ACCEPTED,
+    signals.rejected_membership: MembershipEvent.ACTION_REJECTED,
+    signals.promoted_member: MembershipEvent.ACTION_PROMOTED,
+    signals.demoted_member: MembershipEvent.ACTION_DEMOTED,
+    signals.left_team: MembershipEvent.ACTION_LEFT,
+    signals.removed_member: MembershipEvent.ACTION_REMOVED,
+}
+
+BATCHED_MEMBERSHIP_EVENTS = {
+    signals.added_members: MembershipEvent.ACTION_ADDED,
+    signals.invited_users: MembershipEvent.ACTION_INVITED,
+    signals.joined_teams: MembershipEvent.ACTION_JOINED,
+    signals.accepted_memberships: MembershipEvent.ACTION_ACCEPTED,
+    signals.rejected_memberships: MembershipEvent.ACTION_REJECTED,
+    signals.promoted_members: MembershipEvent.ACTION_PROMOTED,
+    signals.demoted_members: MembershipEvent.ACTION_DEMOTED,
+    signals.updated_members: MembershipEvent.ACTION_UPDATED,
+}
+
+
+@receiver(list(MEMBERSHIP_EVENTS))
+def handle_membership_event(signal, sender, membership, by=None, **kwargs):
+    if settings.PINAX_TEAMS_MEMBERSHIP_HISTORY == history.HISTORY_EVENTS:
+        MembershipEvent.log(MEMBERSHIP_EVENTS[signal], [membership], by)
+
+
+@receiver(list(BATCHED_MEMBERSHIP_EVENTS))
+def handle_membership_events(signal, sender, memberships, by=None, **kwargs):
+    if settings.PINAX_TEAMS_MEMBERSHIP_HISTORY == history.HISTORY_EVENTS:
+        MembershipEvent.log(BATCHED_MEMBERSHIP_EVENTS[signal], memberships, by)
+
+
+@receiver([post_save, post_delete], sender=Team)
+def handle_team_change(sender, instance, **kwargs):
+    team_cache.invalidate(instance.slug)
+
+
+@receiver(signals.memberships_changed)
+def handle_memberships_changed(sender, user_ids, team_ids=(), **kwargs):
+    user_teams_cache.invalidate(user_ids)
+    if team_ids:
+        autocomplete_cache.invalidate_teams(team_ids)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def handle_user_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if update_fields is not None and update_fields.isdisjoint(hookset.search_user_fields):
+        return
+    if not raw and reindex_user(instance):
+        autocomplete_cache.invalidate_users()
+        if settings.PINAX_TEAMS_AUTOCOMPLETE_INDEX:
+            prefix_index.update_user(instance)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def handle_user_delete(sender, instance, **kwargs):
+    autocomplete_cache.invalidate_users()
+    if settings.PINAX_TEAMS_AUTOCOMPLETE_INDEX:
+        prefix_index.remove_user(instance.pk)
+
+
+def handle_profile_change(sender, instance, **kwargs):
+    user_teams_cache.invalidate([instance.user_id])
+
+
+def connect_profile_receivers(profile_model):
+    """
+    Connects handle_profile_change to the profile model alone, rather than
+    to every model's saves and deletes
+    """
+    for signal in [post_save, post_delete]:
+        signal.disconnect(dispatch_uid="pinax-teams-profile-change")
+        if profile_model:
+            signal.connect(handle_profile_change, sender=profile_model, dispatch_uid="pinax-teams-profile-change")
+
+
+@receiver(setting_changed)
+def handle_profile_model_change(setting, **kwargs):
+    if setting == "PINAX_TEAMS_PROFILE_MODEL":
+        connect_profile_receivers(settings.PINAX_TEAMS_PROFILE_MODEL)
+
+
+connect_profile_receivers(settings.PINAX_TEAMS_PROFILE_MODEL)
@@ -0,0 +1,314 @@
+import collections
+import csv
+import itertools
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.validators import validate_email
+from django.db import transaction
+from django.utils import timezone
+
+from . import history, signals
+from .hooks import hookset
+from .models import BaseMembership, MembershipQuerySet, membership_changed
+
+
+def roster_user_fields(prefix):
+    user_fields = {field.name for field in get_user_model()._meta.concrete_fields}
+    return [f"{prefix}__{name}" for name in hookset.roster_user_fields if name in user_fields]
+
+
+class Roster:
+    """
+    Every membership of a team, fetched with their users and invites in a
+    single query and partitioned in memory into the lists the team's
+    applicants, invitees, declines, rejections, waitlisted, acceptances,
+    members, managers and owners querysets would return
+    """
+
+    def __init__(self, team):
+        self.team = team
+        self.applicants = []
+        self.invitees = []
+        self.declines = []
+        self.rejections = []
+        self.waitlisted = []
+        self.acceptances = []
+        self.members = []
+        self.managers = []
+        self.owners = []
+        by_state = {
+            BaseMembership.STATE_APPLIED: self.applicants,
+            BaseMembership.STATE_INVITED: self.invitees,
+            BaseMembership.STATE_DECLINED: self.declines,
+            BaseMembership.STATE_REJECTED: self.rejections,
+            BaseMembership.STATE_WAITLISTED: self.waitlisted,
+            BaseMembership.STATE_ACCEPTED: self.acceptances,
+            BaseMembership.STATE_AUTO_JOINED: self.acceptances,
+        }
+        by_role = {
+            BaseMembership.ROLE_MEMBER: self.members,
+            BaseMembership.ROLE_MANAGER: self.managers,
+            BaseMembership.ROLE_OWNER: self.owners,
+        }
+        self.memberships = list(self.get_queryset())
+        for membership in self.memberships:
+            by_state[membership.state].append(membership)
+            if by_state[membership.state] is self.acceptances:
+                by_role[membership.role].append(membership)
+
+    def get_queryset(self):
+        return self.team.memberships.select_related(
+            "user", "invite", "invite__to_user", "invite__signup_code"
+        ).only(
+            "team", "user", "invite", "state", "role", "created",
+            "invite__to_user", "invite__signup_code", "invite__status", "invite__sent",
+            "invite__signup_code__email",
+            *roster_user_fields("user"),
+            *roster_user_fields("invite__to_user")
+        ).order_by("created", "pk")
+
+    def __iter__(self):
+        return iter(self.memberships)
+
+    def __len__(self):
+        return len(self.memberships)
+
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def export_columns():
+    """
+    Returns (column, lookup) pairs of a roster export
+    """
+    user_fields = {field.name for field in get_user_model()._meta.concrete_fields}
+    columns = [
+        ("id", "pk"),
+        ("state", "state"),
+        ("role", "role"),
+        ("created", "created"),
+        ("user_id", "user_id"),
+        ("username", f"user__{get_user_model().USERNAME_FIELD}"),
+    ]
+    if "email" in user_fields:
+        columns.append(("email", "user__email"))
+    columns.append(("invite_email", "invite__signup_code__email"))
+    columns.append(("invite_sent", "invite__sent"))
+    return columns
+
+
+def export_rows(team, chunk_size):
+    """
+    Yields every membership of team as a dict, streaming them from the
+    database chunk_size rows at a time
+    """
+    columns = export_columns()
+    names = [name for name, lookup in columns]
+    queryset = team.memberships.order_by("pk").values_list(*[lookup for name, lookup in columns])
+    for row in queryset.iterator(chunk_size=chunk_size):
+        yield dict(zip(names, row))
+
+
+class Echo:
+
+    def write(self, value):
+        return value
+
+
+def export_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow([name for name, lookup in export_columns()])
+    for row in rows:
+        yield writer.writerow(row.values())
+
+
+def export_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+
+def export_roster(team, export_format, chunk_size):
+    """
+    Returns an iterator over the lines of team's roster in export_format,
+    csv or ndjson
+    """
+    formatter = {"csv": export_csv, "ndjson": export_ndjson}[export_format]
+    return formatter(export_rows(team, chunk_size))
+
+
+def read_roster(lines, import_format):
+    """
+    Yields the rows of a roster in import_format, csv or ndjson, as dicts
+    """
+    if import_format == "csv":
+        yield from csv.DictReader(lines)
+    else:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+
+def import_roster(team, rows, inviter, chunk_size=1000):
+    """
+    Adds or updates a membership on team for every row naming a user by
+    username or email, and invites unknown email addresses, a chunk of
+    rows at a time with a constant number of queries per chunk. Rows may
+    also give a role and a state, and take the columns of a roster export.
+    Importing the same rows again changes nothing. Returns a Counter of
+    created, updated, unchanged, invited and skipped rows.
+    """
+    results = collections.Counter()
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        with transaction.atomic():
+            import_chunk(team, chunk, inviter, results)
+    return results
+
+
+def parse_rows(rows, results):
+    """
+    Returns (username, email, role, state) for every row naming a user with
+    a valid role and state, counting the rest as skipped
+    """
+    states = dict(BaseMembership.STATE_CHOICES)
+    roles = dict(BaseMembership.ROLE_CHOICES)
+    parsed = []
+    for row in rows:
+        username = (row.get("username") or "").strip()
+        email = (row.get("email") or row.get("invite_email") or "").strip()
+        role = row.get("role") or BaseMembership.ROLE_MEMBER
+        state = row.get("state") or BaseMembership.STATE_AUTO_JOINED
+        if (username or email) and role in roles and state in states:
+            parsed.append((username, email, role, state))
+        else:
+            results["skipped"] += 1
+    return parsed
+
+
+def resolve_users(parsed, results):
+    """
+    Returns the (role, state) wanted for each user pk and the email
+    addresses to invite, by role. Rows name a user by username or, failing
+    that, by email; unknown usernames and invalid emails are skipped.
+    """
+    User = get_user_model()
+    usernames = [username for username, email, role, state in parsed if username]
+    emails = [email for username, email, role, state in parsed if email and not username]
+    # one IN query per kind of key, as OR-ing them defeats their indexes
+    users = User.objects.order_by()
+    by_username = dict(
+        users.filter(**{f"{User.USERNAME_FIELD}__in": usernames}).values_list(User.USERNAME_FIELD, "pk")
+    ) if usernames else {}
+    by_email = {}
+    for email, pk in (users.filter(email__in=emails).values_list("email", "pk") if emails else []):
+        by_email.setdefault(email, pk)
+
+    wanted, invites = {}, collections.defaultdict(list)
+    for username, email, role, state in parsed:
+        pk = by_username.get(username) if username else by_email.get(email)
+        if pk is not None:
+            wanted[pk] = (role, state)
+        elif not username and is_valid_email(email):
+            invites[role].append(email)
+        else:
+            results["skipped"] += 1
+    return wanted, invites
+
+
+def is_valid_email(email):
+    try:
+        validate_email(email)
+    except ValidationError:
+        return False
+    return True
+
+
+def upsert_memberships(team, wanted, results):
+    """
+    Inserts the memberships in wanted that team lacks and moves the others
+    to their wanted role and state, with one UPDATE per distinct change,
+    and applies both to the team's counters. Rows that would take a seat
+    the team no longer has are waitlisted, and seats the import frees go to
+    the waitlist. Returns (pk, user pk) of the created and of the updated
+    memberships.
+    """
+    membership_model = team.memberships.model
+    existing = {
+        user_pk: (pk, (state, role))
+        for user_pk, pk, state, role in team.memberships.select_for_update().filter(
+            user_id__in=list(wanted)
+        ).values_list("user_id", "pk", "state", "role")
+    }
+    targets = []
+    for user_pk, (role, state) in wanted.items():
+        pk, before = existing.get(user_pk, (None, (None, None)))
+        targets.append(((pk, team.pk, user_pk), before, (state, role), team.capacity))
+    to_create, to_update = {}, collections.defaultdict(list)
+    for (pk, team_pk, user_pk), before, after in MembershipQuerySet.waitlist_overflow(type(team), targets):
+        if pk is None:
+            to_create[user_pk] = after
+        elif before != after:
+            to_update[(before, after)].append((pk, user_pk))
+        else:
+            results["unchanged"] += 1
+    now = timezone.now()
+    membership_model.objects.bulk_create([
+        membership_model(team_id=team.pk, user_id=user_pk, state=state, role=role, created=now)
+        for user_pk, (state, role) in to_create.items()
+    ], ignore_conflicts=True)
+    # ignore_conflicts skips users a concurrent request added first
+    created, changes = [], []
+    for pk, user_pk, state, role in team.memberships.filter(
+        user_id__in=list(to_create), created=now
+    ).values_list("pk", "user_id", "state", "role"):
+        created.append((pk, user_pk))
+        changes.append((None, (state, role)))
+    updated = []
+    for (before, after), members in to_update.items():
+        membership_model.objects.filter(pk__in=[pk for pk, user_pk in members]).update(
+            state=after[0], role=after[1]
+        )
+        updated.extend(members)
+        changes.extend([(before, after)] * len(members))
+    type(team).adjust_counts(team.pk, changes)
+    history.record_all(team.memberships.filter(pk__in=[pk for pk, user_pk in created + updated]))
+    results["created"] += len(created)
+    results["unchanged"] += len(to_create) - len(created)
+    results["updated"] += len(updated)
+    seated = BaseMembership.SEATED_STATES
+    if team.capacity is not None and any(
+        before[0] in seated and after[0] not in seated for before, after in to_update
+    ):
+        team.promote_waitlisted()
+    return created, updated
+
+
+def invite_emails(team, inviter, invites, results):
+    for role, emails in invites.items():
+        invited = len(team.invite_users(inviter, emails, role))
+        results["invited"] += invited
+        results["unchanged"] += len(emails) - invited
+
+
+def import_chunk(team, rows, inviter, results):
+    wanted, invites = resolve_users(parse_rows(rows, results), results)
+    created, updated = upsert_memberships(team, wanted, results)
+    invite_emails(team, inviter, invites, results)
+    if created or updated:
+        membership_changed([user_pk for pk, user_pk in created + updated], [team.pk])
+    for signal, members in [(signals.added_members, created), (signals.updated_members, updated)]:
+        if members:
+            signal.send(
+                sender=team,
+                memberships=team.memberships.filter(pk__in=[pk for pk, user_pk in members]),
+                by=inviter
+            )
@@ -0,0 +1,58 @@
+# @@@ kept free of model imports so the WSGI and ASGI middlewares can load
+# before the app registry is ready
+import re
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+TEAM_PATH_RE = re.compile(r"(/teams/([\w-]+))(.*)")
+
+DEFAULT_ALLOWED_PATHS = [
+    r"account/login/$",
+    r"account/signup/",
+    r"ajax/username-validation/",
+    r"account/password/reset/",
+]
+
+
+def match_team_path(path):
+    """
+    Splits a path under /teams/<slug>/ into (script name, slug, path info),
+    or returns None for any other path
+    """
+    m = TEAM_PATH_RE.match(path)
+    if m:
+        return m.groups()
+
+
+_allowed_path_matcher = None
+
+
+def compile_allowed_paths(patterns):
+    alternatives = "|".join(f"(?:{pattern})" for pattern in patterns)
+    return re.compile(rf"^/teams/[\w-]+/(?:{alternatives})")
+
+
+def allowed_path_matcher():
+    """
+    Returns a single precompiled regex matching every team path anonymous
+    users may visit, configured by PINAX_TEAMS_ALLOWED_PATHS
+    """
+    global _allowed_path_matcher
+    if _allowed_path_matcher is None:
+        patterns = getattr(settings, "PINAX_TEAMS_ALLOWED_PATHS", DEFAULT_ALLOWED_PATHS)
+        _allowed_path_matcher = compile_allowed_paths(patterns)
+    return _allowed_path_matcher
+
+
+def reset_allowed_path_matcher(setting, **kwargs):
+    global _allowed_path_matcher
+    if setting == "PINAX_TEAMS_ALLOWED_PATHS":
+        _allowed_path_matcher = None
+
+
+setting_changed.connect(reset_allowed_path_matcher)
+
+
+def is_allowed_path(path):
+    return allowed_path_matcher().match(path) is not None
@@ -0,0 +1,454 @@
+import bisect
+import collections
+import heapq
+import threading
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Min, Value, When
+from django.db.models.functions import Length
+
+from . import models
+from .conf import settings
+from .hooks import hookset
+from .models import UserSearchTerm
+
+# sorts after every character a term can contain, so that prefix searches
+# become index range scans rather than LIKE patterns
+MAX_CHAR = "\U0010ffff"
+
+
+def normalize_term(value):
+    return " ".join(str(value or "").split()).casefold()[:255]
+
+
+def terms_for_user(user):
+    """
+    Returns the (term, weight) pairs user is indexed under
+    """
+    terms = {}
+    for weight, value in enumerate(hookset.get_search_terms(user)):
+        term = normalize_term(value)
+        if term and term not in terms:
+            terms[term] = weight
+    return list(terms.items())
+
+
+def index_users(users):
+    """
+    Replaces the search terms of users with two queries and a bulk insert
+    """
+    users = list(users)
+    with transaction.atomic():
+        UserSearchTerm.objects.filter(user__in=[user.pk for user in users]).delete()
+        UserSearchTerm.objects.bulk_create([
+            UserSearchTerm(user=user, term=term, weight=weight)
+            for user in users
+            for term, weight in terms_for_user(user)
+        ])
+
+
+def reindex_user(user):
+    """
+    Updates the search terms of user if they have changed, returning
+    whether they had
+    """
+    terms = sorted(terms_for_user(user))
+    current = sorted(UserSearchTerm.objects.filter(user=user).values_list("term", "weight"))
+    if terms != current:
+        index_users([user])
+        return True
+    return False
+
+
+# rank_match()'s (inexact, weight, length) tuple packed into one integer,
+# so that its minimum over a user's terms in SQL orders users the same way;
+# terms are at most 255 characters and weights are small integers
+RANK_WEIGHT = 1 << 8
+RANK_INEXACT = 1 << 24
+
+
+def search_users(query, users):
+    """
+    Filters users down to those with a term starting with query, ranked by
+    their best term as rank_match() ranks them: exact matches first, then
+    by term weight and length
+    """
+    term = normalize_term(query)
+    return users.filter(
+        pinax_teams_search_terms__term__gte=term,
+        pinax_teams_search_terms__term__lt=term + MAX_CHAR
+    ).annotate(
+        search_rank=Min(
+            Case(
+                When(pinax_teams_search_terms__term=term, then=Value(0)),
+                default=Value(RANK_INEXACT),
+                output_field=IntegerField()
+            ) +
+            F("pinax_teams_search_terms__weight") * RANK_WEIGHT +
+            Length("pinax_teams_search_terms__term"),
+            output_field=IntegerField()
+        ),
+    ).order_by("search_rank", "pk")
+
+
+def autocomplete_candidates(team):
+    """
+    Users who may be invited to team
+    """
+    return get_user_model().objects.exclude(
+        pk__in=team.memberships.filter(user__isnull=False).values("user")
+    )
+
+
+def autocomplete_queryset(query, team, user):
+    """
+    Returns at most PINAX_TEAMS_AUTOCOMPLETE_LIMIT users matching query who
+    are neither user nor on team, or nothing for a query shorter than
+    PINAX_TEAMS_AUTOCOMPLETE_MIN_LENGTH
+    """
+    if len(normalize_term(query)) < settings.PINAX_TEAMS_AUTOCOMPLETE_MIN_LENGTH:
+        return get_user_model().objects.none()
+    users = autocomplete_candidates(team).exclude(pk=user.pk)
+    return hookset.search_queryset(query, users)[:settings.PINAX_TEAMS_AUTOCOMPLETE_LIMIT]
+
+
+def autocomplete_results(query, team, user):
+    """
+    Returns the autocomplete results for query from the in-process prefix
+    index when it is enabled and can hold every user, else through the
+    autocomplete cache when it is enabled, or else from the database
+    """
+    if settings.PINAX_TEAMS_AUTOCOMPLETE_INDEX:
+        results = prefix_index.search(query, team, user)
+        if results is not None:
+            return results
+    if settings.PINAX_TEAMS_AUTOCOMPLETE_CACHE:
+        return autocomplete_cache.search(query, team, user)
+    return [hookset.get_autocomplete_result(u) for u in autocomplete_queryset(query, team, user)]
+
+
+def rank_match(term, terms):
+    """
+    Returns the rank search_users() orders a user with the given terms by
+    for term, or None if none of them start with it
+    """
+    ranks = [(t != term, weight, len(t)) for t, weight in terms if t.startswith(term)]
+    if ranks:
+        return min(ranks)
+
+
+class AutocompleteCache:
+    """
+    Bounded in-process LRU of autocomplete matches keyed by team and
+    normalized query, each expiring after PINAX_TEAMS_AUTOCOMPLETE_CACHE_TIMEOUT
+    seconds. A query that is not cached is answered by filtering and
+    reranking the matches of its longest cached prefix, when those are
+    complete, before falling back to hookset.search_queryset. Entries are
+    dropped by user changes and by membership changes on their team through
+    version keys in Django's cache, so every process sees them.
+    """
+
+    users_version_key = "pinax-teams:autocomplete-users-version"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = collections.OrderedDict()
+        self.stats = collections.Counter()
+
+    def team_version_key(self, team_pk):
+        return f"pinax-teams:autocomplete-team-version:{team_pk}"
+
+    def get_versions(self, team_pk):
+        keys = [self.users_version_key, self.team_version_key(team_pk)]
+        versions = cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                cache.add(key, uuid.uuid4().hex, None)
+                versions[key] = cache.get(key)
+        return tuple(versions[key] for key in keys)
+
+    def get(self, team_pk, term, versions):
+        with self.lock:
+            entry = self.local.get((team_pk, term))
+            if entry is None:
+                return None
+            if entry[0] != versions or entry[1] < time.monotonic():
+                del self.local[(team_pk, term)]
+                return None
+            self.local.move_to_end((team_pk, term))
+            return entry
+
+    def set(self, team_pk, term, versions, matches, complete):
+        expires = time.monotonic() + settings.PINAX_TEAMS_AUTOCOMPLETE_CACHE_TIMEOUT
+        with self.lock:
+            self.local[(team_pk, term)] = (versions, expires, matches, complete)
+            self.local.move_to_end((team_pk, term))
+            while len(self.local) > settings.PINAX_TEAMS_AUTOCOMPLETE_CACHE_SIZE:
+                self.local.popitem(last=False)
+
+    def refine(self, team_pk, term, versions):
+        for length in range(len(term) - 1, settings.PINAX_TEAMS_AUTOCOMPLETE_MIN_LENGTH - 1, -1):
+            entry = self.get(team_pk, term[:length], versions)
+            if entry is not None and entry[3]:
+                ranked = []
+                for pk, terms, result in entry[2]:
+                    rank = rank_match(term, terms)
+                    if rank is not None:
+                        ranked.append((rank, pk, terms, result))
+                ranked.sort(key=lambda match: match[:2])
+                return [match[1:] for match in ranked]
+
+    def fetch(self, term, team):
+        limit = settings.PINAX_TEAMS_AUTOCOMPLETE_CACHE_MATCHES
+        users = list(hookset.search_queryset(term, autocomplete_candidates(team))[:limit + 1])
+        matches = [
+            (user.pk, terms_for_user(user), hookset.get_autocomplete_result(user))
+            for user in users[:limit]
+        ]
+        return matches, len(users) <= limit
+
+    def search(self, query, team, user):
+        """
+        Returns the results autocomplete_queryset() would
+        """
+        term = normalize_term(query)
+        if len(term) < settings.PINAX_TEAMS_AUTOCOMPLETE_MIN_LENGTH:
+            return []
+        versions = self.get_versions(team.pk)
+        entry = self.get(team.pk, term, versions)
+        if entry is not None:
+            self.stats["hits"] += 1
+            matches = entry[2]
+        else:
+            matches = self.refine(team.pk, term, versions)
+            if matches is not None:
+                self.stats["refinements"] += 1
+                complete = True
+            else:
+                self.stats["misses"] += 1
+                matches, complete = self.fetch(term, team)
+            self.set(team.pk, term, versions, matches, complete)
+        results = []
+        for pk, terms, result in matches:
+            if len(results) == settings.PINAX_TEAMS_AUTOCOMPLETE_LIMIT:
+                break
+            if pk != user.pk:
+                results.append(dict(result))
+        return results
+
+    def invalidate_users(self):
+        cache.set(self.users_version_key, uuid.uuid4().hex, None)
+
+    def invalidate_teams(self, team_pks):
+        cache.set_many({self.team_version_key(pk): uuid.uuid4().hex for pk in team_pks}, None)
+
+    def clear(self):
+        with self.lock:
+            self.local.clear()
+            self.stats.clear()
+
+
+class PrefixIndex:
+    """
+    In-process autocomplete index: every user search term in a sorted array,
+    so that a lookup is a binary search and a short scan with no database
+    query. Built at first use and kept current from user saves and deletes.
+    Changes made by other processes, and rebuild_autocomplete_index, bump a
+    shared version in the cache which is checked at most every
+    PINAX_TEAMS_AUTOCOMPLETE_INDEX_TIMEOUT seconds. Sites with more than
+    PINAX_TEAMS_AUTOCOMPLETE_INDEX_SIZE users are not indexed.
+    """
+
+    version_key = "pinax-teams:autocomplete-index-version"
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # counts changes applied to the index, so that a build can tell
+        # whether any were made while it was loading
+        self.changes = 0
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.terms = []
+            self.keys = []
+            self.user_terms = {}
+            self.results = {}
+            self.members = {}
+            self.version = None
+            self.checked = None
+            self.overflow = False
+
+    def get_version(self):
+        cache.add(self.version_key, 0, None)
+        return cache.get(self.version_key)
+
+    def bump_version(self):
+        cache.add(self.version_key, 0, None)
+        try:
+            version = cache.incr(self.version_key)
+        except ValueError:
+            return
+        with self.lock:
+            if self.version is not None and version == self.version + 1:
+                self.version = version
+            else:
+                self.checked = None
+
+    def invalidate(self):
+        """
+        Makes this and every other process rebuild its index
+        """
+        cache.add(self.version_key, 0, None)
+        cache.incr(self.version_key)
+        with self.lock:
+            self.changes += 1
+            self.checked = None
+
+    def ensure_current(self):
+        now = time.monotonic()
+        with self.lock:
+            checked, current = self.checked, self.version
+        if checked is not None and now - checked < settings.PINAX_TEAMS_AUTOCOMPLETE_INDEX_TIMEOUT:
+            return
+        version = self.get_version()
+        if checked is None or version != current:
+            self.build(version, now)
+        else:
+            with self.lock:
+                self.members.clear()
+                self.checked = now
+
+    def build(self, version, now):
+        """
+        Loads the index without holding the lock, which is taken only to
+        swap the new structures in
+        """
+        with self.lock:
+            changes = self.changes
+        loaded = self.load()
+        with self.lock:
+            self.reset()
+            self.version = version
+            if loaded is None:
+                self.overflow = True
+            else:
+                self.terms, self.keys, self.user_terms, self.results = loaded
+            # a user saved during the load may be missing from it
+            self.checked = now if self.changes == changes else None
+
+    def load(self):
+        """
+        Returns (terms, keys, user_terms, results) for every user, or None if
+        there are more than PINAX_TEAMS_AUTOCOMPLETE_INDEX_SIZE
+        """
+        users = get_user_model().objects.order_by("pk")
+        if users.count() > settings.PINAX_TEAMS_AUTOCOMPLETE_INDEX_SIZE:
+            return None
+        results = {}
+        user_terms = {}
+        rows = []
+        for user in users.iterator(chunk_size=2000):
+            results[user.pk] = hookset.get_autocomplete_result(user)
+            user_terms[user.pk] = terms_for_user(user)
+            rows.extend((term, weight, user.pk) for term, weight in user_terms[user.pk])
+        rows.sort()
+        terms = [term for term, weight, pk in rows]
+        keys = [(weight, len(term), pk) for term, weight, pk in rows]
+        return terms, keys, user_terms, results
+
+    def remove(self, pk):
+        for term, weight in self.user_terms.pop(pk, []):
+            i = bisect.bisect_left(self.terms, term)
+            while i < len(self.terms) and self.terms[i] == term:
+                if self.keys[i][2] == pk:
+                    del self.terms[i]
+                    del self.keys[i]
+                    break
+                i += 1
+        self.results.pop(pk, None)
+
+    def update_user(self, user):
+        with self.lock:
+            self.changes += 1
+            if self.checked is not None and not self.overflow:
+                self.remove(user.pk)
+                if user.pk not in self.results and len(self.results) >= settings.PINAX_TEAMS_AUTOCOMPLETE_INDEX_SIZE:
+                    self.checked = None
+                else:
+                    self.results[user.pk] = hookset.get_autocomplete_result(user)
+                    self.user_terms[user.pk] = terms_for_user(user)
+                    for term, weight in self.user_terms[user.pk]:
+                        i = bisect.bisect_left(self.terms, term)
+                        self.terms.insert(i, term)
+                        self.keys.insert(i, (weight, len(term), user.pk))
+        self.bump_version()
+
+    def remove_user(self, pk):
+        with self.lock:
+            self.changes += 1
+            if self.checked is not None:
+                self.remove(pk)
+        self.bump_version()
+
+    def get_members(self, team):
+        version = models._membership_version
+        with self.lock:
+            entry = self.members.get(team.pk)
+        if entry is None or entry[0] != version:
+            entry = (
+                version,
+                set(team.memberships.filter(user__isnull=False).values_list("user_id", flat=True))
+            )
+            with self.lock:
+                if len(self.members) >= settings.PINAX_TEAMS_TEAM_CACHE_SIZE:
+                    self.members.clear()
+                self.members[team.pk] = entry
+        return entry[1]
+
+    def search(self, query, team, user):
+        """
+        Returns the results autocomplete_queryset() would, or None if the
+        index is over its size limit
+        """
+        term = normalize_term(query)
+        self.ensure_current()
+        if self.overflow:
+            return None
+        if len(term) < settings.PINAX_TEAMS_AUTOCOMPLETE_MIN_LENGTH:
+            return []
+        excluded = self.get_members(team) | {user.pk}
+        with self.lock:
+            limit = settings.PINAX_TEAMS_AUTOCOMPLETE_LIMIT
+            lo = bisect.bisect_left(self.terms, term)
+            hi = bisect.bisect_left(self.terms, term + MAX_CHAR, lo)
+            exact_hi = bisect.bisect_right(self.terms, term, lo, hi)
+            # exact matches rank first, then prefix matches by (weight,
+            # length, pk), which do not depend on the query, so only the
+            # smallest few keys of the range need ordering
+            exact = sorted(self.keys[lo:exact_hi])
+            prefixed = self.keys[exact_hi:hi]
+            n = limit
+            while True:
+                if n < len(prefixed):
+                    best = heapq.nsmallest(n, prefixed)
+                else:
+                    best = sorted(prefixed)
+                pks = []
+                seen = set(excluded)
+                for weight, length, pk in exact + best:
+                    if pk not in seen:
+                        seen.add(pk)
+                        pks.append(pk)
+                if len(pks) >= limit or len(best) == len(prefixed):
+                    break
+                n *= 4
+            return [dict(self.results[pk]) for pk in pks[:limit]]
+
+
+prefix_index = PrefixIndex()
+autocomplete_cache = AutocompleteCache()
@@ -8,3 +8,22 @@ accepted_membership = django.dispatch.Signal()
 rejected_membership = django.dispatch.Signal()
 resent_invite = django.dispatch.Signal()
 removed_membership = django.dispatch.Signal()
+removed_member = django.dispatch.Signal()
+joined_team = django.dispatch.Signal()
+applied_to_team = django.dispatch.Signal()
+left_team = django.dispatch.Signal()
+
+# batched counterparts sent once per bulk operation with a memberships queryset
+added_members = django.dispatch.Signal()
+invited_users = django.dispatch.Signal()
+promoted_members = django.dispatch.Signal()
+demoted_members = django.dispatch.Signal()
+accepted_memberships = django.dispatch.Signal()
+rejected_memberships = django.dispatch.Signal()
+joined_teams = django.dispatch.Signal()
+# sent for memberships a roster import moved to another role or state
+updated_members = django.dispatch.Signal()
+
+# sent with the ids of users and teams whose memberships changed, for cache
+# invalidation
+memberships_changed = django.dispatch.Signal()
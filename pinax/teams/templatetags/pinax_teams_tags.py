@@ -1,5 +1,7 @@
 from django import template
+from django.core.cache import cache
 
+from ..conf import settings
 from ..models import Team
 
 register = template.Library()
@@ -12,21 +14,35 @@ class AvailableTeamsNode(template.Node):
         bits = token.split_contents()
         if len(bits) == 3 and bits[1] == "as":
             return cls(bits[2])
+        elif len(bits) == 5 and bits[1] == "limit" and bits[3] == "as":
+            return cls(bits[4], limit=parser.compile_filter(bits[2]))
         else:
-            raise template.TemplateSyntaxError("%r takes 'as var'" % bits[0])
+            raise template.TemplateSyntaxError("%r takes '[limit n] as var'" % bits[0])
 
-    def __init__(self, context_var):
+    def __init__(self, context_var, limit=None):
         self.context_var = context_var
+        self.limit = limit
+
+    def get_teams(self, user, limit):
+        teams = Team.objects.available_to(user).order_by("name", "pk")
+        if limit is not None:
+            teams = teams[:limit]
+        return list(teams)
 
     def render(self, context):
         request = context["request"]
-        teams = []
-        for team in Team.objects.all():
-            state = team.state_for(request.user)
-            if team.member_access == Team.MEMBER_ACCESS_OPEN and state is None:
-                teams.append(team)
-            elif request.user.is_staff and state is None:
-                teams.append(team)
+        limit = None
+        if self.limit is not None:
+            limit = int(self.limit.resolve(context))
+        timeout = settings.PINAX_TEAMS_AVAILABLE_TEAMS_CACHE_TIMEOUT
+        if timeout is None:
+            teams = self.get_teams(request.user, limit)
+        else:
+            key = f"pinax-teams:available-teams:{request.user.pk}:{limit}"
+            teams = cache.get(key)
+            if teams is None:
+                teams = self.get_teams(request.user, limit)
+                cache.set(key, teams, timeout)
         context[self.context_var] = teams
         return ""
 
@@ -35,5 +51,6 @@ class AvailableTeamsNode(template.Node):
 def available_teams(parser, token):
     """
     {% available_teams as available_teams %}
+    {% available_teams limit 10 as available_teams %}
     """
     return AvailableTeamsNode.handle_token(parser, token)
@@ -0,0 +1,10 @@
+from django.conf import settings
+from django.db import models
+
+from pinax.teams.models import Team
+
+
+class Profile(models.Model):
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="team_profiles", on_delete=models.CASCADE)
+    team = models.ForeignKey(Team, null=True, related_name="profiles", on_delete=models.CASCADE)
@@ -1,10 +1,68 @@
+import asyncio
+import csv
+import io
+import itertools
 import json
-
-from django.contrib.auth.models import User
-
-from pinax.teams.models import Membership, Team, avatar_upload
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipIf, skipUnless
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core import mail
+from django.core.management import call_command
+from django.db import (
+    IntegrityError,
+    close_old_connections,
+    connection,
+    transaction,
+)
+from django.db.models import QuerySet
+from django.http import Http404, HttpResponse
+from django.template import Context, Template
+from django.test import (
+    AsyncRequestFactory,
+    RequestFactory,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+
+from asgiref.sync import sync_to_async
+from pinax.teams import signals
+from pinax.teams.asgi_middleware import ASGITeamMiddleware
+from pinax.teams.cache import team_cache
+from pinax.teams.decorators import manager_required
+from pinax.teams.forms import TeamBulkInviteForm, TeamForm
+from pinax.teams.middleware import TeamMiddleware
+from pinax.teams.models import (
+    Membership,
+    MembershipEvent,
+    OutboxMessage,
+    SimpleMembership,
+    SimpleTeam,
+    Team,
+    UserSearchTerm,
+    avatar_upload,
+    transition_matrix,
+)
+from pinax.teams.roster import import_roster
+from pinax.teams.routing import is_allowed_path
+from pinax.teams.search import (
+    autocomplete_cache,
+    autocomplete_queryset,
+    autocomplete_results,
+    prefix_index,
+)
+from pinax.teams.wsgi_middleware import WSGITeamMiddleware
+from reversion import revisions as reversion
+from reversion.models import Version
 from test_plus.test import TestCase
 
+from .models import Profile
+
 
 class BaseTeamTests(TestCase):
 
@@ -83,188 +141,121 @@ class TeamTests(BaseTeamTests):
         self.assertTrue(team.is_on_team(self.user))
 
 
-class ManagerAddMemberOpenTests(BaseTeamTests):
-
-    MANAGER_ACCESS = Team.MANAGER_ACCESS_ADD
-    MEMBER_ACCESS = Team.MEMBER_ACCESS_OPEN
-
-    def test_cannot_apply(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        team.add_user(paltman, Membership.ROLE_MEMBER)
-        self.assertFalse(team.can_apply(paltman))
-
-    def test_can_apply(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        self.assertFalse(team.can_apply(paltman))
-
-    def test_can_join_non_member(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        self.assertTrue(team.can_join(paltman))
-
-    def test_can_join_invited(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        membership = team.add_user(paltman, Membership.ROLE_MEMBER)
-        membership.state = Membership.STATE_INVITED
-        membership.save()
-        self.assertTrue(team.can_join(User.objects.get(username="paltman")))
-
-    def test_can_join_declined(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        team.add_user(paltman, Membership.STATE_DECLINED)
-        self.assertFalse(team.can_join(paltman))
-
-
-class ManagerAddMemberApplicationTests(BaseTeamTests):
-
-    MANAGER_ACCESS = Team.MANAGER_ACCESS_ADD
-    MEMBER_ACCESS = Team.MEMBER_ACCESS_APPLICATION
-
-    def test_cannot_apply(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        team.add_user(paltman, Membership.ROLE_MEMBER)
-        self.assertFalse(team.can_apply(paltman))
-
-    def test_can_apply(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        self.assertTrue(team.can_apply(paltman))
-
-    def test_can_join_non_member(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        self.assertFalse(team.can_join(paltman))
-
-    def test_can_join_invited(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        membership = team.add_user(paltman, Membership.ROLE_MEMBER)
-        membership.state = Membership.STATE_INVITED
-        membership.save()
-        self.assertTrue(team.can_join(User.objects.get(username="paltman")))
-
-    def test_can_join_declined(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        team.add_user(paltman, Membership.STATE_DECLINED)
-        self.assertFalse(team.can_join(paltman))
-
-
-class ManagerAddMemberInvitationTests(BaseTeamTests):
-
-    MANAGER_ACCESS = Team.MANAGER_ACCESS_ADD
-    MEMBER_ACCESS = Team.MEMBER_ACCESS_INVITATION
-
-    def test_cannot_apply(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        team.add_user(paltman, Membership.ROLE_MEMBER)
-        self.assertFalse(team.can_apply(paltman))
-
-    def test_can_apply(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        self.assertFalse(team.can_apply(paltman))
-
-    def test_can_join_non_member(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        self.assertFalse(team.can_join(paltman))
-
-    def test_can_join_invited(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        membership = team.add_user(paltman, Membership.ROLE_MEMBER)
-        membership.state = Membership.STATE_INVITED
-        membership.save()
-        self.assertTrue(team.can_join(User.objects.get(username="paltman")))
-
-    def test_can_join_declined(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        team.add_user(paltman, Membership.STATE_DECLINED)
-        self.assertFalse(team.can_join(paltman))
-
-
-class ManagerInviteMemberOpenTests(BaseTeamTests):
-
-    MANAGER_ACCESS = Team.MANAGER_ACCESS_INVITE
-    MEMBER_ACCESS = Team.MEMBER_ACCESS_OPEN
-
-    def test_cannot_apply(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        team.add_user(paltman, Membership.ROLE_MEMBER)
-        self.assertFalse(team.can_apply(paltman))
-
-    def test_can_apply(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        self.assertFalse(team.can_apply(paltman))
-
-    def test_can_join_non_member(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        self.assertTrue(team.can_join(paltman))
-
-    def test_can_join_invited(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        membership = team.add_user(paltman, Membership.ROLE_MEMBER)
-        membership.state = Membership.STATE_INVITED
-        membership.save()
-        self.assertTrue(team.can_join(User.objects.get(username="paltman")))
-
-    def test_can_join_declined(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        membership = team.add_user(paltman, Membership.ROLE_MEMBER)
-        membership.state = Membership.STATE_DECLINED
-        membership.save()
-        self.assertFalse(team.can_join(paltman))
-
-
-class ManagerInviteMemberApplicationTests(BaseTeamTests):
-
-    MANAGER_ACCESS = Team.MANAGER_ACCESS_INVITE
-    MEMBER_ACCESS = Team.MEMBER_ACCESS_APPLICATION
-
-    def test_cannot_apply(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        team.add_user(paltman, Membership.ROLE_MEMBER)
-        self.assertFalse(team.can_apply(paltman))
-
-    def test_can_apply(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        self.assertTrue(team.can_apply(paltman))
-
-    def test_can_join_non_member(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        self.assertFalse(team.can_join(paltman))
-
-    def test_can_join_invited(self):
-        team = self._create_team()
+class TransitionTableTests(BaseTeamTests):
+    """
+    Checks the transition matrix against the membership rules written out
+    by hand, for every combination of team access modes, state and role
+    """
+
+    STATES = [None] + [state for state, label in Membership.STATE_CHOICES]
+    ROLES = [role for role, label in Membership.ROLE_CHOICES]
+    ACCESS = list(itertools.product(
+        [access for access, label in Team.MEMBER_ACCESS_CHOICES],
+        [access for access, label in Team.MANAGER_ACCESS_CHOICES],
+    ))
+    MANAGER_ROLES = [Membership.ROLE_MANAGER, Membership.ROLE_OWNER]
+
+    def expected(self, member_access, manager_access, state, role):
+        allowed = {
+            "view": member_access != Team.MEMBER_ACCESS_INVITATION or state is not None or role in self.MANAGER_ROLES,
+            "join": (member_access == Team.MEMBER_ACCESS_OPEN and state is None) or state == Membership.STATE_INVITED,
+            "apply": member_access == Team.MEMBER_ACCESS_APPLICATION and state is None,
+            "leave": state is not None and role == Membership.ROLE_MEMBER,
+            "add": state is None,
+            "accept": state == Membership.STATE_APPLIED,
+            "reject": state == Membership.STATE_APPLIED,
+            "accept_invite": state == Membership.STATE_INVITED,
+            "admit": state == Membership.STATE_WAITLISTED,
+            "promote": state is not None and role == Membership.ROLE_MEMBER,
+            "demote": state is not None and role == Membership.ROLE_MANAGER,
+        }
+        return {action: allowed[action] for action in transition_matrix.actions}
+
+    def cases(self):
+        for member_access, manager_access in self.ACCESS:
+            for state in self.STATES:
+                # without a membership, only staff have a role
+                for role in [None, Membership.ROLE_MANAGER] if state is None else self.ROLES:
+                    yield member_access, manager_access, state, role
+
+    def test_matrix_matches_rules(self):
+        for case in self.cases():
+            for action, allowed in self.expected(*case).items():
+                with self.subTest(case=case, action=action):
+                    self.assertEqual(transition_matrix.get(*case, action) is not None, allowed)
+
+    def test_targets(self):
+        targets = {
+            "accept": (Membership.STATE_APPLIED, Membership.ROLE_MEMBER, Membership.STATE_ACCEPTED, Membership.ROLE_MEMBER),
+            "reject": (Membership.STATE_APPLIED, Membership.ROLE_MEMBER, Membership.STATE_REJECTED, Membership.ROLE_MEMBER),
+            "accept_invite": (Membership.STATE_INVITED, Membership.ROLE_MANAGER, Membership.STATE_ACCEPTED, Membership.ROLE_MANAGER),
+            "join": (Membership.STATE_INVITED, Membership.ROLE_MANAGER, Membership.STATE_AUTO_JOINED, Membership.ROLE_MEMBER),
+            "admit": (Membership.STATE_WAITLISTED, Membership.ROLE_MEMBER, Membership.STATE_AUTO_JOINED, Membership.ROLE_MEMBER),
+            "promote": (Membership.STATE_ACCEPTED, Membership.ROLE_MEMBER, Membership.STATE_ACCEPTED, Membership.ROLE_MANAGER),
+            "demote": (Membership.STATE_ACCEPTED, Membership.ROLE_MANAGER, Membership.STATE_ACCEPTED, Membership.ROLE_MEMBER),
+            "leave": (Membership.STATE_ACCEPTED, Membership.ROLE_MEMBER, None, None),
+        }
+        for member_access, manager_access in self.ACCESS:
+            for action, (state, role, to_state, to_role) in targets.items():
+                with self.subTest(access=(member_access, manager_access), action=action):
+                    self.assertEqual(
+                        transition_matrix.get(member_access, manager_access, state, role, action),
+                        (to_state, to_role)
+                    )
+            added, _ = transition_matrix.get(member_access, manager_access, None, None, "add")
+            self.assertEqual(added, {
+                Team.MANAGER_ACCESS_ADD: Membership.STATE_AUTO_JOINED,
+                Team.MANAGER_ACCESS_INVITE: Membership.STATE_INVITED,
+            }[manager_access])
+
+    def test_snapshots_follow_table(self):
         paltman = self.make_user("paltman")
-        membership = team.add_user(paltman, Membership.ROLE_MEMBER)
-        membership.state = Membership.STATE_INVITED
-        membership.save()
-        self.assertTrue(team.can_join(User.objects.get(username="paltman")))
-
-    def test_can_join_declined(self):
-        team = self._create_team()
+        for i, ((member_access, manager_access), state) in enumerate(itertools.product(self.ACCESS, self.STATES)):
+            team = Team.objects.create(
+                name=f"Team {i}", creator=self.user, member_access=member_access, manager_access=manager_access
+            )
+            if state is not None:
+                team.memberships.create(user=paltman, state=state, role=Membership.ROLE_MEMBER)
+            role = None if state is None else Membership.ROLE_MEMBER
+            expected = self.expected(member_access, manager_access, state, role)
+            snapshot = team.snapshot_for(paltman)
+            with self.subTest(access=(member_access, manager_access), state=state):
+                self.assertEqual(
+                    (snapshot.can_view, snapshot.can_join, snapshot.can_apply, snapshot.can_leave),
+                    (expected["view"], expected["join"], expected["apply"], expected["leave"])
+                )
+                self.assertEqual(
+                    (team.can_join(paltman), team.can_apply(paltman), team.can_leave(paltman)),
+                    (expected["join"], expected["apply"], expected["leave"])
+                )
+
+    def test_add_user_follows_manager_access(self):
+        for i, (member_access, manager_access) in enumerate(self.ACCESS):
+            team = Team.objects.create(
+                name=f"Team {i}", creator=self.user, member_access=member_access, manager_access=manager_access
+            )
+            membership = team.add_user(self.make_user(f"user{i}"), Membership.ROLE_MEMBER)
+            with self.subTest(access=(member_access, manager_access)):
+                self.assertEqual(membership.state, {
+                    Team.MANAGER_ACCESS_ADD: Membership.STATE_AUTO_JOINED,
+                    Team.MANAGER_ACCESS_INVITE: Membership.STATE_INVITED,
+                }[manager_access])
+
+    def test_invitation_only_team_hides_membership_pages(self):
+        team = Team.objects.create(
+            name="Eldarion", creator=self.user,
+            member_access=Team.MEMBER_ACCESS_INVITATION, manager_access=Team.MANAGER_ACCESS_INVITE
+        )
         paltman = self.make_user("paltman")
-        membership = team.add_user(paltman, Membership.ROLE_MEMBER)
-        membership.state = Membership.STATE_DECLINED
-        membership.save()
-        self.assertFalse(team.can_join(paltman))
+        with self.login(paltman):
+            self.post("pinax_teams:team_join", slug=team.slug)
+            self.response_404()
+        staff = self.make_user("staff")
+        staff.is_staff = True
+        staff.save()
+        with self.login(staff):
+            self.post("pinax_teams:team_join", slug=team.slug)
+            self.response_302()
 
     def test_add_member_twice_does_not_duplicate(self):
         team = self._create_team()
@@ -275,44 +266,6 @@ class ManagerInviteMemberApplicationTests(BaseTeamTests):
         self.assertEqual(team.memberships.count(), 2)
 
 
-class ManagerInviteMemberInvitationTests(BaseTeamTests):
-
-    MANAGER_ACCESS = Team.MANAGER_ACCESS_INVITE
-    MEMBER_ACCESS = Team.MEMBER_ACCESS_INVITATION
-
-    def test_cannot_apply(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        team.add_user(paltman, Membership.ROLE_MEMBER)
-        self.assertFalse(team.can_apply(paltman))
-
-    def test_can_apply(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        self.assertFalse(team.can_apply(paltman))
-
-    def test_can_join_non_member(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        self.assertFalse(team.can_join(paltman))
-
-    def test_can_join_invited(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        membership = team.add_user(paltman, Membership.ROLE_MEMBER)
-        membership.state = Membership.STATE_INVITED
-        membership.save()
-        self.assertTrue(team.can_join(User.objects.get(username="paltman")))
-
-    def test_can_join_declined(self):
-        team = self._create_team()
-        paltman = self.make_user("paltman")
-        membership = team.add_user(paltman, Membership.ROLE_MEMBER)
-        membership.state = Membership.STATE_DECLINED
-        membership.save()
-        self.assertFalse(team.can_join(paltman))
-
-
 class ViewTests(BaseTeamTests):
 
     MANAGER_ACCESS = Team.MANAGER_ACCESS_INVITE
@@ -425,3 +378,1332 @@ class ViewTests(BaseTeamTests):
             json_data = json.loads(self.last_response.content.decode("utf-8"))
             self.assertIn("html", json_data)
             self.assertNotIn("append-fragments", json_data)
+
+
+class MembershipSnapshotTests(BaseTeamTests):
+
+    def test_snapshot_single_query(self):
+        team = self._create_team()
+        with self.assertNumQueries(1):
+            snapshot = team.snapshot_for(self.user)
+            self.assertEqual(snapshot.state, Membership.STATE_AUTO_JOINED)
+            self.assertEqual(snapshot.role, Membership.ROLE_OWNER)
+            self.assertTrue(snapshot.can_manage)
+            self.assertFalse(snapshot.can_join)
+            self.assertFalse(snapshot.can_leave)
+            self.assertFalse(snapshot.can_apply)
+
+    def test_snapshot_anonymous_user(self):
+        team = self._create_team()
+        with self.assertNumQueries(0):
+            snapshot = team.snapshot_for(AnonymousUser())
+        self.assertIsNone(snapshot.membership)
+        self.assertIsNone(snapshot.role)
+        self.assertTrue(snapshot.can_join)
+
+    def test_snapshot_staff_override(self):
+        team = self._create_team()
+        staff = self.make_user("staff")
+        staff.is_staff = True
+        snapshot = team.snapshot_for(staff)
+        self.assertIsNone(snapshot.state)
+        self.assertEqual(snapshot.role, Membership.ROLE_MANAGER)
+        self.assertTrue(snapshot.can_manage)
+
+
+class RequestTeamMembershipTests(BaseTeamTests):
+
+    def test_manager_required_shares_membership_with_view(self):
+        team = self._create_team()
+
+        @manager_required
+        def view(request):
+            self.assertEqual(request.team.role_for(request.user), Membership.ROLE_OWNER)
+            self.assertFalse(request.team.can_leave(request.user))
+            self.assertTrue(request.team_membership.can_manage)
+            return HttpResponse()
+
+        request = RequestFactory().get("/")
+        request.user = self.user
+        # one query for the team, one for the membership
+        with self.assertNumQueries(2):
+            view(request, slug=team.slug)
+
+    def test_memoized_snapshot_invalidated_by_membership_change(self):
+        team = self._create_team()
+        team.memoize_snapshots()
+        paltman = self.make_user("paltman")
+        self.assertIsNone(team.state_for(paltman))
+        with self.assertNumQueries(0):
+            self.assertTrue(team.can_join(paltman))
+        team.add_member(paltman)
+        self.assertEqual(team.state_for(paltman), Membership.STATE_AUTO_JOINED)
+        self.assertTrue(team.can_leave(paltman))
+
+
+class AvailableTeamsTests(TestCase):
+
+    def setUp(self):
+        self.user = self.make_user("jtauber")
+        self.other = self.make_user("paltman")
+        self.open = Team.objects.create(
+            name="Open", creator=self.other,
+            member_access=Team.MEMBER_ACCESS_OPEN, manager_access=Team.MANAGER_ACCESS_ADD
+        )
+        self.joined = Team.objects.create(
+            name="Joined", creator=self.other,
+            member_access=Team.MEMBER_ACCESS_OPEN, manager_access=Team.MANAGER_ACCESS_ADD
+        )
+        self.joined.add_member(self.user)
+        self.closed = Team.objects.create(
+            name="Closed", creator=self.other,
+            member_access=Team.MEMBER_ACCESS_INVITATION, manager_access=Team.MANAGER_ACCESS_ADD
+        )
+
+    def test_available_to(self):
+        self.assertEqual(list(Team.objects.available_to(self.user)), [self.open])
+
+    def test_available_to_staff(self):
+        self.user.is_staff = True
+        self.assertEqual(
+            set(Team.objects.available_to(self.user)),
+            {self.open, self.closed}
+        )
+
+    def test_available_teams_tag(self):
+        self.make_user("someone").teams_created.create(
+            name="Another", member_access=Team.MEMBER_ACCESS_OPEN, manager_access=Team.MANAGER_ACCESS_ADD
+        )
+        request = RequestFactory().get("/")
+        request.user = self.user
+        context = Context({"request": request})
+        template = Template("{% load pinax_teams_tags %}{% available_teams limit 1 as teams %}")
+        with self.assertNumQueries(1):
+            template.render(context)
+        self.assertEqual([team.name for team in context["teams"]], ["Another"])
+
+
+class TeamCountTests(BaseTeamTests):
+
+    def assertCounts(self, team, **counts):
+        team.refresh_from_db()
+        for field in Team.count_filters():
+            self.assertEqual(getattr(team, field), counts.get(field, 0), field)
+
+    def test_counts_follow_membership_changes(self):
+        team = self._create_team()
+        self.assertCounts(team, owner_count=1)
+        paltman = self.make_user("paltman")
+        membership = team.add_member(paltman)
+        self.assertCounts(team, owner_count=1, member_count=1)
+        membership.promote(by=self.user)
+        self.assertCounts(team, owner_count=1, manager_count=1)
+        membership.demote(by=self.user)
+        self.assertCounts(team, owner_count=1, member_count=1)
+        membership.remove(by=self.user)
+        self.assertCounts(team, owner_count=1)
+
+    def test_counts_follow_application(self):
+        team = self._create_team()
+        membership = team.add_member(self.make_user("paltman"), state=Membership.STATE_APPLIED)
+        self.assertCounts(team, owner_count=1, applicant_count=1)
+        membership.accept(by=self.user)
+        self.assertCounts(team, owner_count=1, member_count=1)
+
+    def test_saving_stale_team_keeps_counts(self):
+        team = self._create_team()
+        team.add_member(self.make_user("paltman"))
+        team.description = "updated"
+        team.save()
+        self.assertCounts(team, owner_count=1, member_count=1)
+
+    def test_stale_form_save_keeps_concurrent_counts(self):
+        team = self._create_team()
+        stale = Team.objects.get(pk=team.pk)
+        for username in ["paltman", "brosner"]:
+            team.add_member(self.make_user(username))
+        data = {
+            "name": team.name,
+            "description": "updated",
+            "member_access": team.member_access,
+            "manager_access": team.manager_access,
+        }
+        form = TeamForm(data, instance=stale)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertCounts(team, owner_count=1, member_count=2)
+        team.add_member(self.make_user("lukeman"))
+        with self.login(self.user):
+            self.post("pinax_teams:team_update", slug=team.slug, data=data)
+        self.response_302()
+        self.assertCounts(team, owner_count=1, member_count=3)
+
+    def test_recount_teams_repairs_drift(self):
+        team = self._create_team()
+        team.add_member(self.make_user("paltman"))
+        Team.objects.update(member_count=42, owner_count=0)
+        call_command("recount_teams", batch_size=1, stdout=io.StringIO())
+        self.assertCounts(team, owner_count=1, member_count=1)
+
+
+@skipUnless(connection.vendor == "sqlite", "query plans are checked on SQLite")
+class MembershipQueryPlanTests(BaseTeamTests):
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        self.assertRegex(plan, r"USING (COVERING )?INDEX")
+        self.assertNotIn("SCAN", plan)
+
+    def test_team_membership_queries_use_indexes(self):
+        team = self._create_team()
+        self.assertUsesIndex(team.memberships.filter(user=self.user))
+        self.assertUsesIndex(team.acceptances)
+        self.assertUsesIndex(team.members)
+        self.assertUsesIndex(team.managers)
+        self.assertUsesIndex(team.owners)
+        self.assertUsesIndex(team.applicants)
+        self.assertUsesIndex(team.acceptances.filter(
+            role__in=[Membership.ROLE_OWNER, Membership.ROLE_MANAGER],
+            user=self.user
+        ))
+        self.assertUsesIndex(Membership.objects.filter(
+            user=self.user,
+            state__in=[Membership.STATE_ACCEPTED, Membership.STATE_AUTO_JOINED]
+        ))
+
+    def test_simple_team_membership_queries_use_indexes(self):
+        team = SimpleTeam.objects.create(
+            member_access=SimpleTeam.MEMBER_ACCESS_OPEN,
+            manager_access=SimpleTeam.MANAGER_ACCESS_ADD
+        )
+        self.assertUsesIndex(team.memberships.filter(user=self.user))
+        self.assertUsesIndex(team.members)
+        self.assertUsesIndex(team.managers)
+        self.assertUsesIndex(SimpleMembership.objects.filter(
+            user=self.user,
+            state__in=[Membership.STATE_ACCEPTED, Membership.STATE_AUTO_JOINED]
+        ))
+
+
+class BulkMembershipTests(BaseTeamTests):
+
+    def setUp(self):
+        super().setUp()
+        self.team = self._create_team()
+        self.users = [self.make_user(f"user{i}") for i in range(5)]
+        self.received = []
+
+    def receiver(self, sender, memberships, by, **kwargs):
+        self.received.append((sender, memberships, by))
+
+    def test_add_members(self):
+        self.team.add_member(self.users[0])
+        signals.added_members.connect(self.receiver)
+        self.addCleanup(signals.added_members.disconnect, self.receiver)
+        # savepoint, existing memberships, insert, inserted rows, counters, release
+        with self.assertNumQueries(6):
+            memberships = self.team.add_members(self.users + [self.user], by=self.user)
+        self.assertEqual(len(memberships), 4)
+        self.assertEqual(self.team.memberships.count(), 6)
+        [(sender, received, by)] = self.received
+        self.assertEqual((sender, by), (self.team, self.user))
+        self.assertEqual(sorted(m.user.username for m in received), ["user1", "user2", "user3", "user4"])
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.member_count, 5)
+
+    def test_add_members_counts_inserted_rows(self):
+        signals.added_members.connect(self.receiver)
+        self.addCleanup(signals.added_members.disconnect, self.receiver)
+        bulk_create = Membership.objects.bulk_create
+
+        def racing_bulk_create(objs, **kwargs):
+            # another request adds user0 after the existing memberships are read
+            Membership.objects.create(team=self.team, user=self.users[0], state=Membership.STATE_AUTO_JOINED)
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Membership.objects, "bulk_create", racing_bulk_create):
+            memberships = self.team.add_members(self.users)
+        self.assertEqual(sorted(m.user.username for m in memberships), ["user1", "user2", "user3", "user4"])
+        [(sender, received, by)] = self.received
+        self.assertEqual(len(received), 4)
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.member_count, 4)
+
+    def test_promote_and_demote_all(self):
+        self.team.add_members(self.users)
+        signals.promoted_members.connect(self.receiver)
+        self.addCleanup(signals.promoted_members.disconnect, self.receiver)
+        self.assertEqual(self.team.memberships.promote_all(by=self.user), 5)
+        self.assertEqual(len(self.received), 1)
+        self.team.refresh_from_db()
+        self.assertEqual((self.team.member_count, self.team.manager_count), (0, 5))
+        self.assertEqual(self.team.managers.filter(user__in=self.users[:2]).demote_all(), 2)
+        self.team.refresh_from_db()
+        self.assertEqual((self.team.member_count, self.team.manager_count), (2, 3))
+
+    def test_accept_and_reject_all(self):
+        self.team.add_members(self.users, state=Membership.STATE_APPLIED)
+        self.assertEqual(self.team.applicants.filter(user__in=self.users[:3]).accept_all(), 3)
+        self.assertEqual(self.team.memberships.reject_all(), 2)
+        self.assertEqual(self.team.memberships.accept_all(), 0)
+        self.team.refresh_from_db()
+        self.assertEqual((self.team.member_count, self.team.applicant_count), (3, 0))
+        self.assertEqual(self.team.rejections.count(), 2)
+
+
+class MembershipTransitionTests(BaseTeamTests):
+
+    def setUp(self):
+        super().setUp()
+        self.team = self._create_team()
+        self.membership = self.team.add_member(self.make_user("paltman"))
+        self.promotions = []
+        signals.promoted_member.connect(self.receiver)
+        self.addCleanup(signals.promoted_member.disconnect, self.receiver)
+
+    def receiver(self, sender, membership, **kwargs):
+        self.promotions.append(membership)
+
+    def test_promote_without_select(self):
+        # savepoint, conditional update, counters, release
+        with self.assertNumQueries(4):
+            self.assertTrue(self.membership.promote(by=self.user))
+        self.assertEqual(self.membership.role, Membership.ROLE_MANAGER)
+        self.membership.refresh_from_db()
+        self.assertEqual(self.membership.role, Membership.ROLE_MANAGER)
+
+    def test_stale_instance_does_not_apply(self):
+        stale = Membership.objects.get(pk=self.membership.pk)
+        self.assertTrue(self.membership.promote(by=self.user))
+        self.assertTrue(self.membership.demote(by=self.user))
+        self.assertTrue(self.membership.promote(by=self.user))
+        stale.role = Membership.ROLE_MEMBER
+        self.assertFalse(stale.promote(by=self.user))
+        self.assertEqual(len(self.promotions), 2)
+        self.team.refresh_from_db()
+        self.assertEqual((self.team.member_count, self.team.manager_count), (0, 1))
+
+    def test_revision_only_on_success(self):
+        with reversion.create_revision():
+            self.membership.promote(by=self.user)
+        with reversion.create_revision():
+            self.membership.promote(by=self.user)
+        self.assertEqual(Version.objects.get_for_object(self.membership).count(), 1)
+
+
+class UpsertMembershipTests(BaseTeamTests):
+
+    def setUp(self):
+        super().setUp()
+        self.team = self._create_team()
+        self.paltman = self.make_user("paltman")
+
+    def test_join_is_idempotent(self):
+        self.team.join(self.paltman)
+        # savepoints, failed insert, rollback, select, releases
+        with self.assertNumQueries(7):
+            self.team.join(self.paltman)
+        self.assertEqual(self.team.memberships.filter(user=self.paltman).count(), 1)
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.member_count, 1)
+
+    def test_join_after_apply_updates_in_place(self):
+        applied = self.team.apply(self.paltman)
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.applicant_count, 1)
+        joined = self.team.join(self.paltman)
+        self.assertEqual((joined.pk, joined.state), (applied.pk, Membership.STATE_AUTO_JOINED))
+        self.team.refresh_from_db()
+        self.assertEqual((self.team.member_count, self.team.applicant_count), (1, 0))
+
+    def test_duplicate_user_or_invite_is_rejected(self):
+        self.team.join(self.paltman)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.team.memberships.create(user=self.paltman, state=Membership.STATE_APPLIED)
+        invited = self.team.invite_user(self.user, "jiggy@widit.com", Membership.ROLE_MEMBER)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.team.memberships.create(invite=invited.invite, state=Membership.STATE_INVITED)
+        # pending invitations without a user do not collide with each other
+        self.team.invite_user(self.user, "pinax@widit.com", Membership.ROLE_MEMBER)
+        self.assertEqual(self.team.invitees.count(), 2)
+
+
+class CapacityTests(BaseTeamTests):
+
+    def setUp(self):
+        super().setUp()
+        self.team = self._create_team()
+        self.team.capacity = 2
+        self.team.save()
+        self.users = [self.make_user(f"user{i}") for i in range(3)]
+
+    def test_join_beyond_capacity_is_waitlisted(self):
+        states = [self.team.join(user).state for user in self.users]
+        self.assertEqual(states, [Membership.STATE_AUTO_JOINED, Membership.STATE_WAITLISTED, Membership.STATE_WAITLISTED])
+        # joining again keeps the place in the queue
+        self.assertEqual(self.team.join(self.users[1]).state, Membership.STATE_WAITLISTED)
+        self.team.refresh_from_db()
+        self.assertEqual((self.team.owner_count, self.team.member_count), (1, 1))
+
+    def test_leaving_promotes_oldest_waitlisted(self):
+        seated, first, second = [self.team.join(user) for user in self.users]
+        second.leave()
+        self.assertEqual(self.team.waitlisted.get(), first)
+        seated.leave()
+        first.refresh_from_db()
+        self.assertEqual(first.state, Membership.STATE_AUTO_JOINED)
+        self.assertFalse(self.team.waitlisted.exists())
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.member_count, 1)
+
+    def test_raising_capacity_admits_waitlist(self):
+        for user in self.users:
+            self.team.join(user)
+        self.team.capacity = 3
+        self.team.save()
+        self.assertEqual(self.team.waitlisted.count(), 1)
+        self.team.capacity = None
+        self.team.save()
+        self.assertFalse(self.team.waitlisted.exists())
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.member_count, 3)
+
+    def test_accepting_invite_on_full_team_is_waitlisted(self):
+        self.team.join(self.users[0])
+        membership = self.team.invite_user(self.user, "jiggy@widit.com", Membership.ROLE_MEMBER)
+        jiggy = self.make_user("jiggy")
+        membership.invite.accept(jiggy)
+        membership.refresh_from_db()
+        self.assertEqual((membership.state, membership.user), (Membership.STATE_WAITLISTED, jiggy))
+        self.team.refresh_from_db()
+        self.assertEqual((self.team.member_count, self.team.invitee_count), (1, 0))
+
+    def test_accepting_applicants_on_full_team_waitlists_overflow(self):
+        first, second = [
+            self.team.memberships.create(user=user, state=Membership.STATE_APPLIED) for user in self.users[:2]
+        ]
+        self.assertTrue(first.accept(by=self.user))
+        self.assertEqual(first.state, Membership.STATE_ACCEPTED)
+        self.assertTrue(second.accept(by=self.user))
+        self.assertEqual(second.state, Membership.STATE_WAITLISTED)
+        first.leave()
+        second.refresh_from_db()
+        self.assertEqual(second.state, Membership.STATE_AUTO_JOINED)
+
+    def test_bulk_accept_waitlists_overflow(self):
+        self.team.capacity = 3
+        self.team.save()
+        for user in self.users:
+            self.team.memberships.create(user=user, state=Membership.STATE_APPLIED)
+        self.team.memberships.filter(state=Membership.STATE_APPLIED).accept_all(by=self.user)
+        self.assertEqual(
+            list(self.team.memberships.exclude(user=self.user).order_by("created", "pk").values_list("state", flat=True)),
+            [Membership.STATE_ACCEPTED, Membership.STATE_ACCEPTED, Membership.STATE_WAITLISTED]
+        )
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.member_count, 2)
+
+    def test_adding_members_beyond_capacity_waitlists_overflow(self):
+        memberships = self.team.add_members(self.users)
+        self.assertEqual(
+            sorted(memberships.values_list("state", flat=True)),
+            [Membership.STATE_AUTO_JOINED, Membership.STATE_WAITLISTED, Membership.STATE_WAITLISTED]
+        )
+        self.assertEqual(self.team.add_user(self.make_user("jiggy"), Membership.ROLE_MEMBER).state, Membership.STATE_WAITLISTED)
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.member_count, 1)
+
+
+@skipIf(
+    connection.vendor == "sqlite" and not connection.settings_dict["TEST"]["NAME"],
+    "shared-cache in-memory SQLite fails concurrent writers instead of queueing them; set a TEST NAME"
+)
+class ConcurrentJoinTests(TransactionTestCase):
+
+    JOINS = 200
+
+    def test_concurrent_joins_create_one_membership(self):
+        creator = User.objects.create_user("jtauber")
+        team = Team.objects.create(
+            name="Eldarion", creator=creator, member_access=Team.MEMBER_ACCESS_OPEN,
+            manager_access=Team.MANAGER_ACCESS_ADD
+        )
+        user = User.objects.create_user("paltman")
+        start = threading.Barrier(8)
+
+        def join(i):
+            if i < 8:
+                start.wait()
+            try:
+                return Team.objects.get(pk=team.pk).join(user).pk
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            pks = set(executor.map(join, range(self.JOINS)))
+        self.assertEqual(len(pks), 1)
+        self.assertEqual(team.memberships.filter(user=user).count(), 1)
+        team.refresh_from_db()
+        self.assertEqual((team.member_count, team.owner_count), (1, 1))
+
+    def test_concurrent_joins_do_not_oversubscribe(self):
+        creator = User.objects.create_user("jtauber")
+        team = Team.objects.create(
+            name="Eldarion", creator=creator, member_access=Team.MEMBER_ACCESS_OPEN,
+            manager_access=Team.MANAGER_ACCESS_ADD, capacity=10
+        )
+        users = User.objects.bulk_create([User(username=f"user{i}") for i in range(self.JOINS)])
+        start = threading.Barrier(8)
+
+        def join(i):
+            if i < 8:
+                start.wait()
+            try:
+                return Team.objects.get(pk=team.pk).join(users[i]).state
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            states = list(executor.map(join, range(self.JOINS)))
+        self.assertEqual(states.count(Membership.STATE_AUTO_JOINED), 9)
+        self.assertEqual(team.acceptances.count(), 10)
+        self.assertEqual(team.waitlisted.count(), self.JOINS - 9)
+        team.refresh_from_db()
+        self.assertEqual((team.member_count, team.owner_count), (9, 1))
+
+
+class MembershipHistoryTests(BaseTeamTests):
+
+    def setUp(self):
+        super().setUp()
+        self.team = self._create_team()
+        self.users = [self.make_user(f"user{i}") for i in range(2)]
+
+    def change_memberships(self):
+        with reversion.create_revision():
+            reversion.set_user(self.user)
+            first = self.team.add_member(self.users[0])
+            self.team.add_member(self.users[1])
+            first.promote(by=self.user)
+
+    def change_memberships_in_bulk(self):
+        with reversion.create_revision():
+            reversion.set_user(self.user)
+            self.team.add_members(self.users)
+            self.team.memberships.filter(user=self.users[0]).promote_all(by=self.user)
+            self.team.invite_users(self.user, ["jiggy@widit.com"], Membership.ROLE_MEMBER)
+            import_roster(self.team, [{"username": "user1", "role": Membership.ROLE_MANAGER}], self.user)
+
+    def assertBulkVersions(self):
+        versions = Version.objects.get_for_model(Membership)
+        self.assertEqual(versions.count(), 3)
+        self.assertEqual({version.revision.user for version in versions}, {self.user})
+        self.assertEqual(
+            sorted(version.field_dict["role"] for version in versions),
+            [Membership.ROLE_MANAGER, Membership.ROLE_MANAGER, Membership.ROLE_MEMBER]
+        )
+
+    def test_reversion_records_bulk_changes(self):
+        self.change_memberships_in_bulk()
+        self.assertBulkVersions()
+
+    @override_settings(PINAX_TEAMS_MEMBERSHIP_HISTORY="deferred")
+    def test_deferred_records_bulk_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.change_memberships_in_bulk()
+            self.assertFalse(Version.objects.exists())
+        self.assertBulkVersions()
+
+    def test_reversion_writes_versions_inline(self):
+        self.change_memberships()
+        self.assertEqual(Version.objects.get_for_model(Membership).count(), 2)
+        self.assertFalse(MembershipEvent.objects.exists())
+
+    @override_settings(PINAX_TEAMS_MEMBERSHIP_HISTORY="deferred")
+    def test_deferred_writes_one_revision_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.change_memberships()
+            self.assertFalse(Version.objects.exists())
+        versions = Version.objects.get_for_model(Membership)
+        self.assertEqual(versions.count(), 2)
+        self.assertEqual({version.revision.user for version in versions}, {self.user})
+        promoted = Version.objects.get_for_object(self.team.memberships.get(user=self.users[0])).get()
+        self.assertEqual(promoted.field_dict["role"], Membership.ROLE_MANAGER)
+
+    @override_settings(PINAX_TEAMS_MEMBERSHIP_HISTORY="deferred")
+    def test_deferred_drops_rolled_back_changes(self):
+        paltman = self.make_user("paltman")
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(IntegrityError):
+                with reversion.create_revision():
+                    reversion.set_user(paltman)
+                    self.team.add_member(self.users[0])
+                    raise IntegrityError()
+            self.change_memberships()
+        versions = Version.objects.get_for_model(Membership)
+        self.assertEqual(versions.count(), 2)
+        self.assertEqual({version.revision.user for version in versions}, {self.user})
+
+    @override_settings(PINAX_TEAMS_MEMBERSHIP_HISTORY="events")
+    def test_events_are_logged_from_signals(self):
+        self.change_memberships()
+        self.team.memberships.filter(user__in=self.users).demote_all(by=self.user)
+        paltman = self.make_user("paltman")
+        self.team.join(paltman).leave()
+        self.assertFalse(Version.objects.exists())
+        events = MembershipEvent.objects.order_by("pk")
+        self.assertEqual(
+            [(event.action, event.user, event.role) for event in events],
+            [
+                (MembershipEvent.ACTION_ADDED, self.users[0], Membership.ROLE_MEMBER),
+                (MembershipEvent.ACTION_ADDED, self.users[1], Membership.ROLE_MEMBER),
+                (MembershipEvent.ACTION_PROMOTED, self.users[0], Membership.ROLE_MANAGER),
+                (MembershipEvent.ACTION_DEMOTED, self.users[0], Membership.ROLE_MEMBER),
+                (MembershipEvent.ACTION_JOINED, paltman, Membership.ROLE_MEMBER),
+                (MembershipEvent.ACTION_LEFT, paltman, Membership.ROLE_MEMBER),
+            ]
+        )
+        self.assertEqual({event.team_pk for event in events}, {self.team.pk})
+
+    @override_settings(PINAX_TEAMS_MEMBERSHIP_HISTORY="off")
+    def test_off_keeps_no_history(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.change_memberships()
+        self.assertFalse(Version.objects.exists())
+        self.assertFalse(MembershipEvent.objects.exists())
+
+
+class InviteAcceptanceTests(BaseTeamTests):
+
+    def setUp(self):
+        super().setUp()
+        self.team = self._create_team()
+        self.simple_team = SimpleTeam.objects.create(member_access="open", manager_access="add someone")
+        self.membership = self.team.invite_user(self.user, "jiggy@widit.com", Membership.ROLE_MEMBER)
+        self.invite = self.membership.invite
+        self.simple_membership = self.simple_team.memberships.create(
+            invite=self.invite, role=SimpleMembership.ROLE_MEMBER, state=SimpleMembership.STATE_INVITED
+        )
+        self.received = []
+        signals.joined_teams.connect(self.receiver)
+        self.addCleanup(signals.joined_teams.disconnect, self.receiver)
+
+    def receiver(self, sender, memberships, **kwargs):
+        self.received.append((sender, list(memberships)))
+
+    def test_accept_converts_all_memberships(self):
+        jiggy = self.make_user("jiggy")
+        self.invite.accept(jiggy)
+        for membership in [self.membership, self.simple_membership]:
+            membership.refresh_from_db()
+            self.assertEqual((membership.state, membership.user), (Membership.STATE_ACCEPTED, jiggy))
+        self.assertEqual(
+            [(sender, len(memberships)) for sender, memberships in self.received],
+            [(Membership, 1), (SimpleMembership, 1)]
+        )
+        self.team.refresh_from_db()
+        self.assertEqual((self.team.member_count, self.team.invitee_count), (1, 0))
+        self.assertTrue(self.simple_team.is_on_team(jiggy))
+
+    def test_existing_member_is_left_alone(self):
+        jiggy = self.make_user("jiggy")
+        self.team.add_member(jiggy)
+        self.invite.accept(jiggy)
+        self.membership.refresh_from_db()
+        self.assertEqual((self.membership.state, self.membership.user), (Membership.STATE_INVITED, None))
+        self.assertEqual([sender for sender, memberships in self.received], [SimpleMembership])
+
+
+@override_settings(PINAX_TEAMS_INVITE_OUTBOX=True, PINAX_TEAMS_OUTBOX_MAX_ATTEMPTS=2)
+class InviteOutboxTests(BaseTeamTests):
+
+    def setUp(self):
+        super().setUp()
+        self.team = self._create_team()
+
+    def process(self):
+        call_command("process_team_outbox", workers=1, stdout=io.StringIO())
+
+    def test_invite_is_queued_and_delivered(self):
+        membership = self.team.invite_user(self.user, "jiggy@widit.com", Membership.ROLE_MEMBER)
+        self.assertEqual(len(mail.outbox), 0)
+        message = OutboxMessage.objects.get(invite=membership.invite)
+        self.assertEqual(message.state, OutboxMessage.STATE_PENDING)
+        self.process()
+        message.refresh_from_db()
+        self.assertEqual(message.state, OutboxMessage.STATE_SENT)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["jiggy@widit.com"])
+
+    def test_failed_delivery_is_retried_then_dead_lettered(self):
+        self.team.invite_user(self.user, "jiggy@widit.com", Membership.ROLE_MEMBER)
+        with mock.patch("pinax.teams.models.send_invite", side_effect=OSError("SMTP down")):
+            self.process()
+            message = OutboxMessage.objects.get()
+            self.assertEqual((message.state, message.attempts), (OutboxMessage.STATE_PENDING, 1))
+            self.assertIn("SMTP down", message.last_error)
+            # not due again until the backoff has passed
+            self.process()
+            self.assertEqual(OutboxMessage.objects.get().attempts, 1)
+            OutboxMessage.objects.update(next_attempt=message.created)
+            self.process()
+        message.refresh_from_db()
+        self.assertEqual((message.state, message.attempts), (OutboxMessage.STATE_FAILED, 2))
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class BulkInviteTests(BaseTeamTests):
+
+    def test_bulk_invite(self):
+        team = self._create_team()
+        paltman = self.make_user("paltman")
+        paltman.email = "paltman@example.com"
+        paltman.save()
+        self.make_user("brosner")
+        team.add_member(self.make_user("lukeman"))
+        team.invite_user(self.user, "old@example.com", Membership.ROLE_MEMBER)
+        post_data = {
+            "invitees": "paltman@example.com, brosner\nlukeman; new@example.com\nold@example.com bogus",
+            "role": Membership.ROLE_MEMBER,
+        }
+        with self.login(self.user):
+            response = self.post("pinax_teams:team_bulk_invite", slug=team.slug, data=post_data)
+        self.response_200(response)
+        results = {
+            result["address"]: result["status"]
+            for result in json.loads(response.content.decode("utf-8"))["results"]
+        }
+        self.assertEqual(results, {
+            "paltman@example.com": "added",
+            "brosner": "added",
+            "lukeman": "exists",
+            "new@example.com": "invited",
+            "old@example.com": "exists",
+            "bogus": "invalid",
+        })
+        self.assertTrue(team.is_on_team(paltman))
+        self.assertEqual(team.invitees.count(), 2)
+
+    def test_bulk_invite_query_count_is_constant(self):
+        team = self._create_team()
+        for count in [2, 10]:
+            users = [self.make_user(f"user{count}-{i}") for i in range(count)]
+            emails = [f"new{count}-{i}@example.com" for i in range(count)]
+            form = TeamBulkInviteForm(team=team, data={
+                "invitees": ",".join([user.username for user in users] + emails),
+                "role": Membership.ROLE_MEMBER,
+            })
+            self.assertTrue(form.is_valid())
+            with mock.patch("pinax.teams.models.send_invite"):
+                with CaptureQueriesContext(connection) as queries:
+                    form.save(self.user)
+            if count == 2:
+                expected = len(queries)
+        self.assertEqual(len(queries), expected)
+
+
+class TeamCacheTests(BaseTeamTests):
+
+    def setUp(self):
+        super().setUp()
+        team_cache.clear()
+        self.team = self._create_team()
+
+    def test_lookups_hit_the_database_once(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(team_cache.get(self.team.slug), self.team)
+        with self.assertNumQueries(0):
+            self.assertEqual(team_cache.get(self.team.slug), self.team)
+        team_cache.local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(team_cache.get(self.team.slug), self.team)
+        self.assertEqual(team_cache.stats, {"misses": 1, "local_hits": 1, "shared_hits": 1})
+
+    def test_lookups_return_private_copies(self):
+        team = team_cache.get(self.team.slug)
+        team.name = "Changed"
+        self.assertEqual(team_cache.get(self.team.slug).name, "Eldarion")
+
+    def test_save_invalidates(self):
+        team_cache.get(self.team.slug)
+        self.team.name = "Renamed"
+        self.team.save()
+        self.assertEqual(team_cache.get(self.team.slug).name, "Renamed")
+
+    def test_counts_are_read_fresh(self):
+        team_cache.get(self.team.slug)
+        self.team.add_member(self.make_user("paltman"))
+        team = team_cache.get(self.team.slug)
+        with self.assertNumQueries(1):
+            self.assertEqual((team.owner_count, team.member_count, team.manager_count), (1, 1, 0))
+
+    def test_missing_team(self):
+        with self.assertRaises(Team.DoesNotExist):
+            team_cache.get("missing")
+
+    @override_settings(PINAX_TEAMS_TEAM_CACHE=False)
+    def test_disabled(self):
+        team_cache.get(self.team.slug)
+        with self.assertNumQueries(1):
+            team_cache.get(self.team.slug)
+
+
+@override_settings(PINAX_TEAMS_PROFILE_MODEL=Profile)
+class TeamMiddlewareTests(BaseTeamTests):
+
+    def setUp(self):
+        super().setUp()
+        self.team = self._create_team()
+        self.profile = Profile.objects.create(user=self.user, team=self.team)
+
+    def process_request(self, user):
+        request = RequestFactory().get("/")
+        request.environ["pinax.team"] = self.team.slug
+        request.user = user
+        TeamMiddleware().process_request(request)
+        return request
+
+    def test_teams_are_lazy_and_cached(self):
+        with self.assertNumQueries(2):
+            request = self.process_request(self.user)
+            self.assertEqual(request.profile.pk, self.profile.pk)
+        with self.assertNumQueries(0):
+            request = self.process_request(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual([profile.pk for profile in request.user.teams], [self.profile.pk])
+        with self.assertNumQueries(0):
+            request = self.process_request(self.user)
+            self.assertEqual(request.profile.pk, self.profile.pk)
+            self.assertEqual(len(request.user.teams), 1)
+        self.assertIsInstance(request.user.teams, QuerySet)
+        self.assertFalse(request.user.teams.exclude(team=self.team).exists())
+
+    def test_profile_change_invalidates(self):
+        other = Team.objects.create(
+            name="Pinax", creator=self.user, member_access=self.MEMBER_ACCESS, manager_access=self.MANAGER_ACCESS
+        )
+        request = self.process_request(self.user)
+        self.assertEqual(len(request.user.teams), 1)
+        Profile.objects.create(user=self.user, team=other)
+        request = self.process_request(self.user)
+        self.assertEqual(len(request.user.teams), 2)
+
+    def test_membership_change_invalidates(self):
+        request = self.process_request(self.user)
+        self.assertEqual(len(request.user.teams), 1)
+        self.team.for_user(self.user).remove()
+        request = self.process_request(self.user)
+        self.assertEqual(len(request.user.teams), 0)
+
+    def test_missing_profile(self):
+        with self.assertRaises(Http404):
+            self.process_request(self.make_user("paltman"))
+
+    def test_missing_profile_is_not_found_on_team_urls(self):
+        self.client.force_login(self.make_user("paltman"))
+        url = self.reverse("pinax_teams:team_detail", slug=self.team.slug)
+        with self.modify_settings(MIDDLEWARE={"append": "pinax.teams.middleware.TeamMiddleware"}):
+            self.assertEqual(self.client.get(url, **{"pinax.team": self.team.slug}).status_code, 404)
+            self.client.force_login(self.user)
+            self.assertEqual(self.client.get(url, **{"pinax.team": self.team.slug}).status_code, 200)
+
+    async def test_async_missing_profile(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        request = AsyncRequestFactory().get("/")
+        request.scope["pinax.team"] = self.team.slug
+        request.user = await sync_to_async(self.make_user)("paltman")
+        with self.assertRaises(Http404):
+            await TeamMiddleware(get_response)(request)
+
+    async def test_async_middleware(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = TeamMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        request = AsyncRequestFactory().get("/")
+        request.scope["pinax.team"] = self.team.slug
+        request.user = self.user
+        response = await middleware(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(request.team.pk, self.team.pk)
+        self.assertEqual((await request.team_membership.aresolve()).role, Membership.ROLE_OWNER)
+        self.assertEqual((await request.aprofile()).pk, self.profile.pk)
+        self.assertEqual([profile.pk for profile in await request.ateams()], [self.profile.pk])
+
+
+class AsyncTeamViewTests(BaseTeamTests):
+
+    def setUp(self):
+        super().setUp()
+        self.team = self._create_team()
+        self.member = self.make_user("paltman")
+        self.client.force_login(self.member)
+        self.async_client.cookies = self.client.cookies
+
+    def test_detail_view(self):
+        response = self.client.get(self.reverse("pinax_teams:team_detail", slug=self.team.slug))
+        self.assertContains(response, "can-join")
+
+    async def test_async_detail_view(self):
+        response = await self.async_client.get(self.reverse("pinax_teams_async:team_detail", slug=self.team.slug))
+        self.assertContains(response, "can-join")
+
+    async def test_async_join(self):
+        response = await self.async_client.post(self.reverse("pinax_teams_async:team_join", slug=self.team.slug))
+        self.assertEqual(response.status_code, 302)
+        membership = await self.team.memberships.aget(user=self.member)
+        self.assertEqual(membership.state, Membership.STATE_AUTO_JOINED)
+        team = await Team.objects.aget(pk=self.team.pk)
+        self.assertEqual(team.member_count, 1)
+
+    async def test_async_autocomplete(self):
+        url = self.reverse("pinax_teams_async:autocomplete_users", slug=self.team.slug)
+        response = await self.async_client.get(url, {"q": "jtau"})
+        self.assertEqual(response.status_code, 404)
+        await sync_to_async(self.client.force_login)(self.user)
+        self.async_client.cookies = self.client.cookies
+        response = await self.async_client.get(url, {"q": "jtau"})
+        self.assertEqual([u["username"] for u in json.loads(response.content)["users"]], [])
+        await User.objects.acreate(username="jtaub")
+        response = await self.async_client.get(url, {"q": "jtau"})
+        self.assertEqual([u["username"] for u in json.loads(response.content)["users"]], ["jtaub"])
+        self.async_client.cookies.clear()
+        response = await self.async_client.get(url, {"q": "tau"})
+        self.assertEqual(response.status_code, 302)
+
+
+class TeamListViewTests(BaseTeamTests):
+
+    def setUp(self):
+        super().setUp()
+        for name, access in [("Red", "open"), ("Green", "application"), ("Blue", "open"), ("Cyan", "invitation")]:
+            Team.objects.create(name=name, creator=self.user, member_access=access, manager_access=Team.MANAGER_ACCESS_ADD)
+        # keyset ties on created are broken by id
+        Team.objects.filter(slug__in=["green", "blue"]).update(created=Team.objects.get(slug="red").created)
+
+    def pages(self, **params):
+        pages, query = [], urlencode(params)
+        while query is not None:
+            response = self.client.get(f"{self.reverse('pinax_teams:team_list')}?{query}")
+            self.assertEqual(response.status_code, 200)
+            pages.append([line.split(":")[0] for line in response.content.decode().splitlines() if ":" in line])
+            query = response.context["next_query"]
+        return pages
+
+    @override_settings(PINAX_TEAMS_TEAM_LIST_PAGE_SIZE=3)
+    def test_keyset_pages(self):
+        self.assertEqual(self.pages(), [["cyan", "blue", "green"], ["red"]])
+        self.assertEqual(self.pages(access="open"), [["blue", "red"]])
+        self.assertEqual(self.pages(q="REE"), [["green"]])
+
+    def test_member_total_and_query_count(self):
+        Team.objects.get(slug="red").add_user(self.make_user("paltman"), Membership.ROLE_MEMBER)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.reverse("pinax_teams:team_list"))
+        self.assertIn("red:2", response.content.decode())
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.reverse("pinax_teams:team_list"), {"cursor": "nope"})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_async_team_list(self):
+        with self.settings(PINAX_TEAMS_TEAM_LIST_PAGE_SIZE=3):
+            response = await self.async_client.get(self.reverse("pinax_teams_async:team_list"))
+        self.assertEqual(response.content.decode().splitlines()[0], "cyan:1")
+        self.assertIn("cursor=", response.content.decode())
+
+
+class RosterTests(BaseTeamTests):
+
+    def setUp(self):
+        super().setUp()
+        self.team = self._create_team()
+
+    def populate(self, n, start=0):
+        for i in range(start, start + n):
+            self.team.add_user(self.make_user(f"member{i}"), Membership.ROLE_MEMBER)
+            self.team.invite_user(self.user, f"invitee{i}@example.com", Membership.ROLE_MEMBER)
+            Membership.objects.create(team=self.team, user=self.make_user(f"applicant{i}"), state=Membership.STATE_APPLIED)
+
+    def manage(self):
+        with self.login(self.user):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.get("pinax_teams:team_manage", slug=self.team.slug)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_partitions_match_querysets(self):
+        self.populate(2)
+        roster = self.team.roster()
+        for name in ["applicants", "invitees", "acceptances", "members", "managers", "owners"]:
+            self.assertEqual(
+                sorted(m.pk for m in getattr(roster, name)),
+                sorted(getattr(self.team, name).values_list("pk", flat=True))
+            )
+        self.assertEqual(len(roster), 7)
+
+    def test_loaded_roster_serves_team_properties(self):
+        self.populate(2)
+        team = Team.objects.get(pk=self.team.pk)
+        roster = team.load_roster()
+        with self.assertNumQueries(0):
+            self.assertEqual(team.members, roster.members)
+            self.assertEqual(team.invitees, roster.invitees)
+        self.assertTrue(team.is_member(self.team.members.first().user))
+
+    def test_manage_queries_do_not_grow_with_team(self):
+        self.populate(1)
+        self.manage()
+        response, small = self.manage()
+        self.assertContains(response, "invitee:invitee0@example.com")
+        self.assertContains(response, "owner:Eldarion: jtauber")
+        self.populate(4, start=1)
+        response, large = self.manage()
+        self.assertContains(response, "member:member4 auto joined")
+        self.assertEqual(small, large)
+
+    def test_csv_export(self):
+        self.populate(2)
+        with self.login(self.user):
+            response = self.get("pinax_teams:team_export", slug=self.team.slug)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[0]["username"], "jtauber")
+        self.assertEqual(rows[0]["role"], Membership.ROLE_OWNER)
+        self.assertEqual({row["invite_email"] for row in rows if row["invite_email"]}, {
+            "invitee0@example.com", "invitee1@example.com"
+        })
+
+    def test_ndjson_export_requires_manager(self):
+        self.populate(1)
+        with self.login(self.user):
+            response = self.get("pinax_teams:team_export", slug=self.team.slug, data={"format": "ndjson"})
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row["state"] for row in rows], [
+            Membership.STATE_AUTO_JOINED,
+            Membership.STATE_AUTO_JOINED,
+            Membership.STATE_INVITED,
+            Membership.STATE_APPLIED,
+        ])
+        with self.login(User.objects.get(username="member0")):
+            response = self.get("pinax_teams:team_export", slug=self.team.slug)
+        self.assertEqual(response.status_code, 404)
+
+    def test_command(self):
+        self.populate(1)
+        out = io.StringIO()
+        call_command("export_team_roster", self.team.slug, "--format", "ndjson", "--chunk-size", "2", stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 4)
+
+
+class RosterImportTests(BaseTeamTests):
+
+    def setUp(self):
+        super().setUp()
+        self.team = self._create_team()
+        self.paltman = self.make_user("paltman")
+        self.brosner = self.make_user("brosner")
+        self.brosner.email = "brosner@example.com"
+        self.brosner.save()
+
+    def import_roster(self, content, suffix=".csv"):
+        with tempfile.NamedTemporaryFile("w", suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        out = io.StringIO()
+        call_command("import_team_roster", self.team.slug, f.name, "--chunk-size", "2", stdout=out)
+        return out.getvalue().strip()
+
+    def test_import_is_idempotent(self):
+        content = "\n".join([
+            "username,email,role,state",
+            "paltman,,manager,",
+            ",brosner@example.com,,",
+            ",new@example.com,,",
+            "nobody,,,",
+            "jtauber,,bogus,",
+        ])
+        self.assertEqual(self.import_roster(content), "2 created, 0 updated, 0 unchanged, 1 invited, 2 skipped")
+        self.assertEqual(self.team.for_user(self.paltman).role, Membership.ROLE_MANAGER)
+        self.assertEqual(self.team.for_user(self.brosner).state, Membership.STATE_AUTO_JOINED)
+        self.assertEqual(self.team.invitees.get().invite.to_user_email(), "new@example.com")
+        team = Team.objects.get(pk=self.team.pk)
+        self.assertEqual((team.member_count, team.manager_count, team.invitee_count), (1, 1, 1))
+        self.assertEqual(self.import_roster(content), "0 created, 0 updated, 3 unchanged, 0 invited, 2 skipped")
+
+    def test_export_round_trip(self):
+        self.team.add_user(self.paltman, Membership.ROLE_MEMBER)
+        out = io.StringIO()
+        call_command("export_team_roster", self.team.slug, "--format", "ndjson", stdout=out)
+        self.team.for_user(self.paltman).promote(by=self.user)
+        result = self.import_roster(out.getvalue(), suffix=".ndjson")
+        self.assertEqual(result, "0 created, 1 updated, 1 unchanged, 0 invited, 0 skipped")
+        self.assertEqual(self.team.for_user(self.paltman).role, Membership.ROLE_MEMBER)
+
+    def test_counters_are_current_after_each_chunk(self):
+        self.team.add_user(self.paltman, Membership.ROLE_MEMBER)
+        rows = [
+            {"username": "paltman", "role": Membership.ROLE_MANAGER},
+            {"username": "brosner"},
+            {"email": "new@example.com"},
+        ]
+        with mock.patch("pinax.teams.roster.invite_emails", side_effect=[None, RuntimeError]):
+            with self.assertRaises(RuntimeError):
+                import_roster(self.team, rows, self.user, chunk_size=2)
+        team = Team.objects.get(pk=self.team.pk)
+        self.assertEqual((team.member_count, team.manager_count, team.invitee_count), (1, 1, 0))
+        Team.objects.filter(pk=team.pk).recount()
+        team.refresh_from_db()
+        self.assertEqual((team.member_count, team.manager_count, team.invitee_count), (1, 1, 0))
+
+    def test_import_respects_capacity(self):
+        Team.objects.filter(pk=self.team.pk).update(capacity=3)
+        self.team.refresh_from_db()
+        users = [self.make_user(f"user{i}") for i in range(5)]
+        results = import_roster(self.team, [{"username": user.username} for user in users], self.user, chunk_size=2)
+        self.assertEqual((results["created"], results["updated"]), (5, 0))
+        self.assertEqual([m.user for m in self.team.waitlisted.order_by("created", "pk")], users[2:])
+        self.assertEqual(Team.objects.get(pk=self.team.pk).member_count, 2)
+        # declining a seated member hands the seat to the oldest waitlisted
+        rows = [{"username": "user0", "state": Membership.STATE_DECLINED}, {"username": "user4"}]
+        import_roster(self.team, rows, self.user)
+        self.assertEqual(self.team.for_user(users[0]).state, Membership.STATE_DECLINED)
+        self.assertIn(self.team.for_user(users[2]).state, Membership.SEATED_STATES)
+        self.assertEqual([m.user for m in self.team.waitlisted.order_by("created", "pk")], users[3:])
+        self.assertEqual(Team.objects.get(pk=self.team.pk).member_count, 2)
+
+    @override_settings(PINAX_TEAMS_MEMBERSHIP_HISTORY="events")
+    def test_updated_rows_are_logged(self):
+        self.team.add_user(self.paltman, Membership.ROLE_MEMBER)
+        received = []
+
+        def receiver(sender, memberships, by, **kwargs):
+            received.append(list(memberships))
+
+        signals.updated_members.connect(receiver)
+        self.addCleanup(signals.updated_members.disconnect, receiver)
+        import_roster(self.team, [{"username": "paltman", "role": Membership.ROLE_MANAGER}], self.user)
+        self.assertEqual([[m.user for m in memberships] for memberships in received], [[self.paltman]])
+        event = MembershipEvent.objects.get(action=MembershipEvent.ACTION_UPDATED)
+        self.assertEqual((event.user, event.role, event.by), (self.paltman, Membership.ROLE_MANAGER, self.user))
+
+
+class AutocompleteTests(BaseTeamTests):
+
+    def setUp(self):
+        super().setUp()
+        self.team = self._create_team()
+        self.member = self.make_user("paltman")
+        self.team.add_user(self.member, Membership.ROLE_MEMBER)
+        for username, first_name in [("patrick", ""), ("pa", ""), ("bob", "Pat"), ("pamela", "")]:
+            User.objects.create(username=username, first_name=first_name)
+
+    def search(self, q):
+        with self.login(self.user):
+            response = self.get("pinax_teams:autocomplete_users", slug=self.team.slug, data={"q": q})
+        return [u["username"] for u in json.loads(response.content)["users"]]
+
+    def test_ranking_and_exclusion(self):
+        self.assertEqual(self.search("PA"), ["pa", "pamela", "patrick", "bob"])
+        self.assertEqual(self.search("pat"), ["bob", "patrick"])
+
+    def test_requires_manager(self):
+        with self.login(self.member):
+            self.get("pinax_teams:autocomplete_users", slug=self.team.slug, data={"q": "pat"})
+        self.response_404()
+
+    def test_min_length_and_limit(self):
+        self.assertEqual(self.search("p"), [])
+        with self.settings(PINAX_TEAMS_AUTOCOMPLETE_LIMIT=2):
+            self.assertEqual(self.search("pa"), ["pa", "pamela"])
+
+    def test_paths_rank_alike(self):
+        # each user's best "zed" term is an exact match of a different weight,
+        # while zedekiah's lowest weight term is only a prefix match
+        User.objects.create(username="zedekiah", last_name="Zed")
+        User.objects.create(username="bob2", first_name="Zed")
+        expected = ["bob2", "zedekiah"]
+        self.assertEqual([u.username for u in autocomplete_queryset("zed", self.team, self.user)], expected)
+        autocomplete_cache.clear()
+        autocomplete_cache.search("ze", self.team, self.user)
+        self.assertEqual([r["username"] for r in autocomplete_cache.search("zed", self.team, self.user)], expected)
+        self.assertEqual(autocomplete_cache.stats["refinements"], 1)
+        prefix_index.reset()
+        self.addCleanup(prefix_index.reset)
+        self.assertEqual([r["username"] for r in prefix_index.search("zed", self.team, self.user)], expected)
+
+    def test_index_follows_user_changes(self):
+        user = User.objects.get(username="patrick")
+        user.username = "rick"
+        user.save()
+        self.assertEqual(self.search("pat"), ["bob"])
+        self.assertEqual(self.search("ric"), ["rick"])
+
+    def test_unrelated_user_saves_skip_reindexing(self):
+        user = User.objects.get(username="patrick")
+        with CaptureQueriesContext(connection) as queries:
+            user.save(update_fields=["last_login"])
+        self.assertFalse([q for q in queries.captured_queries if UserSearchTerm._meta.db_table in q["sql"]])
+        user.username = "rick"
+        user.save(update_fields=["username"])
+        self.assertEqual(self.search("ric"), ["rick"])
+
+    def test_rebuild_command(self):
+        UserSearchTerm.objects.all().delete()
+        self.assertEqual(self.search("pat"), [])
+        call_command("rebuild_autocomplete_index", "--batch-size", "2", stdout=io.StringIO())
+        self.assertEqual(self.search("pat"), ["bob", "patrick"])
+
+    def test_uses_term_index(self):
+        queryset = autocomplete_queryset("pat", self.team, self.user)
+        sql, params = queryset.query.sql_with_params()
+        self.assertNotIn(" LIKE ", sql)
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = " ".join(str(row) for row in cursor.fetchall())
+        self.assertIn("pinax_teams_search_term_idx", plan)
+
+
+class AutocompleteCacheTests(AutocompleteTests):
+
+    def setUp(self):
+        autocomplete_cache.clear()
+        super().setUp()
+
+    def results(self, q):
+        return [r["username"] for r in autocomplete_results(q, self.team, self.user)]
+
+    def test_hits_and_refinements_skip_the_database(self):
+        self.assertEqual(self.results("pa"), ["pa", "pamela", "patrick", "bob"])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.results("pa"), ["pa", "pamela", "patrick", "bob"])
+            self.assertEqual(self.results("pat"), ["bob", "patrick"])
+            self.assertEqual(self.results("patr"), ["patrick"])
+        self.assertEqual(autocomplete_cache.stats, {"misses": 1, "hits": 1, "refinements": 2})
+
+    def test_incomplete_matches_are_not_refined(self):
+        with self.settings(PINAX_TEAMS_AUTOCOMPLETE_CACHE_MATCHES=2):
+            self.assertEqual(self.results("pa"), ["pa", "pamela"])
+            self.assertEqual(self.results("pat"), ["bob", "patrick"])
+        self.assertEqual(autocomplete_cache.stats["misses"], 2)
+
+    def test_expiry(self):
+        with self.settings(PINAX_TEAMS_AUTOCOMPLETE_CACHE_TIMEOUT=-1):
+            self.results("pa")
+            self.results("pa")
+        self.assertEqual(autocomplete_cache.stats["misses"], 2)
+
+    def test_invalidation(self):
+        self.assertEqual(self.results("pat"), ["bob", "patrick"])
+        self.team.add_user(User.objects.get(username="bob"), Membership.ROLE_MEMBER)
+        self.assertEqual(self.results("pat"), ["patrick"])
+        User.objects.create(username="patty")
+        self.assertEqual(self.results("pat"), ["patty", "patrick"])
+
+
+@override_settings(PINAX_TEAMS_AUTOCOMPLETE_INDEX=True)
+class PrefixIndexTests(AutocompleteTests):
+
+    def setUp(self):
+        prefix_index.reset()
+        super().setUp()
+
+    def tearDown(self):
+        prefix_index.reset()
+        super().tearDown()
+
+    def test_lookups_skip_the_database(self):
+        autocomplete_results("pa", self.team, self.user)
+        with self.assertNumQueries(0):
+            results = autocomplete_results("pat", self.team, self.user)
+        self.assertEqual([r["username"] for r in results], ["bob", "patrick"])
+        self.team.add_user(User.objects.get(username="bob"), Membership.ROLE_MEMBER)
+        self.assertEqual(self.search("pat"), ["patrick"])
+
+    def test_rebuild_command(self):
+        self.assertEqual(self.search("pat"), ["bob", "patrick"])
+        User.objects.filter(username="bob").update(first_name="Bob")
+        self.assertEqual(self.search("pat"), ["bob", "patrick"])
+        call_command("rebuild_autocomplete_index", stdout=io.StringIO())
+        self.assertEqual(self.search("pat"), ["patrick"])
+
+    def test_user_delete(self):
+        self.assertEqual(self.search("pat"), ["bob", "patrick"])
+        User.objects.get(username="bob").delete()
+        self.assertEqual(self.search("pat"), ["patrick"])
+
+    def test_size_limit_falls_back_to_database(self):
+        with self.settings(PINAX_TEAMS_AUTOCOMPLETE_INDEX_SIZE=2):
+            self.assertEqual(self.search("pat"), ["bob", "patrick"])
+        self.assertTrue(prefix_index.overflow)
+
+    def test_build_loads_without_the_lock(self):
+        acquired = []
+        load = prefix_index.load
+
+        def acquire():
+            acquired.append(prefix_index.lock.acquire(timeout=1))
+            if acquired[-1]:
+                prefix_index.lock.release()
+
+        def checked_load():
+            thread = threading.Thread(target=acquire)
+            thread.start()
+            thread.join()
+            return load()
+
+        with mock.patch.object(prefix_index, "load", checked_load):
+            self.assertEqual(self.search("pat"), ["bob", "patrick"])
+        self.assertEqual(acquired, [True])
+
+    def test_changes_during_build_are_not_lost(self):
+        load = prefix_index.load
+
+        def racing_load():
+            loaded = load()
+            User.objects.filter(username="bob").update(first_name="Bob")
+            prefix_index.update_user(User.objects.get(username="bob"))
+            return loaded
+
+        with mock.patch.object(prefix_index, "load", racing_load):
+            self.assertEqual(self.search("pat"), ["bob", "patrick"])
+        self.assertEqual(self.search("pat"), ["patrick"])
+
+
+class TeamRoutingTests(TestCase):
+
+    def test_wsgi_middleware(self):
+        environ = {"PATH_INFO": "/teams/eldarion/manage/"}
+        WSGITeamMiddleware(lambda environ, start_response: None)(environ, None)
+        self.assertEqual(environ["SCRIPT_NAME"], "/teams/eldarion")
+        self.assertEqual(environ["PATH_INFO"], "/manage/")
+        self.assertEqual(environ["pinax.team"], "eldarion")
+
+    def test_asgi_middleware(self):
+        scopes = []
+
+        async def app(scope, receive, send):
+            scopes.append(scope)
+
+        middleware = ASGITeamMiddleware(app)
+        asyncio.run(middleware({"type": "http", "path": "/site/teams/eldarion/manage/", "root_path": "/site"}, None, None))
+        asyncio.run(middleware({"type": "http", "path": "/about/", "root_path": ""}, None, None))
+        self.assertEqual(scopes[0]["root_path"], "/site/teams/eldarion")
+        self.assertEqual(scopes[0]["path"], "/site/teams/eldarion/manage/")
+        self.assertEqual(scopes[0]["pinax.team"], "eldarion")
+        self.assertNotIn("pinax.team", scopes[1])
+
+    def test_allowed_paths(self):
+        self.assertTrue(is_allowed_path("/teams/eldarion/account/login/"))
+        self.assertTrue(is_allowed_path("/teams/eldarion/account/password/reset/key/"))
+        self.assertFalse(is_allowed_path("/teams/eldarion/account/login/extra/"))
+        self.assertFalse(is_allowed_path("/teams/eldarion/manage/"))
+        with self.settings(PINAX_TEAMS_ALLOWED_PATHS=[r"public/"]):
+            self.assertTrue(is_allowed_path("/teams/eldarion/public/page/"))
+            self.assertFalse(is_allowed_path("/teams/eldarion/account/login/"))
+        self.assertTrue(is_allowed_path("/teams/eldarion/account/login/"))
@@ -2,5 +2,6 @@ from django.urls import include, re_path
 
 urlpatterns = [
     re_path(r"^account/", include("account.urls")),
+    re_path(r"^async/", include("pinax.teams.async_urls", namespace="pinax_teams_async")),
     re_path(r"^", include("pinax.teams.urls", namespace="pinax_teams")),
 ]
@@ -0,0 +1,97 @@
+"""
+A declarative membership state machine. Rules name an action and the
+team access modes, membership states and roles it applies to, and the
+state and role it leads to; TransitionMatrix expands them once into a
+table over every (member_access, manager_access, state, role, action) so
+that checking a transition is a single dict lookup.
+"""
+import itertools
+
+ANY = object()
+SAME = object()
+
+
+def _values(value):
+    if value is ANY:
+        return value
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return frozenset(value)
+    return frozenset([value])
+
+
+class Rule:
+    """
+    Allows action from the given states and roles, where a state of None
+    stands for having no membership. to_state and to_role default to
+    leaving the state or role as it is; a to_state of None removes the
+    membership.
+    """
+
+    def __init__(self, action, state=ANY, role=ANY, member_access=ANY, manager_access=ANY,
+                 to_state=SAME, to_role=SAME):
+        self.action = action
+        self.state = _values(state)
+        self.role = _values(role)
+        self.member_access = _values(member_access)
+        self.manager_access = _values(manager_access)
+        self.to_state = to_state
+        self.to_role = to_role
+
+    def matches(self, member_access, manager_access, state, role):
+        return all(
+            allowed is ANY or value in allowed
+            for allowed, value in [
+                (self.member_access, member_access),
+                (self.manager_access, manager_access),
+                (self.state, state),
+                (self.role, role),
+            ]
+        )
+
+    def target(self, state, role):
+        if self.to_state is None:
+            return (None, None)
+        return (
+            state if self.to_state is SAME else self.to_state,
+            role if self.to_role is SAME else self.to_role,
+        )
+
+
+class TransitionMatrix:
+    """
+    Every allowed transition, keyed by (member_access, manager_access,
+    state, role, action) and mapping to the resulting (state, role). Where
+    several rules match, the first one wins.
+    """
+
+    def __init__(self, rules, member_access, manager_access, states, roles):
+        self.actions = list(dict.fromkeys(rule.action for rule in rules))
+        self.table = {}
+        for key in itertools.product(member_access, manager_access, [None] + list(states), [None] + list(roles)):
+            for action in self.actions:
+                for rule in rules:
+                    if rule.action == action and rule.matches(*key):
+                        self.table[key + (action,)] = rule.target(*key[2:])
+                        break
+        self.sources = {action: set() for action in self.actions}
+        for (_, _, state, role, action) in self.table:
+            self.sources[action].add((state, role))
+
+    def get(self, member_access, manager_access, state, role, action):
+        """
+        Returns the (state, role) that action leads to, or None when it is
+        not allowed
+        """
+        return self.table.get((member_access, manager_access, state, role, action))
+
+    def target(self, team, state, role, action):
+        return self.table.get((team.member_access, team.manager_access, state, role, action))
+
+    def allows(self, team, state, role, action):
+        return (team.member_access, team.manager_access, state, role, action) in self.table
+
+    def source_states(self, action):
+        return {state for state, role in self.sources[action] if state is not None}
+
+    def source_roles(self, action):
+        return {role for state, role in self.sources[action] if role is not None}
@@ -13,6 +13,9 @@ urlpatterns = [
     path("<slug:slug>/join/", views.team_join, name="team_join"),
     path("<slug:slug>/leave/", views.team_leave, name="team_leave"),
     path("<slug:slug>/apply/", views.team_apply, name="team_apply"),
+    path("<slug:slug>/autocomplete/", views.autocomplete_users, name="autocomplete_users"),
+    path("<slug:slug>/invite/bulk/", views.TeamBulkInviteView.as_view(), name="team_bulk_invite"),
+    path("<slug:slug>/export/", views.team_export, name="team_export"),
     path("membership/<int:pk>/accept/", views.team_accept, name="team_accept"),
     path("membership/<int:pk>/reject/", views.team_reject, name="team_reject"),
     path("membership/<int:pk>/revoke/", views.team_member_revoke_invite, name="team_member_revoke_invite"),
@@ -20,5 +23,4 @@ urlpatterns = [
     path("membership/<int:pk>/promote/", views.team_member_promote, name="team_member_promote"),
     path("membership/<int:pk>/demote/", views.team_member_demote, name="team_member_demote"),
     path("membership/<int:pk>/remove/", views.team_member_remove, name="team_member_remove"),
-    path("autocomplete/", views.autocomplete_users, name="autocomplete_users"),
 ]
@@ -1,3 +1,12 @@
+import base64
+import binascii
+import datetime
+
+from django.http import Http404
+
+from asgiref.sync import sync_to_async
+
+from .conf import settings
 from .models import Team
 
 
@@ -41,3 +50,111 @@ def create_teams(obj, user, access):
             new_team.save()
             setattr(obj, field_name, new_team)
     return obj
+
+
+class RequestTeamMembership:
+    """
+    Resolves the membership snapshot of request.user on request.team lazily
+    and memoizes it for the rest of the request
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    def resolve(self):
+        return self.request.team.snapshot_for(self.request.user)
+
+    async def aresolve(self):
+        return await self.request.team.asnapshot_for(self.request.user)
+
+    def __getattr__(self, attr):
+        return getattr(self.resolve(), attr)
+
+
+def set_request_team(request, team):
+    """
+    Sets request.team and request.team_membership
+    """
+    request.team = team
+    if team is None:
+        request.team_membership = None
+    else:
+        team.memoize_snapshots()
+        request.team_membership = RequestTeamMembership(request)
+
+
+def resolve_user(request):
+    request.user.is_authenticated
+    return request.user
+
+
+async def aget_user(request):
+    """
+    Returns the resolved request.user without blocking the event loop
+    """
+    if hasattr(request, "auser"):
+        return await request.auser()
+    return await sync_to_async(resolve_user)(request)
+
+
+def encode_cursor(team):
+    value = f"{team.created.isoformat()}|{team.pk}"
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (created, pk) pair encoded by encode_cursor(), raising
+    ValueError for a malformed cursor
+    """
+    try:
+        value = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created, pk = value.split("|")
+        return datetime.datetime.fromisoformat(created), int(pk)
+    except (TypeError, UnicodeDecodeError, ValueError, binascii.Error):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def team_list_queryset(params):
+    """
+    Returns the teams on the page of the team list described by the query
+    parameters q, access and cursor, newest first, raising Http404 for a
+    malformed cursor
+    """
+    queryset = Team.objects.with_member_total().order_by("-created", "-pk")
+    query = params.get("q", "").strip()
+    if query:
+        queryset = queryset.search(query)
+    access = params.get("access")
+    if access in dict(Team.MEMBER_ACCESS_CHOICES):
+        queryset = queryset.filter(member_access=access)
+    cursor = params.get("cursor")
+    if cursor:
+        try:
+            queryset = queryset.before(*decode_cursor(cursor))
+        except ValueError:
+            raise Http404()
+    return queryset
+
+
+def team_list_context(params, teams):
+    """
+    Builds the team list context from the first PINAX_TEAMS_TEAM_LIST_PAGE_SIZE + 1
+    teams of team_list_queryset(params)
+    """
+    page_size = settings.PINAX_TEAMS_TEAM_LIST_PAGE_SIZE
+    next_cursor = next_query = None
+    if len(teams) > page_size:
+        teams = teams[:page_size]
+        next_cursor = encode_cursor(teams[-1])
+        next_params = params.copy()
+        next_params["cursor"] = next_cursor
+        next_query = next_params.urlencode()
+    return {
+        "teams": teams,
+        "object_list": teams,
+        "next_cursor": next_cursor,
+        "next_query": next_query,
+        "query": params.get("q", ""),
+        "access": params.get("access", ""),
+    }
@@ -1,30 +1,37 @@
-import json
-
 from django.contrib import messages
-from django.contrib.auth import get_user_model
 from django.http import (
     Http404,
-    HttpResponse,
     HttpResponseForbidden,
     HttpResponseRedirect,
     JsonResponse,
+    StreamingHttpResponse,
 )
 from django.shortcuts import get_object_or_404, redirect, render
 from django.template.loader import render_to_string
 from django.utils.decorators import method_decorator
 from django.views.decorators.http import require_POST
 from django.views.generic import FormView, ListView, TemplateView
-from django.views.generic.edit import CreateView
 from django.views.generic.detail import DetailView
+from django.views.generic.edit import CreateView
 
 from account.decorators import login_required
 from account.mixins import LoginRequiredMixin
 from account.views import SignupView
+from pinax.invitations.models import NotEnoughInvitationsError
 
+from .conf import settings
 from .decorators import manager_required, team_required
-from .forms import TeamForm, TeamInviteUserForm, TeamSignupForm
+from .forms import (
+    TeamBulkInviteForm,
+    TeamForm,
+    TeamInviteUserForm,
+    TeamSignupForm,
+)
 from .hooks import hookset
 from .models import Membership, Team
+from .roster import EXPORT_FORMATS, export_roster
+from .search import autocomplete_results
+from .utils import team_list_context, team_list_queryset
 
 MESSAGE_STRINGS = hookset.get_message_strings()
 
@@ -60,11 +67,26 @@ class TeamCreateView(LoginRequiredMixin, CreateView):
 
 
 class TeamListView(ListView):
+    """
+    Teams newest first, a page at a time, with keyset pagination on
+    (created, id) so that every page costs the same. Accepts q to search
+    name, slug and description, access to filter by member access, and the
+    cursor of the next page given in the context as next_cursor.
+    """
 
     model = Team
     context_object_name = "teams"
     template_name = "pinax/teams/team_list.html"
 
+    def get_queryset(self):
+        return team_list_queryset(self.request.GET)
+
+    def get_context_data(self, **kwargs):
+        page_size = settings.PINAX_TEAMS_TEAM_LIST_PAGE_SIZE
+        context = team_list_context(self.request.GET, list(self.object_list[:page_size + 1]))
+        context.update(kwargs)
+        return super().get_context_data(**context)
+
 
 class TeamDetailView(DetailView):
     model = Team
@@ -74,14 +96,15 @@ class TeamDetailView(DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         team = self.object
-        user = self.request.user
+        snapshot = team.snapshot_for(self.request.user)
         context.update({
-            "state": team.state_for(user),
-            "role": team.role_for(user),
+            "team_membership": snapshot,
+            "state": snapshot.state,
+            "role": snapshot.role,
             "invite_form": TeamInviteUserForm(team=team),
-            "can_join": team.can_join(user),
-            "can_leave": team.can_leave(user),
-            "can_apply": team.can_apply(user),
+            "can_join": snapshot.can_join,
+            "can_leave": snapshot.can_leave,
+            "can_apply": snapshot.can_apply,
         })
         return context
 
@@ -109,18 +132,21 @@ class TeamManageView(TemplateView):
     @method_decorator(manager_required)
     def dispatch(self, *args, **kwargs):
         self.team = self.request.team
-        self.role = self.team.role_for(self.request.user)
+        self.snapshot = self.request.team_membership.resolve()
+        self.role = self.snapshot.role
         return super().dispatch(*args, **kwargs)
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         ctx.update({
             "team": self.team,
+            "team_membership": self.snapshot,
             "role": self.role,
+            "roster": self.team.load_roster(),
             "invite_form": self.get_team_invite_form(),
-            "can_join": self.team.can_join(self.request.user),
-            "can_leave": self.team.can_leave(self.request.user),
-            "can_apply": self.team.can_apply(self.request.user),
+            "can_join": self.snapshot.can_join,
+            "can_leave": self.snapshot.can_leave,
+            "can_apply": self.snapshot.can_apply,
         })
         return ctx
 
@@ -132,18 +158,15 @@ class TeamManageView(TemplateView):
 @login_required
 def team_join(request):
     team = request.team
-    state = team.state_for(request.user)
-
-    if team.manager_access == Team.MEMBER_ACCESS_INVITATION and \
-       state is None and not request.user.is_staff:
+    if not request.team_membership.can_view:
         raise Http404()
 
-    if team.can_join(request.user) and request.method == "POST":
-        membership, created = Membership.objects.get_or_create(team=team, user=request.user)
-        membership.role = Membership.ROLE_MEMBER
-        membership.state = Membership.STATE_AUTO_JOINED
-        membership.save()
-        messages.success(request, MESSAGE_STRINGS["joined-team"])
+    if request.team_membership.can_join and request.method == "POST":
+        membership = team.join(request.user)
+        if membership.state == Membership.STATE_WAITLISTED:
+            messages.success(request, MESSAGE_STRINGS["joined-waitlist"])
+        else:
+            messages.success(request, MESSAGE_STRINGS["joined-team"])
     return redirect(team.get_absolute_url())
 
 
@@ -151,14 +174,11 @@ def team_join(request):
 @login_required
 def team_leave(request):
     team = request.team
-    state = team.state_for(request.user)
-    if team.manager_access == Team.MEMBER_ACCESS_INVITATION and \
-       state is None and not request.user.is_staff:
+    if not request.team_membership.can_view:
         raise Http404()
 
-    if team.can_leave(request.user) and request.method == "POST":
-        membership = Membership.objects.get(team=team, user=request.user)
-        membership.delete()
+    if request.team_membership.can_leave and request.method == "POST":
+        request.team_membership.membership.leave()
         messages.success(request, MESSAGE_STRINGS["left-team"])
         return redirect("pinax_teams:dashboard")
     else:
@@ -169,15 +189,11 @@ def team_leave(request):
 @login_required
 def team_apply(request):
     team = request.team
-    state = team.state_for(request.user)
-    if team.manager_access == Team.MEMBER_ACCESS_INVITATION and \
-       state is None and not request.user.is_staff:
+    if not request.team_membership.can_view:
         raise Http404()
 
-    if team.can_apply(request.user) and request.method == "POST":
-        membership, created = Membership.objects.get_or_create(team=team, user=request.user)
-        membership.state = Membership.STATE_APPLIED
-        membership.save()
+    if request.team_membership.can_apply and request.method == "POST":
+        team.apply(request.user)
         messages.success(request, MESSAGE_STRINGS["applied-to-join"])
     return redirect(team.get_absolute_url())
 
@@ -285,6 +301,49 @@ class TeamInviteView(FormView):
         return JsonResponse(context)
 
 
+class TeamBulkInviteView(FormView):
+    http_method_names = ["post"]
+    form_class = TeamBulkInviteForm
+
+    @method_decorator(manager_required)
+    def dispatch(self, *args, **kwargs):
+        self.team = self.request.team
+        return super().dispatch(*args, **kwargs)
+
+    def get_form_kwargs(self):
+        form_kwargs = super().get_form_kwargs()
+        form_kwargs.update({"team": self.team})
+        return form_kwargs
+
+    def form_valid(self, form):
+        try:
+            results = form.save(self.request.user)
+        except NotEnoughInvitationsError:
+            form.add_error(None, MESSAGE_STRINGS["not-enough-invitations"])
+            return self.form_invalid(form)
+        return JsonResponse({"results": results})
+
+    def form_invalid(self, form):
+        return JsonResponse({"errors": form.errors.get_json_data()}, status=400)
+
+
+@manager_required
+def team_export(request):
+    """
+    Streams the team's memberships as CSV or, with format=ndjson, as
+    newline-delimited JSON
+    """
+    export_format = request.GET.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        raise Http404()
+    response = StreamingHttpResponse(
+        export_roster(request.team, export_format, settings.PINAX_TEAMS_EXPORT_CHUNK_SIZE),
+        content_type=EXPORT_FORMATS[export_format]
+    )
+    response["Content-Disposition"] = f'attachment; filename="{request.team.slug}-roster.{export_format}"'
+    return response
+
+
 @manager_required
 @require_POST
 def team_member_revoke_invite(request, pk):
@@ -330,16 +389,8 @@ def team_member_remove(request, pk):
     return redirect(membership.team.get_absolute_url())
 
 
-@team_required
-@login_required
+@manager_required
 def autocomplete_users(request):
-    if "q" in request.GET:
-        users = get_user_model().objects.filter(
-            username__icontains=request.GET["q"]
-        ).exclude(
-            username=request.user.username
-        )
-        return JsonResponse({
-            "users": [{"username": u.username} for u in users]
-        })
-    return JsonResponse({"users": []})
+    return JsonResponse({
+        "users": autocomplete_results(request.GET.get("q", ""), request.team, request.user)
+    })
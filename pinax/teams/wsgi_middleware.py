@@ -1,6 +1,6 @@
 # @@@ separate wsgi middlewares from django middlewares
 # to avoid app loading errors
-import re
+from .routing import match_team_path
 
 
 class WSGITeamMiddleware():
@@ -9,9 +9,7 @@ class WSGITeamMiddleware():
         self.app = application
 
     def __call__(self, environ, start_repsonse):
-        m = re.match(r"(/teams/([\w-]+))(.*)", environ["PATH_INFO"])
+        m = match_team_path(environ["PATH_INFO"])
         if m:
-            environ["SCRIPT_NAME"] = m.group(1)
-            environ["PATH_INFO"] = m.group(3)
-            environ["pinax.team"] = m.group(2)
+            environ["SCRIPT_NAME"], environ["pinax.team"], environ["PATH_INFO"] = m
         return self.app(environ, start_repsonse)
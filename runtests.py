@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import os
 import sys
+import tempfile
 
 import django
 
@@ -14,7 +15,11 @@ DEFAULT_SETTINGS = dict(
     DATABASES = {
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
-            "NAME": ":memory:"
+            "NAME": ":memory:",
+            # a file, so threaded tests get connections that queue for the lock
+            "TEST": {
+                "NAME": os.path.join(tempfile.gettempdir(), "pinax-teams-tests-%d.sqlite3" % os.getpid()),
+            },
         }
     },
     MIDDLEWARE = [
@@ -31,6 +36,7 @@ DEFAULT_SETTINGS = dict(
 
         "account",
         "pinax.invitations",
+        "reversion",
         "pinax.templates",
         "pinax.teams",
         "pinax.teams.tests",